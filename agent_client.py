@@ -1,5 +1,10 @@
 import os
+import asyncio
 import json
+import re
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from agents import (
     Agent,
     Runner,
@@ -10,21 +15,125 @@ from agents import (
 )
 from agents.mcp import MCPServerSse
 
+import memory_index
+import usage_ledger
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "<YOUR_OPENAI_API_KEY>")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5.1")
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8888/sse")
+# Replies that may carry media are requested as AgentReply structured output
+STRUCTURED_OUTPUT = os.getenv("AGENT_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+# Background lane (pre-generated content): optional cheaper model and service tier
+BACKGROUND_MODEL = os.getenv("BACKGROUND_MODEL", "")
+BACKGROUND_SERVICE_TIER = os.getenv("BACKGROUND_SERVICE_TIER", "")  # e.g. "flex"
+BACKGROUND_IDLE_POLL = 0.5  # Seconds between checks for interactive calls in flight
 
 HISTORY_DIR = "chat_history"
 MAX_HISTORY = 20  # Keep last N messages (user + assistant) per chat
 
 openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 set_default_openai_client(openai_client)
+memory_index.configure(openai_client)
 
 
 _agent: Agent | None = None
 _mcp_server: MCPServerSse | None = None
 _system_history: list[dict] = []
 _histories: dict[int, list[dict]] = {}  # chat_id -> last N user messages
+_inflight = 0  # interactive ask_agent calls running
+_background_slot: asyncio.Semaphore | None = None
+
+
+class AgentReply(BaseModel):
+    """A reply split into the text to post and the media or command to attach."""
+
+    text: str = Field(
+        description="Message to post in the chat. When image is set this is its caption."
+    )
+    image: str | None = Field(
+        description="Image to send as a photo: a media:<sha256>.<ext> handle or an image URL "
+        "returned by a tool, otherwise null."
+    )
+    voice: str | None = Field(
+        description="Voice clip to send: a media:<sha256>.<ext> handle returned by "
+        "generate_voice, otherwise null."
+    )
+    command: Literal["/fact", "/meme"] | None = Field(
+        description="/fact to post a fact of the day or /meme to post a meme, otherwise null."
+    )
+
+
+_json_decoder = json.JSONDecoder()
+_HANDLE_RE = re.compile(r"media:[0-9a-f]{64}\.([a-z0-9]{2,5})\b")
+_IMAGE_URL_RE = re.compile(r"https?://\S+?\.(?:jpe?g|png|gif)(?:\?\S*)?(?=[\s)\"',]|$)", re.I)
+_AUDIO_EXTENSIONS = ("ogg", "oga", "opus", "mp3", "m4a", "wav")
+
+
+def _json_payload(text: str) -> tuple[object, str]:
+    """Return the first JSON value in ``text`` and the text following it."""
+    if text.startswith('"'):
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return None, ""
+        return _json_payload(value.strip()) if isinstance(value, str) else (None, "")
+    start = text.find("{")
+    if start < 0:
+        return None, ""
+    try:
+        value, end = _json_decoder.raw_decode(text, start)
+    except ValueError:
+        return None, ""
+    if isinstance(value, dict) and value.get("type") == "text" and isinstance(value.get("text"), str):
+        inner, _ = _json_payload(value["text"].strip())
+        if isinstance(inner, dict):
+            value = inner
+    return value, text[end:].strip()
+
+
+def parse_reply(reply: "str | AgentReply") -> AgentReply:
+    """Convert a plain-text agent reply into an :class:`AgentReply` in one pass.
+
+    Understands the formats replies used before structured output: a JSON
+    object (possibly wrapped in a JSON string or a ``{"type": "text"}``
+    block) with ``image``/``image_url``/``url``, ``voice``/``voice_url``,
+    ``command`` and ``caption`` keys, whose trailing text is the caption
+    when ``caption`` is missing; a media handle in the text; or a bare image
+    URL. Anything else is plain text. No I/O is done here.
+    """
+    if isinstance(reply, AgentReply):
+        return reply
+    text = reply.strip()
+    payload, trailing = _json_payload(text)
+    if isinstance(payload, dict):
+        caption = str(payload.get("caption", "")) or trailing
+        url = payload.get("image_url") or payload.get("url")
+        image = payload.get("image") or url
+        voice = payload.get("voice") or payload.get("voice_url")
+        if not voice and isinstance(url, str) and url.split("?")[0].lower().endswith(_AUDIO_EXTENSIONS):
+            voice, image = url, payload.get("image")
+        command = payload.get("command")
+        command = command if command in ("/fact", "/meme") else None
+        if image or voice or command:
+            return AgentReply(
+                text=caption,
+                image=str(image) if image else None,
+                voice=str(voice) if voice else None,
+                command=command,
+            )
+        return AgentReply(text=text, image=None, voice=None, command=None)
+
+    m = _HANDLE_RE.search(text)
+    if m and m.group(1) in _AUDIO_EXTENSIONS:
+        rest = " ".join(part for part in (text[: m.start()].strip(), text[m.end() :].strip()) if part)
+        return AgentReply(text=rest, image=None, voice=m.group(0), command=None)
+    if m:
+        return AgentReply(text=text[m.end() :].strip(), image=m.group(0), voice=None, command=None)
+    if "{" not in text:
+        url = _IMAGE_URL_RE.search(text)
+        if url:
+            return AgentReply(text=text[url.end() :].strip(), image=url.group(0), voice=None, command=None)
+    return AgentReply(text=text, image=None, voice=None, command=None)
 
 
 def _normalize_history(history: list[dict]) -> list[dict]:
@@ -73,6 +182,34 @@ def _normalize_history(history: list[dict]) -> list[dict]:
     return normalized
 
 
+def _message_text(msg: dict) -> str:
+    content = msg.get("content")
+    if isinstance(content, list):
+        return " ".join(
+            item.get("text", "") for item in content
+            if isinstance(item, dict) and item.get("type") != "input_image"
+        ).strip()
+    return str(content or "")
+
+
+async def _recall_memory(chat_id: int, contents: list[dict], history: list[dict]) -> list[dict]:
+    """Return a system message quoting earlier messages relevant to ``contents``."""
+    if not memory_index.enabled():
+        return []
+    query = "\n".join(_message_text(m) for m in contents if m.get("role") == "user")
+    try:
+        snippets = await memory_index.recall(
+            chat_id, query, exclude=[_message_text(m) for m in history]
+        )
+    except Exception as e:
+        print(f"[memory] Recall failed for chat {chat_id}: {e}")
+        return []
+    if not snippets:
+        return []
+    text = "Earlier messages in this chat that may be relevant:\n" + "\n".join(snippets)
+    return [{"role": "system", "content": text}]
+
+
 async def create_thread_with_system_prompt(
     system_prompt: str, bot_name: str | None = None
 ) -> None:
@@ -92,30 +229,80 @@ async def create_thread_with_system_prompt(
     _system_history = [{"role": "system", "content": system_prompt}]
 
 
-async def ask_agent(contents: list[dict], chat_id: int, *, tool_choice: str | None = None) -> str:
+def _record_run(chat_id: int | None, request_class: str, model: str, result) -> None:
+    """Record a run's token usage and the text generate_voice synthesized.
+
+    Clips served from the voice cache report ``synthesized: false`` in their
+    tool output and are not counted.
+    """
+    usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+    usage_ledger.record_usage(chat_id, request_class, model, usage)
+    items = getattr(result, "new_items", None)
+    voice_calls = {}  # call id -> characters sent to generate_voice
+    tts_chars = 0
+    for item in items if isinstance(items, list) else []:
+        raw = getattr(item, "raw_item", None)
+        kind = getattr(item, "type", None)
+        if kind == "tool_call_item" and getattr(raw, "name", None) == "generate_voice":
+            try:
+                voice_calls[raw.call_id] = len(json.loads(raw.arguments).get("text", ""))
+            except (ValueError, TypeError, AttributeError):
+                pass
+        elif kind == "tool_call_output_item" and isinstance(raw, dict) and raw.get("call_id") in voice_calls:
+            try:
+                meta = json.loads(str(item.output)).get("meta") or {}
+            except (ValueError, AttributeError):
+                meta = {}
+            if meta.get("synthesized", True):
+                tts_chars += voice_calls[raw["call_id"]]
+    if tts_chars:
+        usage_ledger.record(chat_id, request_class, tts_chars=tts_chars)
+
+
+async def ask_agent(
+    contents: list[dict],
+    chat_id: int,
+    *,
+    tool_choice: str | None = None,
+    structured: bool = False,
+    request_class: str = "reply",
+) -> "str | AgentReply":
     """Send message contents to the agent and return its reply.
 
     History is simple: system prompt + last MAX_HISTORY user messages + new contents.
-    Only user messages from contents are stored in history.
+    Only user messages from contents are stored in history. With ``structured``
+    the reply is an :class:`AgentReply`; it comes from the model as structured
+    output, or from :func:`parse_reply` when STRUCTURED_OUTPUT is off. Usage is
+    recorded under ``request_class``; chats over their soft budget are answered
+    by USAGE_DOWNGRADE_MODEL.
     """
     if _agent is None:
         raise RuntimeError("Agent not initialized")
 
-    # Store user messages from contents into history (skip images - file IDs expire)
+    # Store user messages from contents into history
     history = _histories.get(chat_id, [])
+    with_images = {}  # id(stored message) -> message as sent, images included
     for msg in contents:
         if msg.get("role") == "user":
             content = msg.get("content")
-            # Skip messages containing input_image (file IDs expire on OpenAI)
+            # Images are stored by their text parts only (file IDs expire on
+            # OpenAI); photo messages carry a cached description for this
             if isinstance(content, list) and any(
                 isinstance(item, dict) and item.get("type") == "input_image"
                 for item in content
             ):
-                continue
+                text_parts = [
+                    item for item in content
+                    if isinstance(item, dict) and item.get("type") != "input_image"
+                ]
+                stored = {**msg, "content": text_parts or "[photo]"}
+                with_images[id(stored)] = msg
+                msg = stored
             history.append(msg)
 
-    # Build API input: system prompt + history + non-user hints from contents
-    api_history = list(_system_history) + history
+    # Build API input: system prompt + recalled memory + history + non-user hints
+    memory = await _recall_memory(chat_id, contents, history)
+    api_history = list(_system_history) + memory + [with_images.get(id(m), m) for m in history]
     for msg in contents:
         if msg.get("role") != "user" and msg not in api_history:
             api_history.append(msg)
@@ -123,22 +310,87 @@ async def ask_agent(contents: list[dict], chat_id: int, *, tool_choice: str | No
     api_history = _normalize_history(api_history)
     print(f"[ask_agent] Chat {chat_id}: sending {len(api_history)} messages")
 
+    model = OPENAI_MODEL
     run_cfg = None
-    if tool_choice:
-        run_cfg = RunConfig(model_settings=ModelSettings(tool_choice=tool_choice))
-    result = await Runner.run(_agent, api_history, run_config=run_cfg)
-
-    reply = str(result.final_output)
+    downgrade = usage_ledger.budget_state(chat_id) != "ok"
+    if downgrade:
+        model = usage_ledger.USAGE_DOWNGRADE_MODEL
+        print(f"[ask_agent] Chat {chat_id} is over budget, using {model}")
+    if tool_choice or downgrade:
+        run_cfg = RunConfig(
+            model=model if downgrade else None,
+            model_settings=ModelSettings(tool_choice=tool_choice) if tool_choice else None,
+        )
+    agent = _agent
+    if structured and STRUCTURED_OUTPUT:
+        agent = _agent.clone(output_type=AgentReply)
+    global _inflight
+    _inflight += 1
+    try:
+        result = await Runner.run(agent, api_history, run_config=run_cfg)
+    finally:
+        _inflight -= 1
+    _record_run(chat_id, request_class, model, result)
+
+    output = result.final_output
+    reply = output.text if isinstance(output, AgentReply) else str(output)
 
     # Store assistant response in history so model knows what it already said
     history.append({"role": "assistant", "content": reply})
+    memory_index.remember_later(
+        chat_id, [_message_text(m) for m in contents if m.get("role") == "user"] + [reply]
+    )
 
     # Trim history to last MAX_HISTORY messages
     _histories[chat_id] = history[-MAX_HISTORY:]
 
+    if structured:
+        return output if isinstance(output, AgentReply) else parse_reply(reply)
     return reply
 
 
+async def ask_detached(
+    contents: list[dict],
+    *,
+    structured: bool = False,
+    chat_id: int | None = None,
+    request_class: str = "background",
+) -> "str | AgentReply":
+    """Run the agent on ``contents`` in the background lane, outside any chat.
+
+    No history is read or written; ``chat_id`` only attributes the usage.
+    Calls run one at a time and only start while no interactive
+    :func:`ask_agent` call is in flight, so they never compete with replies
+    to users. BACKGROUND_MODEL and BACKGROUND_SERVICE_TIER can make them
+    cheaper.
+    """
+    global _background_slot
+    if _agent is None:
+        raise RuntimeError("Agent not initialized")
+    if _background_slot is None:
+        _background_slot = asyncio.Semaphore(1)
+
+    async with _background_slot:
+        while _inflight:
+            await asyncio.sleep(BACKGROUND_IDLE_POLL)
+        agent = _agent
+        if structured and STRUCTURED_OUTPUT:
+            agent = _agent.clone(output_type=AgentReply)
+        extra = {"service_tier": BACKGROUND_SERVICE_TIER} if BACKGROUND_SERVICE_TIER else None
+        run_cfg = RunConfig(
+            model=BACKGROUND_MODEL or None,
+            model_settings=ModelSettings(extra_args=extra),
+        )
+        api_input = _normalize_history(list(_system_history) + list(contents))
+        result = await Runner.run(agent, api_input, run_config=run_cfg)
+    _record_run(chat_id, request_class, BACKGROUND_MODEL or OPENAI_MODEL, result)
+
+    output = result.final_output
+    if structured:
+        return output if isinstance(output, AgentReply) else parse_reply(str(output))
+    return output.text if isinstance(output, AgentReply) else str(output)
+
+
 # === History Management ===
 
 
@@ -164,11 +416,20 @@ def save_histories_to_disk() -> None:
     print(f"[save_histories] Saved {len(_histories)} chats")
 
 
+def record_reply(chat_id: int, text: str) -> None:
+    """Add a reply generated outside :func:`ask_agent` to the chat history."""
+    history = _histories.get(chat_id, [])
+    history.append({"role": "assistant", "content": text})
+    _histories[chat_id] = history[-MAX_HISTORY:]
+    memory_index.remember_later(chat_id, [text])
+
+
 def inject_external_message(chat_id: int, username: str, text: str) -> None:
     """Add another bot's message into chat history as a user message."""
     history = _histories.get(chat_id, [])
     history.append({"role": "user", "content": f"{username}: {text}"})
     _histories[chat_id] = history[-MAX_HISTORY:]
+    memory_index.remember_later(chat_id, [f"{username}: {text}"])
 
 
 def load_histories_from_disk() -> None:
@@ -95,6 +95,61 @@ def last_message_time(chat_id: int) -> float | None:
     return None
 
 
+def reply_counts(chat_id: int, since: float) -> dict[str, int]:
+    """Return how many bus messages each bot posted in ``chat_id`` since ``since``."""
+    counts: dict[str, int] = {}
+    try:
+        with open(_bus_path(chat_id), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return counts
+    for line in lines:
+        try:
+            msg = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if msg.get("bot") and msg.get("ts", 0) >= since:
+            counts[msg["bot"]] = counts.get(msg["bot"], 0) + 1
+    return counts
+
+
+def _members_dir(chat_id: int) -> str:
+    return os.path.join(BOT_BUS_DIR, "members", str(chat_id))
+
+
+def mark_seen(chat_id: int, bot_username: str) -> None:
+    """Record that ``bot_username`` is present in ``chat_id``, even if silent.
+
+    Each bot has an empty marker file whose mtime is the last time it saw a
+    message in the chat.
+    """
+    path = os.path.join(_members_dir(chat_id), bot_username)
+    try:
+        os.makedirs(_members_dir(chat_id), exist_ok=True)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def members(chat_id: int, since: float) -> list[str]:
+    """Return the bots marked as seen in ``chat_id`` since ``since``."""
+    directory = _members_dir(chat_id)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    seen = []
+    for name in names:
+        try:
+            if os.path.getmtime(os.path.join(directory, name)) >= since:
+                seen.append(name)
+        except OSError:
+            continue
+    return sorted(seen)
+
+
 def trim(chat_id: int, max_lines: int = 200) -> None:
     """Keep only the last ``max_lines`` lines in the bus file."""
     path = _bus_path(chat_id)
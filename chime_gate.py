@@ -0,0 +1,201 @@
+"""Local relevance gate for unmentioned chime-ins.
+
+Before a bot pays for an LLM call to react to a message nobody addressed to
+it, :func:`allow` scores the message with a tiny logistic model over cheap
+keyword, length and question features. Short acknowledgements ("ok", "+",
+"))") score low and are skipped; greetings and questions pass. Scoring is a
+few regexes and one NumPy dot product, so it runs in microseconds.
+
+Weights default to hand-set values and can be replaced by a model trained
+offline from the persisted chat histories::
+
+    python chime_gate.py train chat_history chime_gate.npz
+
+Set CHIME_GATE_WEIGHTS to the trained file, or plug in any scorer with
+:func:`set_scorer`. :func:`stats` reports how many LLM calls were avoided.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+from typing import Callable, Sequence
+
+import numpy as np
+
+CHIME_GATE_THRESHOLD = float(os.getenv("CHIME_GATE_THRESHOLD", "0.5"))  # 0 disables the gate
+CHIME_GATE_WEIGHTS = os.getenv("CHIME_GATE_WEIGHTS", "chime_gate.npz")
+
+FEATURES = (
+    "bias",
+    "chars",  # log1p of the text length
+    "words",  # log1p of the word count
+    "question",
+    "greeting",
+    "ack",  # nothing but acknowledgements, laughter, emoji or punctuation
+    "link",
+    "exclaim",
+    "addressed",  # speaks to "you" or about bots
+    "since_bot",  # log1p of user messages since this bot last replied
+)
+DEFAULT_WEIGHTS = np.array(
+    [-1.0, 0.3, 0.3, 1.5, 2.5, -3.0, 0.5, 0.3, 1.0, 0.8], dtype=np.float32
+)
+
+_QUESTION_RE = re.compile(
+    r"\?|^(что|как|почему|зачем|кто|где|когда|какой|какая|сколько|"
+    r"what|why|how|who|where|when|which|is|are|do|does|can)\b",
+    re.IGNORECASE,
+)
+_GREETING_RE = re.compile(
+    r"\b(привет\w*|здравствуй\w*|добр\w+ (утро|день|вечер)|hello|hi|hey|morning|yo)\b",
+    re.IGNORECASE,
+)
+_ACK_WORDS = {
+    "ok", "okay", "k", "kk", "ок", "окей", "ага", "угу", "да", "нет", "ну", "норм",
+    "ясно", "понятно", "yes", "no", "yep", "nope", "lol", "лол", "ха", "хаха",
+    "ахах", "ахаха", "thx", "thanks", "спс", "спасибо", "+", "++", "))", ")))",
+}
+_WORD_RE = re.compile(r"\w+|[^\w\s]+")
+_LINK_RE = re.compile(r"https?://", re.IGNORECASE)
+_ADDRESSED_RE = re.compile(r"\b(ты|вы|тебе|вам|бот\w*|you|your|bots?)\b", re.IGNORECASE)
+
+_weights = DEFAULT_WEIGHTS
+_scorer: Callable[[np.ndarray], np.ndarray] | None = None
+_stats = {"scored": 0, "avoided": 0}
+
+
+def features(texts: Sequence[str], since_bot: Sequence[int] | int = 0) -> np.ndarray:
+    """Return the ``(len(texts), len(FEATURES))`` feature matrix for ``texts``."""
+    since = np.broadcast_to(np.asarray(since_bot, dtype=np.float32), (len(texts),))
+    rows = np.zeros((len(texts), len(FEATURES)), dtype=np.float32)
+    rows[:, 0] = 1.0
+    for i, text in enumerate(texts):
+        text = (text or "").strip()
+        tokens = _WORD_RE.findall(text.lower())
+        rows[i, 1] = len(text)
+        rows[i, 2] = len(tokens)
+        rows[i, 3] = bool(_QUESTION_RE.search(text))
+        rows[i, 4] = bool(_GREETING_RE.search(text))
+        rows[i, 5] = all(t in _ACK_WORDS or not t.isalnum() for t in tokens)
+        rows[i, 6] = bool(_LINK_RE.search(text))
+        rows[i, 7] = "!" in text
+        rows[i, 8] = bool(_ADDRESSED_RE.search(text))
+    rows[:, 1:3] = np.log1p(rows[:, 1:3])
+    rows[:, 9] = np.log1p(since)
+    return rows
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def score(texts: Sequence[str], since_bot: Sequence[int] | int = 0) -> np.ndarray:
+    """Return the probability that each message is worth a chime-in."""
+    x = features(texts, since_bot)
+    if _scorer is not None:
+        return np.asarray(_scorer(x), dtype=np.float32)
+    return _sigmoid(x @ _weights)
+
+
+def allow(text: str, since_bot: int = 0) -> bool:
+    """Return whether an unmentioned ``text`` is worth an LLM call."""
+    if CHIME_GATE_THRESHOLD <= 0:
+        return True
+    _stats["scored"] += 1
+    if float(score([text], since_bot)[0]) >= CHIME_GATE_THRESHOLD:
+        return True
+    _stats["avoided"] += 1
+    return False
+
+
+def stats() -> dict[str, int]:
+    return dict(_stats)
+
+
+def set_scorer(scorer: Callable[[np.ndarray], np.ndarray] | None) -> None:
+    """Score feature matrices with ``scorer`` instead of the logistic weights."""
+    global _scorer
+    _scorer = scorer
+
+
+def load_weights(path: str = CHIME_GATE_WEIGHTS) -> bool:
+    """Use weights saved by :func:`train`; return False if ``path`` is unusable."""
+    global _weights
+    try:
+        with np.load(path) as data:
+            weights = data["weights"].astype(np.float32)
+            names = tuple(str(n) for n in data["features"])
+    except (OSError, KeyError, ValueError):
+        return False
+    if names != FEATURES:
+        logging.warning(f"[chime_gate] {path} was trained on other features, ignoring it")
+        return False
+    _weights = weights
+    logging.info(f"[chime_gate] Loaded weights from {path}")
+    return True
+
+
+def _strip_sender(content: str) -> str:
+    name, sep, text = content.partition(": ")
+    return text if sep and " " not in name else content
+
+
+def training_set(history_dir: str) -> tuple[np.ndarray, np.ndarray]:
+    """Build features and labels from the chat histories saved in ``history_dir``.
+
+    A user message is labelled 1 when the bot answered it (the next entry is
+    an assistant message) and 0 otherwise. These are weak labels: they
+    reflect what the bot used to do, mentions included.
+    """
+    texts, since, labels = [], [], []
+    for filename in sorted(os.listdir(history_dir)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(history_dir, filename), "r", encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            continue
+        count = 0
+        for entry, following in zip(history, history[1:] + [None]):
+            if not isinstance(entry, dict) or entry.get("role") != "user":
+                count = 0
+                continue
+            texts.append(_strip_sender(str(entry.get("content", ""))))
+            since.append(count)
+            labels.append(bool(following) and following.get("role") == "assistant")
+            count += 1
+    return features(texts, since), np.asarray(labels, dtype=np.float32)
+
+
+def train(
+    x: np.ndarray, y: np.ndarray, *, epochs: int = 500, lr: float = 0.1, l2: float = 1e-3
+) -> np.ndarray:
+    """Fit logistic regression weights by batch gradient descent."""
+    weights = DEFAULT_WEIGHTS.copy()
+    for _ in range(epochs):
+        error = _sigmoid(x @ weights) - y
+        gradient = x.T @ error / len(y) + l2 * weights
+        weights -= lr * gradient.astype(np.float32)
+    return weights
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) != 4 or argv[1] != "train":
+        print("usage: python chime_gate.py train <history_dir> <weights.npz>")
+        return 2
+    x, y = training_set(argv[2])
+    if not len(y):
+        print(f"No user messages found in {argv[2]}")
+        return 1
+    weights = train(x, y)
+    np.savez(argv[3], weights=weights, features=np.array(FEATURES))
+    accuracy = float(((_sigmoid(x @ weights) >= 0.5) == (y == 1)).mean())
+    print(f"Trained on {len(y)} messages ({int(y.sum())} answered), accuracy {accuracy:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
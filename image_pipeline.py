@@ -0,0 +1,146 @@
+"""Image re-encoding and downscaling off the event loop.
+
+Generated images arrive as large PNGs and incoming photos are often bigger
+than the vision model ever looks at. :func:`encode_for_telegram` re-encodes
+images to JPEG or WebP under IMAGE_OUTPUT_MAX_KB, and :func:`downscale_for_vision`
+shrinks photos to the resolution the vision model actually uses. Both run in
+a thread pool (Pillow releases the GIL while decoding, resizing and
+encoding) and record bytes saved and time spent per stage, see :func:`stats`.
+
+Pillow is optional (``pip install telebot[images]``); without it images are
+passed through unchanged.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - exercised only without Pillow
+    Image = None
+
+IMAGE_PIPELINE_WORKERS = int(os.getenv("IMAGE_PIPELINE_WORKERS", "2"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg").lower()  # jpeg | webp
+IMAGE_OUTPUT_MAX_BYTES = int(os.getenv("IMAGE_OUTPUT_MAX_KB", "400")) * 1024
+IMAGE_OUTPUT_QUALITIES = (90, 80, 70, 60, 50)
+VISION_JPEG_QUALITY = 85
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PIPELINE_WORKERS, thread_name_prefix="image")
+_stats: dict[str, dict[str, int]] = {}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def _record(stage: str, bytes_in: int, bytes_out: int, elapsed_ms: int) -> None:
+    entry = _stats.setdefault(stage, {"images": 0, "bytes_in": 0, "bytes_out": 0, "ms": 0})
+    entry["images"] += 1
+    entry["bytes_in"] += bytes_in
+    entry["bytes_out"] += bytes_out
+    entry["ms"] += elapsed_ms
+    logging.info(
+        "[image_pipeline] %s: %d -> %d bytes in %d ms", stage, bytes_in, bytes_out, elapsed_ms
+    )
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """Return per-stage counters including the total bytes saved."""
+    return {
+        stage: {**entry, "bytes_saved": entry["bytes_in"] - entry["bytes_out"]}
+        for stage, entry in _stats.items()
+    }
+
+
+def _open_rgb(data: bytes):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    out = io.BytesIO()
+    if fmt == "webp":
+        image.save(out, "WEBP", quality=quality, method=4)
+    else:
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _encode_for_telegram(data: bytes, fmt: str, max_bytes: int) -> tuple[bytes, str]:
+    image = _open_rgb(data)
+    for quality in IMAGE_OUTPUT_QUALITIES:
+        encoded = _encode(image, fmt, quality)
+        if len(encoded) <= max_bytes:
+            break
+    return encoded, "webp" if fmt == "webp" else "jpg"
+
+
+def _vision_scale(width: int, height: int, detail: str) -> float:
+    """Scale factor the vision model would apply before looking at the image.
+
+    Low detail sees a 512 px image; high detail fits the image into 2048 px
+    and then scales the shorter side to 768 px.
+    """
+    if detail == "low":
+        return min(1.0, 512 / max(width, height))
+    return min(1.0, 2048 / max(width, height), 768 / min(width, height))
+
+
+def _downscale_for_vision(data: bytes, detail: str) -> bytes:
+    image = Image.open(io.BytesIO(data))
+    scale = _vision_scale(image.width, image.height, detail)
+    if scale >= 1.0:
+        return data
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image = _open_rgb(data).resize(size, Image.LANCZOS)
+    return _encode(image, "jpeg", VISION_JPEG_QUALITY)
+
+
+async def _run(stage: str, func, data: bytes, *args):
+    started = time.monotonic()
+    result = await asyncio.get_running_loop().run_in_executor(_executor, func, data, *args)
+    out = result[0] if isinstance(result, tuple) else result
+    _record(stage, len(data), len(out), int((time.monotonic() - started) * 1000))
+    return result
+
+
+async def encode_for_telegram(data: bytes, ext: str = "png") -> tuple[bytes, str]:
+    """Re-encode an image for sending; returns ``(bytes, extension)``.
+
+    The original is kept if Pillow is missing, decoding fails, or the
+    re-encoded image is not smaller.
+    """
+    if Image is None:
+        return data, ext
+    try:
+        encoded, new_ext = await _run(
+            "telegram", _encode_for_telegram, data, IMAGE_OUTPUT_FORMAT, IMAGE_OUTPUT_MAX_BYTES
+        )
+    except Exception as e:
+        logging.warning(f"[image_pipeline] Re-encoding failed, sending original: {e}")
+        return data, ext
+    if len(encoded) >= len(data):
+        return data, ext
+    return encoded, new_ext
+
+
+async def downscale_for_vision(data: bytes, detail: str = "high") -> bytes:
+    """Shrink ``data`` to the resolution the vision model uses at ``detail``."""
+    if Image is None:
+        return data
+    try:
+        scaled = await _run("vision", _downscale_for_vision, data, detail)
+    except Exception as e:
+        logging.warning(f"[image_pipeline] Downscaling failed, sending original: {e}")
+        return data
+    return scaled if len(scaled) < len(data) else data
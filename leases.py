@@ -0,0 +1,125 @@
+"""File-based leases so only one co-located bot acts on a shared decision.
+
+Each lease is a JSON file in LEASE_DIR holding the current owner and its
+expiry, read and rewritten under an exclusive ``flock``. The owner keeps the
+lease alive with :func:`keep_alive` and gives it up with :func:`release`;
+a lease whose owner crashed simply expires.
+
+Ownership rotates: every bot that asks for a lease joins its member list,
+and after an owner releases with ``rotate=True`` the lease is reserved for
+the next member in name order. Other members get it only after waiting
+``turn_grace`` seconds, in case the bot whose turn it is has gone away.
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import time
+
+LEASE_DIR = os.getenv("LEASE_DIR", "/tmp/telebot_leases")
+MEMBER_TTL_SECONDS = 24 * 60 * 60  # Bots not seen for this long leave the rotation
+
+
+def _lease_path(name: str) -> str:
+    return os.path.join(LEASE_DIR, f"{name}.json")
+
+
+@contextlib.contextmanager
+def _locked(name: str):
+    """Yield the lease state for ``name``; changes are written back on exit."""
+    os.makedirs(LEASE_DIR, exist_ok=True)
+    with open(_lease_path(name), "a+", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            before = f.read()
+            try:
+                state = json.loads(before or "{}")
+            except ValueError:
+                state = {}
+            yield state
+            if json.dumps(state) != before:
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _next_turn(state: dict, now: float) -> str | None:
+    members = sorted(
+        bot for bot, seen in state.get("members", {}).items() if seen > now - MEMBER_TTL_SECONDS
+    )
+    if not members:
+        return None
+    last_owner = state.get("last_owner")
+    for bot in members:
+        if last_owner is None or bot > last_owner:
+            return bot
+    return members[0]
+
+
+def turn(name: str) -> str | None:
+    """Return the member whose turn it is to take ``name`` next, if known."""
+    with _locked(name) as state:
+        return _next_turn(state, time.time())
+
+
+def acquire(name: str, owner: str, ttl: float, *, turn_grace: float = 0) -> bool:
+    """Take the lease ``name`` for ``ttl`` seconds; return whether ``owner`` holds it."""
+    now = time.time()
+    with _locked(name) as state:
+        members = state.setdefault("members", {})
+        members[owner] = now
+        for bot, seen in list(members.items()):
+            if seen <= now - MEMBER_TTL_SECONDS:
+                del members[bot]
+        holder = state.get("owner")
+        if holder not in (None, owner) and state.get("expires", 0) > now:
+            return False
+        if holder != owner:
+            next_bot = _next_turn(state, now)
+            waiting = state.setdefault("waiting", {})
+            if next_bot != owner and now - waiting.setdefault(owner, now) < turn_grace:
+                return False
+            if next_bot != owner:
+                logging.info(f"[leases] {owner} takes {name} out of turn from {next_bot}")
+        state["owner"] = owner
+        state["expires"] = now + ttl
+        state["waiting"] = {}
+        return True
+
+
+def renew(name: str, owner: str, ttl: float) -> bool:
+    """Extend ``owner``'s lease; return False if it has been lost."""
+    now = time.time()
+    with _locked(name) as state:
+        if state.get("owner") != owner:
+            return False
+        state["expires"] = now + ttl
+        state.setdefault("members", {})[owner] = now
+        return True
+
+
+def release(name: str, owner: str, *, rotate: bool = True) -> None:
+    """Give up ``owner``'s lease; with ``rotate`` the next member's turn begins."""
+    with _locked(name) as state:
+        if state.get("owner") != owner:
+            return
+        state["owner"] = None
+        state["expires"] = 0
+        if rotate:
+            state["last_owner"] = owner
+
+
+async def keep_alive(name: str, owner: str, ttl: float) -> None:
+    """Renew the lease every ``ttl / 3`` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if not renew(name, owner, ttl):
+            logging.warning(f"[leases] {owner} lost lease {name}")
+            return
@@ -8,10 +8,13 @@ from aiogram.enums import ParseMode
 from aiogram import F
 import asyncio
 import dotenv
+import heapq
+from collections import deque
 
 dotenv.load_dotenv()
 
 from agent_client import (
+    AgentReply,
     openai_client,
     create_thread_with_system_prompt,
     ask_agent,
@@ -19,18 +22,24 @@ from agent_client import (
 )
 import agent_client
 import bot_bus
+import chime_gate
+import leases
+import image_pipeline
+import media_store
+import usage_ledger
 import base64
-from tempfile import NamedTemporaryFile
 import aiohttp
 from datetime import datetime, time, timedelta
 from zoneinfo import ZoneInfo
 import io
-from aiogram.types.input_file import BufferedInputFile, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto, SendVoice
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, BufferedInputFile, FSInputFile
 import yaml
 import json
 from mcp.client.sse import sse_client
 from mcp.client.session import ClientSession
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, NotFoundError
 
 # Standard OpenAI client for image generation (not the Agents SDK wrapper)
 _openai_images_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
@@ -48,9 +57,6 @@ DEFAULT_BOT_PROMPTS_FILE = os.path.join("prompts", "default_bot", "bot_prompts.y
 NUDGE_MINUTES = int(
     os.getenv("NUDGE_MINUTES", 120)
 )  # Minutes of inactivity before nudge (default 2 hours)
-# Random per-bot offset (+/-20-30 min) so multiple bots don't nudge simultaneously
-NUDGE_RANDOM_OFFSET = random.choice([-1, 1]) * random.randint(20, 30)
-NUDGE_MINUTES = max(30, NUDGE_MINUTES + NUDGE_RANDOM_OFFSET)
 IMAGE_GEN_MODEL = os.getenv("IMAGE_GEN_MODEL", "gpt-image-1.5")
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8888/sse")
 
@@ -112,23 +118,121 @@ ACTIVE_START = _parse_time(os.getenv("ACTIVE_START", "10:00"), time(10, 0))
 ACTIVE_END = _parse_time(os.getenv("ACTIVE_END", "21:00"), time(21, 0))
 
 MAX_UNMENTIONED_REPLIES = 3
+# At most this many bots consider an unmentioned chime-in on the same message
+MAX_CHIME_IN_BOTS = max(1, int(os.getenv("MAX_CHIME_IN_BOTS", "1")))
+CHIME_IN_WEIGHT_WINDOW = 3600  # Seconds of bus history weighting the chime-in election
+CHIME_IN_MEMBER_TTL = 24 * 60 * 60  # Bots not seen in a chat for this long leave its elections
 
 # Additional configuration constants
 IMAGE_SEND_CHANCE = float(os.getenv("IMAGE_SEND_CHANCE", 0.3))  # Probability of sending an image with a nudge
+# Nudge images are generated in the background by a bounded job queue
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "2"))  # concurrent generations
+IMAGE_JOB_QUEUE_MAX = int(os.getenv("IMAGE_JOB_QUEUE_MAX", "8"))
+IMAGE_JOBS_PER_HOUR = int(os.getenv("IMAGE_JOBS_PER_HOUR", "20"))  # cost cap
+# (size, quality) when the queue is idle, and when jobs are already waiting
+IMAGE_GEN_TIER = (os.getenv("IMAGE_GEN_SIZE", "1024x1024"), os.getenv("IMAGE_GEN_QUALITY", "medium"))
+IMAGE_GEN_BUSY_TIER = (os.getenv("IMAGE_GEN_BUSY_SIZE", "1024x1024"), os.getenv("IMAGE_GEN_BUSY_QUALITY", "low"))
+VISION_DETAIL = os.getenv("VISION_DETAIL", "high")  # low | high | auto
+# Images up to this size are sent inline as data URLs instead of via the Files API
+VISION_INLINE_MAX_BYTES = int(os.getenv("VISION_INLINE_MAX_KB", "512")) * 1024
+VISION_FILE_TTL_SECONDS = int(os.getenv("VISION_FILE_TTL_HOURS", "24")) * 60 * 60
+VISION_JANITOR_INTERVAL = 60 * 60
+IMAGE_DESCRIBE_MODEL = os.getenv("IMAGE_DESCRIBE_MODEL", "gpt-4.1-mini")
+IMAGE_DESCRIBE_PROMPT = (
+    "Describe this image factually in 2-4 sentences for someone who cannot see it: "
+    "the main subjects, setting, mood and anything unusual. Quote any visible text verbatim."
+)
+# Shared by all bots: a description is made once per Telegram file
+IMAGE_DESCRIPTION_DIR = "/tmp/telebot_image_descriptions"
+# OpenAI file ids this bot uploaded for vision; the janitor deletes only these
+VISION_UPLOADS_FILE = os.path.join("/tmp/telebot_vision_uploads", f"{BOT_USERNAME or 'bot'}.json")
+# Captions asking about details the description may have missed get the full image
+FULL_IMAGE_RE = re.compile(
+    r"(прочита|прочти|написан|текст|надпис|сколько|посчита|детал|внимательн|увелич|"
+    r"\bread\b|\btext\b|written|how many|count|detail|zoom|closer)",
+    re.IGNORECASE,
+)
+# edit: send photos with the raw caption and edit in the styled one when ready;
+# wait: style before sending; off: never restyle captions
+CAPTION_STYLE_MODE = os.getenv("CAPTION_STYLE_MODE", "edit").lower()
+CAPTION_STYLE_MODEL = os.getenv("CAPTION_STYLE_MODEL", "gpt-4.1-mini")
+CAPTION_STYLE_CACHE_MAX = 500
 NUDGE_RESET_INTERVAL = 300  # Seconds between unmentioned counter resets
-NUDGE_CHECK_INTERVAL = 60  # Interval between inactivity checks
+NUDGE_CHECK_INTERVAL = 60  # Retry delay after a failed nudge
+# Bots sharing a chat elect one nudger per idle window through a per-chat lease
+NUDGE_LEASE_TTL = 120  # Seconds; renewed while the nudge is being sent
+NUDGE_LEASE_RETRY = 30  # Seconds before asking again for a lease held by another bot
+NUDGE_TURN_GRACE = int(os.getenv("NUDGE_TURN_GRACE_SECONDS", "300"))  # Wait for the bot whose turn it is
+NUDGE_MAX_CONCURRENT = int(os.getenv("NUDGE_MAX_CONCURRENT", "4"))
+# Nudges are prepared in the background this long before they are due (0 disables)
+NUDGE_PREPARE_LEAD_SECONDS = int(os.getenv("NUDGE_PREPARE_LEAD_MINUTES", "10")) * 60
 RECENT_ACTIVITY_SECONDS = 30  # Window to treat bot replies as "recent"
 
 # === GLOBAL STATE ===
 # Note: chat histories now managed in agent_client._histories
 last_activity_time = {}  # chat_id: datetime — any message, used by nudge timer
 nudge_loop_started_at = None  # set when nudge loop starts; prevents nudging right after restart
+# Nudge timers: (monotonic deadline, chat_id, "nudge" | "prepare"), one nudge
+# timer per enabled chat. Activity only updates last_activity_time; a timer
+# that fires early re-arms itself.
+_nudge_heap: list[tuple[float, int, str]] = []
+_nudge_wakeup: asyncio.Event | None = None
+_nudge_slots: asyncio.Semaphore | None = None
+_nudge_tasks: set[asyncio.Task] = set()
+# chat_id -> (last activity when prepared, time prepared, reply, generated image handle,
+# nudge prompt used)
+_prepared_nudges: dict[int, tuple[datetime, float, AgentReply, str | None, str]] = {}
+_preparing: set[int] = set()
 last_bot_reply_time = {}  # chat_id: datetime — bot replies only, used by probabilistic logic
 bot_unmentioned_count = {}  # chat_id: int
 messages_since_bot_reply = {}  # chat_id: int — user messages since last bot reply
 CLAIM_DIR = "/tmp/telebot_claims"
 os.makedirs(CLAIM_DIR, exist_ok=True)
 
+# Picture of the day: date -> (image url, image bytes, caption)
+_potd_cache: dict[str, tuple[str, bytes, str]] = {}
+POTD_CACHE_DAYS = 2
+
+# Downloads above the spill size go to the media store instead of staying in memory
+MEDIA_SPILL_BYTES = int(os.getenv("MEDIA_SPILL_KB", "2048")) * 1024
+MEDIA_MAX_DOWNLOAD_BYTES = int(os.getenv("MEDIA_MAX_DOWNLOAD_MB", "20")) * 1024 * 1024
+_media_send_stats = {"sends": 0, "bytes": 0, "total_ms": 0, "max_ms": 0, "peak_rss_kb": 0}
+
+# Styled captions by (persona, caption hash); restyles run one at a time
+_styled_captions: dict[tuple[str, str], str] = {}
+_caption_style_flights: dict[tuple[str, str], asyncio.Task] = {}
+_caption_style_slot: asyncio.Semaphore | None = None
+_background_tasks: set[asyncio.Task] = set()
+
+# Background image generation: queue and workers are created on first use
+_image_jobs: asyncio.Queue | None = None
+_image_workers: list[asyncio.Task] = []
+_image_job_chats: set[int] = set()  # chats with a pending image
+_image_job_starts: deque[float] = deque()  # accept times within the last hour
+_image_job_stats = {
+    "queued": 0, "done": 0, "failed": 0, "dropped": 0,
+    "wait_ms": 0, "max_wait_ms": 0, "gen_ms": 0, "max_gen_ms": 0,
+}
+
+# Content hash -> Telegram file_id of the first upload. file_ids are only
+# valid for the bot that uploaded them, so each bot keeps its own file.
+FILE_ID_CACHE_FILE = os.path.join("file_ids", f"{BOT_USERNAME or 'bot'}.json")
+FILE_ID_CACHE_MAX = 5000
+_file_ids: dict[str, str] | None = None  # loaded lazily from disk
+_file_id_stats = {"hits": 0, "misses": 0, "stale": 0}
+
+# Albums being collected: media_group_id -> photo messages received so far
+_media_groups: dict[str, list] = {}
+MEDIA_GROUP_WINDOW = 1.5  # seconds to wait for the rest of an album
+
+# Telegram file_unique_id -> (OpenAI file id, upload time) of vision uploads
+_vision_files: dict[str, tuple[str, float]] = {}
+_vision_uploads: dict[str, float] | None = None  # file id -> upload time, loaded lazily
+
+# Media handle extensions accepted in assistant replies
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "webp"}
+AUDIO_EXTENSIONS = {"ogg", "mp3", "wav", "m4a"}
+
 # Bot bus: track file read positions per chat
 _bus_positions: dict[int, int] = {}
 _bus_last_reply: dict[int, float] = {}  # chat_id -> timestamp of last bus-triggered reply
@@ -186,6 +290,9 @@ def _claim_key(message: Message) -> str:
     import hashlib
 
     chat_id = message.chat.id
+    if getattr(message, "media_group_id", None):
+        # All photos of an album share one claim
+        return f"{chat_id}_album_{message.media_group_id}"
     user_id = message.from_user.id
     date = int(message.date.timestamp())
     text = message.text or message.caption or ""
@@ -230,17 +337,29 @@ async def try_claim_message(message: Message, emoji: str = "👀") -> bool:
     return True
 
 
-async def ask_openai_contents(chat_id: int, contents, role="user", *, tool_choice: str | None = None) -> str:
+async def ask_openai_contents(
+    chat_id: int,
+    contents,
+    role="user",
+    *,
+    tool_choice: str | None = None,
+    structured: bool = False,
+    request_class: str = "reply",
+) -> str | AgentReply:
     """Send prepared message contents to the agent.
 
     ``tool_choice`` can be used to force a specific tool for this message.
+    With ``structured`` the reply is an :class:`AgentReply`.
     """
     try:
         message_list = [{"role": role, "content": contents}]
-        reply = await ask_agent(message_list, chat_id=chat_id, tool_choice=tool_choice)
-        return clean_openai_reply(reply)
+        reply = await ask_agent(
+            message_list, chat_id=chat_id, tool_choice=tool_choice, structured=structured,
+            request_class=request_class,
+        )
     except Exception as e:
-        return f"OpenAI error: {e}"
+        reply = f"OpenAI error: {e}"
+    return _clean_reply(reply) if structured else clean_openai_reply(str(reply))
 
 
 async def ask_openai(
@@ -250,7 +369,9 @@ async def ask_openai(
     *,
     chat_id: int,
     tool_choice: str | None = None,
-) -> str:
+    structured: bool = False,
+    request_class: str = "reply",
+) -> str | AgentReply:
     """Send a message to the OpenAI assistant with proper structure (no string concatenation).
 
     Note: History is now managed automatically by agent_client, not passed as a parameter.
@@ -258,312 +379,568 @@ async def ask_openai(
     # Format the message with username prefix
     formatted_prompt = f"{username}: {prompt}"
     print(f"[ask_openai] Sending to OpenAI: {formatted_prompt}")  # Debug print
-    return await ask_openai_contents(chat_id, formatted_prompt, role=role, tool_choice=tool_choice)
+    return await ask_openai_contents(
+        chat_id, formatted_prompt, role=role, tool_choice=tool_choice, structured=structured,
+        request_class=request_class,
+    )
 
 
-async def ask_openai_image(
-    image_bytes: bytes,
-    prompt: str = IMAGE_DEFAULT_PROMPT,
-    *,
-    chat_id: int,
-) -> str:
-    """Upload an image and include it with the prompt for the assistant."""
+def _cached_vision_file(file_unique_id: str | None) -> str | None:
+    """Return the OpenAI file id of a still-valid upload of this Telegram file."""
+    import time as _time
+
+    entry = _vision_files.get(file_unique_id) if file_unique_id else None
+    if entry is None:
+        return None
+    file_id, uploaded_at = entry
+    if uploaded_at < _time.time() - VISION_FILE_TTL_SECONDS:
+        del _vision_files[file_unique_id]
+        return None
+    return file_id
+
+
+def _vision_upload_record() -> dict[str, float]:
+    global _vision_uploads
+    if _vision_uploads is None:
+        try:
+            with open(VISION_UPLOADS_FILE, "r", encoding="utf-8") as f:
+                _vision_uploads = json.load(f)
+        except (OSError, ValueError):
+            _vision_uploads = {}
+    return _vision_uploads
+
+
+def _save_vision_upload_record() -> None:
+    os.makedirs(os.path.dirname(VISION_UPLOADS_FILE), exist_ok=True)
+    tmp_path = f"{VISION_UPLOADS_FILE}.{os.getpid()}.tmp"
     try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_vision_upload_record(), f)
+        os.replace(tmp_path, VISION_UPLOADS_FILE)
+    except OSError as e:
+        logging.warning(f"[vision] Failed to persist uploads: {e}")
+
+
+def _pick_photo_size(sizes):
+    """Return the smallest PhotoSize that still covers the vision detail level.
+
+    Low detail looks at a 512 px image; high detail scales the shorter side
+    to 768 px, so anything larger is wasted download and upload.
+    """
+    for size in sorted(sizes, key=lambda s: s.width * s.height):
+        if VISION_DETAIL == "low" and max(size.width, size.height) >= 512:
+            return size
+        if VISION_DETAIL != "low" and min(size.width, size.height) >= 768:
+            return size
+    return sizes[-1]
+
+
+async def _vision_image_content(
+    image_bytes: bytes | None, file_unique_id: str | None, chat_id: int | None = None
+) -> dict:
+    """Build the ``input_image`` part for an image.
+
+    Small images are inlined as a data URL. Larger ones go through the Files
+    API once per Telegram ``file_unique_id``, so forwarded and repeated photos
+    reuse the upload. A new upload is recorded against ``chat_id``.
+    """
+    import time as _time
+
+    file_id = _cached_vision_file(file_unique_id)
+    if file_id is None:
+        if image_bytes is None:
+            raise ValueError("image bytes required for a new image")
+        image_bytes = await image_pipeline.downscale_for_vision(image_bytes, VISION_DETAIL)
+        if len(image_bytes) <= VISION_INLINE_MAX_BYTES:
+            encoded = base64.b64encode(image_bytes).decode()
+            return {
+                "type": "input_image",
+                "image_url": f"data:image/jpeg;base64,{encoded}",
+                "detail": VISION_DETAIL,
+            }
         image_file = io.BytesIO(image_bytes)
-        image_file.name = "image.jpg"
+        image_file.name = f"telebot-{BOT_USERNAME or 'bot'}.jpg"
         file_response = await openai_client.files.create(
             file=image_file,
             purpose="vision",
         )
         file_id = file_response.id
-        contents = [
-            {"type": "input_text", "text": prompt},
-            {"type": "input_image", "file_id": file_id},
-        ]
+        _vision_upload_record()[file_id] = _time.time()
+        _save_vision_upload_record()
+        usage_ledger.record(chat_id, "vision", vision_uploads=1)
+        if file_unique_id:
+            _vision_files[file_unique_id] = (file_id, _time.time())
+    return {"type": "input_image", "file_id": file_id, "detail": VISION_DETAIL}
+
+
+def _image_description_path(file_unique_id: str) -> str:
+    safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", file_unique_id)
+    return os.path.join(IMAGE_DESCRIPTION_DIR, f"{safe_id}.json")
+
+
+def _cached_image_description(file_unique_id: str | None) -> str | None:
+    if not file_unique_id:
+        return None
+    try:
+        with open(_image_description_path(file_unique_id), "r", encoding="utf-8") as f:
+            return json.load(f).get("description") or None
+    except (OSError, ValueError):
+        return None
+
+
+async def describe_image(
+    image_bytes: bytes | None, file_unique_id: str | None, chat_id: int | None = None
+) -> str:
+    """Return a short text description of an image, cached per Telegram file.
+
+    The description is made once by IMAGE_DESCRIBE_MODEL outside any chat
+    history and shared by all chats and bots, so later turns can refer to
+    the photo without paying for vision tokens again. Its cost is recorded
+    against ``chat_id``, the chat the photo first arrived in.
+    """
+    cached = _cached_image_description(file_unique_id)
+    if cached:
+        return cached
+
+    image = await _vision_image_content(image_bytes, file_unique_id, chat_id)
+    response = await openai_client.responses.create(
+        model=IMAGE_DESCRIBE_MODEL,
+        input=[{
+            "role": "user",
+            "content": [{"type": "input_text", "text": IMAGE_DESCRIBE_PROMPT}, image],
+        }],
+    )
+    usage_ledger.record_usage(
+        chat_id, "describe", IMAGE_DESCRIBE_MODEL, getattr(response, "usage", None)
+    )
+    description = response.output_text.strip()
+    if not description:
+        raise ValueError("empty image description")
+
+    if file_unique_id:
+        path = _image_description_path(file_unique_id)
+        os.makedirs(IMAGE_DESCRIPTION_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"description": description}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"[vision] Failed to cache description: {e}")
+    return description
+
+
+def _needs_full_image(caption: str | None) -> bool:
+    """Return True if ``caption`` asks about details a description may miss."""
+    return bool(caption) and FULL_IMAGE_RE.search(caption) is not None
+
+
+async def _image_parts(
+    image_bytes: bytes | None,
+    file_unique_id: str | None,
+    description: str | None,
+    full_image: bool,
+    chat_id: int | None = None,
+) -> list[dict]:
+    parts = []
+    if description:
+        parts.append({"type": "input_text", "text": f"[Photo: {description}]"})
+    if full_image or not description:
+        parts.append(await _vision_image_content(image_bytes, file_unique_id, chat_id))
+    return parts
+
+
+async def ask_openai_image(
+    image_bytes: bytes | None,
+    prompt: str = IMAGE_DEFAULT_PROMPT,
+    *,
+    chat_id: int,
+    file_unique_id: str | None = None,
+    description: str | None = None,
+    full_image: bool = True,
+) -> str:
+    """Include an image with the prompt for the assistant.
+
+    With a ``description`` the photo is also described in text, which is what
+    the chat history keeps; ``full_image=False`` sends only that text.
+    ``image_bytes`` may be None when ``file_unique_id`` has a cached upload
+    or the full image is not sent.
+    """
+    try:
+        contents = [{"type": "input_text", "text": prompt}]
+        contents += await _image_parts(
+            image_bytes, file_unique_id, description, full_image, chat_id
+        )
         return await ask_openai_contents(chat_id, contents)
     except Exception as e:
         return f"OpenAI error: {e}"
 
 
-async def download_image_to_tmp(url: str) -> str:
-    """Download an image from ``url`` and save it to ``/tmp``.
+async def vision_file_janitor():
+    """Delete this bot's vision uploads older than VISION_FILE_TTL_SECONDS.
 
-    Returns the file path of the saved image.
+    Uploads are recorded in VISION_UPLOADS_FILE, so files left behind by
+    earlier runs are cleaned up too while other bots' and other
+    applications' files on the same account are left alone.
     """
+    import time as _time
+
+    try:
+        while True:
+            cutoff = _time.time() - VISION_FILE_TTL_SECONDS
+            for unique_id, (_file_id, uploaded_at) in list(_vision_files.items()):
+                if uploaded_at < cutoff:
+                    del _vision_files[unique_id]
+            uploads = _vision_upload_record()
+            deleted = 0
+            for file_id, uploaded_at in list(uploads.items()):
+                if uploaded_at >= cutoff:
+                    continue
+                try:
+                    await openai_client.files.delete(file_id)
+                except NotFoundError:
+                    pass
+                except Exception as e:
+                    logging.warning(f"[vision] Janitor failed to delete {file_id}: {e}")
+                    continue
+                del uploads[file_id]
+                deleted += 1
+            if deleted:
+                _save_vision_upload_record()
+                logging.info(f"[vision] Deleted {deleted} expired vision files")
+            await asyncio.sleep(VISION_JANITOR_INTERVAL)
+    except asyncio.CancelledError:
+        logging.info("[vision] Janitor cancelled.")
+        raise
+
+
+async def download_image_bytes(url: str) -> bytearray:
+    """Download ``url`` and return the response body.
+
+    Raises ``ValueError`` when the body exceeds MEDIA_MAX_DOWNLOAD_BYTES.
+    """
+    data = bytearray()
     async with aiohttp.ClientSession() as session:
         async with session.get(url) as resp:
             resp.raise_for_status()
-            data = await resp.read()
+            if (resp.content_length or 0) > MEDIA_MAX_DOWNLOAD_BYTES:
+                raise ValueError(f"download too large: {resp.content_length} bytes")
+            async for chunk in resp.content.iter_chunked(DEFAULT_CHUNK_SIZE):
+                data += chunk
+                if len(data) > MEDIA_MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"download too large: over {MEDIA_MAX_DOWNLOAD_BYTES} bytes")
+    return data
+
+
+async def download_media(url: str) -> bytearray | str:
+    """Download ``url`` for sending.
+
+    Small payloads stay in memory; anything above MEDIA_SPILL_BYTES is written
+    to the media store and returned as a handle.
+    """
+    data = await download_image_bytes(url)
+    if len(data) <= MEDIA_SPILL_BYTES:
+        return data
 
     # Strip query string before extracting extension
     path_part = url.split("?")[0].split("#")[0]
     suffix = os.path.splitext(path_part)[1] or ".jpg"
-    with NamedTemporaryFile(delete=False, dir="/tmp", suffix=suffix) as f:
-        f.write(data)
-        return f.name
+    return media_store.put(data, suffix)
 
 
-async def _extract_json_image(reply: str):
-    """Return image information if ``reply`` includes a JSON payload.
-
-    Supports:
-    - ``{"image": "<base64>"}``
-    - ``{"image_url": "http://..."}`` or ``{"url": "http://..."}``
-    - ``{"command": "/meme"}``
-    Returns a tuple ``(data, caption)`` where ``data`` is either bytes or a file
-    path to an image in ``/tmp``. If the reply contains text after the JSON
-    block, that text will be used as the caption when no ``caption`` field is
-    present.
+class MemoryInputFile(BufferedInputFile):
+    """A :class:`BufferedInputFile` that uploads slices of a memoryview.
+
+    The stock class wraps its data in ``io.BytesIO`` and copies every chunk;
+    this one hands the original buffer to the HTTP client as is.
     """
-    import re
 
-    trailing_text = ""
+    def __init__(self, data: bytes | bytearray | memoryview, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(memoryview(data), filename=filename, chunk_size=chunk_size)
 
-    try:
-        data = json.loads(reply)
-    except json.JSONDecodeError:
-        m = re.search(r"\{.*\}", reply, re.DOTALL)
-        if not m:
-            # Check for a bare image URL in the text
-            url_match = re.search(r"https?://\S+", reply)
-            if url_match:
-                url = url_match.group(0).rstrip(").,'\"")
-                if re.search(r"\.(?:jpe?g|png|gif)(?:\?|$)", url, re.I):
-                    path = await download_image_to_tmp(url)
-                    caption = reply[url_match.end() :].strip()
-                    return path, caption
-            # Check for a local temporary file path like /tmp/tmp123.jpg
-            path_match = re.search(r"(/tmp/[^\s]+\.(?:jpe?g|png|gif))", reply)
-            if path_match and os.path.exists(path_match.group(1)):
-                caption = reply[path_match.end() :].strip()
-                return path_match.group(1), caption
-            return None
-        trailing_text = reply[m.end() :].strip()
-        try:
-            data = json.loads(m.group(0))
-        except json.JSONDecodeError:
-            return None
-    else:
-        if isinstance(data, str):
-            try:
-                data = json.loads(data)
-            except json.JSONDecodeError:
-                return None
+    async def read(self, bot):
+        view = self.data
+        for start in range(0, len(view), self.chunk_size):
+            yield view[start : start + self.chunk_size]
+
+
+def _input_file(media: bytes | bytearray | memoryview | str, filename: str):
+    """Wrap in-memory data or a media handle for sending to Telegram."""
+    if isinstance(media, str):
+        return FSInputFile(media_store.path(media))
+    return MemoryInputFile(media, filename=filename)
 
-    if isinstance(data, dict) and data.get("type") == "text" and isinstance(data.get("text"), str):
+
+def _input_file_size(file) -> int:
+    if isinstance(file, BufferedInputFile):
+        return len(file.data)
+    if isinstance(file, FSInputFile):
         try:
-            inner = json.loads(data["text"])
-            if isinstance(inner, dict):
-                data = inner
-        except json.JSONDecodeError:
-            pass
+            return os.path.getsize(file.path)
+        except OSError:
+            return 0
+    return 0
 
-    if not isinstance(data, dict):
-        return None
 
-    if "image" in data:
-        val = data["image"]
-        if isinstance(val, str) and val.startswith("http"):
-            path = await download_image_to_tmp(val)
-            caption = str(data.get("caption", "")) or trailing_text
-            return path, caption
+def _input_file_digest(file) -> str | None:
+    """Return the SHA-256 of an upload's content, or None if it is not an upload."""
+    import hashlib
+
+    if isinstance(file, BufferedInputFile):
+        return hashlib.sha256(file.data).hexdigest()
+    if isinstance(file, FSInputFile):
+        name = os.path.basename(str(file.path))
+        if os.path.dirname(os.path.abspath(file.path)) == os.path.abspath(media_store.MEDIA_DIR):
+            return name.split(".", 1)[0]  # store files are named by their hash
+        digest = hashlib.sha256()
         try:
-            img_bytes = base64.b64decode(val)
-        except Exception:
+            with open(file.path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(chunk)
+        except OSError:
             return None
-        caption = str(data.get("caption", "")) or trailing_text
-        return img_bytes, caption
+        return digest.hexdigest()
+    return None
+
 
-    if "image_url" in data or "url" in data:
-        url = data.get("image_url") or data.get("url")
-        path = await download_image_to_tmp(url)
-        caption = str(data.get("caption", "")) or trailing_text
-        return path, caption
+def _file_id_cache() -> dict[str, str]:
+    global _file_ids
+    if _file_ids is None:
+        try:
+            with open(FILE_ID_CACHE_FILE, "r", encoding="utf-8") as f:
+                _file_ids = json.load(f)
+        except (OSError, ValueError):
+            _file_ids = {}
+    return _file_ids
 
-    if data.get("command") == "/meme":
-        path = await retrieve_joke()
-        return path, ""
 
+def _save_file_id_cache() -> None:
+    os.makedirs(os.path.dirname(FILE_ID_CACHE_FILE) or ".", exist_ok=True)
+    tmp_path = f"{FILE_ID_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_file_id_cache(), f)
+        os.replace(tmp_path, FILE_ID_CACHE_FILE)
+    except OSError as e:
+        logging.warning(f"[file_id] Failed to persist cache: {e}")
+
+
+def _sent_file_id(result) -> str | None:
+    """Return the file_id Telegram assigned to the media in a sent message."""
+    if getattr(result, "photo", None):
+        return result.photo[-1].file_id
+    for attr in ("voice", "audio", "document"):
+        media = getattr(result, attr, None)
+        if media is not None:
+            return media.file_id
     return None
 
 
-async def _extract_voice_file(reply: str):
-    """Return voice path and remaining text if ``reply`` mentions a local audio file.
+async def _reuse_telegram_file_id(make_request, bot, method):
+    """Bot session middleware sending known photos and voice notes by file_id.
 
-    Supports JSON payloads like ``{"voice": "<base64>"}`` or plain paths such as
-    ``/tmp/tmp123.ogg`` in the text. The function returns a tuple ``(path, text)``
-    where ``text`` is the original message without the file reference.
+    The first upload of some content records the file_id Telegram returns;
+    later sends of the same bytes pass that id instead of uploading again.
     """
-    import re
+    if not isinstance(method, (SendPhoto, SendVoice)):
+        return await make_request(bot, method)
+
+    field = "photo" if isinstance(method, SendPhoto) else "voice"
+    digest = _input_file_digest(getattr(method, field))
+    if digest is None:
+        return await make_request(bot, method)
+
+    key = f"{field}:{digest}"
+    cache = _file_id_cache()
+    file_id = cache.get(key)
+    if file_id:
+        try:
+            result = await make_request(bot, method.model_copy(update={field: file_id}))
+        except TelegramBadRequest as e:
+            logging.info(f"[file_id] Cached {field} rejected, uploading again: {e}")
+            _file_id_stats["stale"] += 1
+            cache.pop(key, None)
+        else:
+            cache[key] = cache.pop(key)  # most recently used goes last
+            _file_id_stats["hits"] += 1
+            _log_file_id_hit_rate()
+            return result
+
+    _file_id_stats["misses"] += 1
+    result = await make_request(bot, method)
+    file_id = _sent_file_id(result)
+    if file_id:
+        cache[key] = file_id
+        while len(cache) > FILE_ID_CACHE_MAX:
+            del cache[next(iter(cache))]
+        _save_file_id_cache()
+    _log_file_id_hit_rate()
+    return result
+
+
+def _log_file_id_hit_rate() -> None:
+    total = _file_id_stats["hits"] + _file_id_stats["misses"]
+    logging.info(
+        "[file_id] hit rate %.0f%% (%d of %d sends, %d stale)",
+        100 * _file_id_stats["hits"] / total,
+        _file_id_stats["hits"],
+        total,
+        _file_id_stats["stale"],
+    )
+
 
-    trailing_text = ""
+async def _measure_media_send(make_request, bot, method):
+    """Bot session middleware logging latency and peak RSS of photo/voice sends."""
+    if not isinstance(method, (SendPhoto, SendVoice)):
+        return await make_request(bot, method)
+
+    import resource
+    import time as _time
+
+    file = method.photo if isinstance(method, SendPhoto) else method.voice
+    size = _input_file_size(file)
+    started = _time.monotonic()
     try:
-        data = json.loads(reply)
-    except json.JSONDecodeError:
-        m = re.search(r"\{.*\}", reply, re.DOTALL)
-        if not m:
-            path_match = re.search(r"(/tmp/[^\s]+\.(?:mp3|ogg|wav|m4a))", reply)
-            if path_match:
-                path = path_match.group(1).rstrip(").,'\"")
-                if os.path.exists(path):
-                    text = (reply[: path_match.start()] + reply[path_match.end() :]).strip()
-                    return path, text
-            return None
-        trailing_text = reply[m.end() :].strip()
-        try:
-            data = json.loads(m.group(0))
-        except json.JSONDecodeError:
-            return None
-    else:
-        if isinstance(data, str):
-            try:
-                data = json.loads(data)
-            except json.JSONDecodeError:
-                return None
+        return await make_request(bot, method)
+    finally:
+        elapsed_ms = int((_time.monotonic() - started) * 1000)
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        _media_send_stats["sends"] += 1
+        _media_send_stats["bytes"] += size
+        _media_send_stats["total_ms"] += elapsed_ms
+        _media_send_stats["max_ms"] = max(_media_send_stats["max_ms"], elapsed_ms)
+        _media_send_stats["peak_rss_kb"] = peak_rss_kb
+        logging.info(
+            "[media] %s: %d bytes in %d ms, peak RSS %.1f MB",
+            type(method).__name__,
+            size,
+            elapsed_ms,
+            peak_rss_kb / 1024,
+        )
 
-    if isinstance(data, dict) and data.get("type") == "text" and isinstance(data.get("text"), str):
-        try:
-            inner = json.loads(data["text"])
-            if isinstance(inner, dict):
-                data = inner
-        except json.JSONDecodeError:
-            pass
 
-    if not isinstance(data, dict):
+def _decode_media(value: str):
+    """Return a media handle as is, or the bytes of base64 data (None if invalid)."""
+    if media_store.is_handle(value):
+        return value
+    try:
+        return base64.b64decode(value)
+    except Exception:
         return None
 
-    if "voice" in data:
-        val = data["voice"]
-        if isinstance(val, str) and val.startswith("http"):
-            path = await download_image_to_tmp(val)
-            text = str(data.get("caption", "")) or trailing_text
-            return path, text
-        if isinstance(val, str) and os.path.exists(val):
-            text = str(data.get("caption", "")) or trailing_text
-            return val, text
-        try:
-            audio_bytes = base64.b64decode(val)
-        except Exception:
-            return None
-        with NamedTemporaryFile(delete=False, dir="/tmp", suffix=".ogg") as f:
-            f.write(audio_bytes)
-            path = f.name
-        text = str(data.get("caption", "")) or trailing_text
-        return path, text
-
-    if "voice_url" in data or "url" in data:
-        url = data.get("voice_url") or data.get("url")
-        path = await download_image_to_tmp(url)
-        text = str(data.get("caption", "")) or trailing_text
-        return path, text
-
-    if "path" in data and os.path.exists(data["path"]):
-        text = str(data.get("caption", "")) or trailing_text
-        return data["path"], text
 
-    return None
+async def _reply_image(reply: AgentReply):
+    """Return ``(media, caption)`` for the image a reply asks to send, or None.
 
+    ``media`` is in-memory image data or a media handle. URLs are downloaded
+    unless the picture of the day already has them; ``/meme`` fetches a meme.
+    """
+    if reply.command == "/meme":
+        return await retrieve_joke(), ""
+    value = reply.image
+    if not value:
+        return None
+    if value.startswith("http"):
+        cached = _cached_potd_image(value)
+        return (cached if cached is not None else await download_media(value)), reply.text
+    media = _decode_media(value)
+    return (media, reply.text) if media is not None else None
 
-async def send_nudge_with_image(target, chat_id, answer, caption="", is_message=True):
-    """Send ``answer`` as a nudge and optionally attach an image."""
 
-    # Check for a JSON command requesting a fact before other processing.
-    command_payload = None
-    trailing_text = ""
-    try:
-        command_payload = json.loads(answer)
-    except json.JSONDecodeError:
-        import re
+async def _reply_voice(reply: AgentReply):
+    """Return ``(media, text)`` for the voice clip a reply asks to send, or None."""
+    value = reply.voice
+    if not value:
+        return None
+    if value.startswith("http"):
+        return await download_media(value), reply.text
+    media = _decode_media(value)
+    return (media, reply.text) if media is not None else None
 
-        m = re.search(r"\{.*\}", answer, re.DOTALL)
-        if m:
-            trailing_text = answer[m.end() :].strip()
-            try:
-                command_payload = json.loads(m.group(0))
-            except json.JSONDecodeError:
-                command_payload = None
-    if isinstance(command_payload, str):
-        try:
-            command_payload = json.loads(command_payload)
-        except json.JSONDecodeError:
-            command_payload = None
-    if isinstance(command_payload, dict) and command_payload.get("command") == "/fact":
+
+async def _extract_json_image(reply: str):
+    """Return ``(media, caption)`` for an image in a plain-text reply, or None."""
+    return await _reply_image(agent_client.parse_reply(reply))
+
+
+async def _extract_voice_file(reply: str):
+    """Return ``(media, text)`` for a voice clip in a plain-text reply, or None."""
+    return await _reply_voice(agent_client.parse_reply(reply))
+
+
+def _clean_reply(reply: str | AgentReply) -> AgentReply:
+    """Strip citation tags from a reply's text and return it as an AgentReply."""
+    if isinstance(reply, AgentReply):
+        return reply.model_copy(update={"text": clean_openai_reply(reply.text)})
+    return agent_client.parse_reply(clean_openai_reply(reply))
+
+
+async def _send_agent_reply(target, chat_id, reply: AgentReply, is_message=True) -> AgentReply:
+    """Post a reply: its voice clip first, then a photo captioned with the
+    text (restyled per CAPTION_STYLE_MODE), or the text on its own.
+
+    Returns the reply as posted, with ``/fact`` expanded into its text.
+    """
+    if reply.command == "/fact":
         fact = await retrieve_fact()
-        extra = str(command_payload.get("caption", "")).strip()
-        if extra and trailing_text:
-            extra = f"{extra}\n\n{trailing_text}"
-        elif trailing_text:
-            extra = trailing_text
-        answer = f"{fact}\n\n{extra}".strip() if extra else fact
-
-    # If the reply contains a voice file path, send the voice first
-    voice = await _extract_voice_file(answer)
+        reply = reply.model_copy(update={"text": f"{fact}\n\n{reply.text}".strip(), "command": None})
+
+    voice = await _reply_voice(reply)
     if voice:
-        path, text = voice
-        voice_file = FSInputFile(path)
         try:
+            voice_file = _input_file(voice[0], "voice.ogg")
             if is_message:
                 await target.answer_voice(voice_file)
             else:
                 await target.send_voice(chat_id, voice_file)
         except Exception as e:
-            logging.error(f"Failed to send nudge voice to chat {chat_id}: {e}")
+            logging.error(f"Failed to send voice to chat {chat_id}: {e}")
+
+    image = await _reply_image(reply)
+    if image:
+        img_data, raw_caption = image
         try:
-            os.remove(path)
-        except Exception:
-            pass
-        answer = text
-
-    # If the reply contains a JSON payload with an image, send that directly
-    json_img = await _extract_json_image(answer)
-    if json_img:
-        img_data, raw_caption = json_img
-        if raw_caption:
-            try:
-                styled = await style_caption(raw_caption, chat_id=chat_id)
-            except Exception:
-                styled = raw_caption
-        else:
-            styled = ""
-        if isinstance(img_data, bytes):
-            photo = BufferedInputFile(img_data, filename="assistant.jpg")
-        else:
-            photo = FSInputFile(img_data)
+            photo = _input_file(img_data, "assistant.jpg")
+            await send_captioned_photo(target, chat_id, photo, raw_caption, is_message)
+        except Exception as e:
+            logging.error(f"Failed to send image to chat {chat_id}: {e}")
+    elif reply.text:
         try:
             if is_message:
-                await target.answer_photo(photo, caption=styled)
+                await target.answer(reply.text, parse_mode=ParseMode.HTML)
             else:
-                await target.send_photo(chat_id, photo, caption=styled)
+                await target.send_message(chat_id, reply.text, parse_mode=ParseMode.HTML)
         except Exception as e:
-            logging.error(f"Failed to send nudge image to chat {chat_id}: {e}")
-        if isinstance(img_data, str):
-            try:
-                os.remove(img_data)
-            except Exception:
-                pass
-        return
+            logging.error(f"Failed to send reply to chat {chat_id}: {e}")
+    return reply
 
-    try:
-        if is_message:
-            await target.answer(answer, parse_mode=ParseMode.HTML)
-        else:
-            await target.send_message(chat_id, answer, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logging.error(f"Failed to send nudge to chat {chat_id}: {e}")
 
-    if random.random() < IMAGE_SEND_CHANCE:
-        image_bytes = await generate_image_from_observation(answer)
-        if image_bytes:
-            try:
-                buffer = io.BytesIO(image_bytes)
-                buffer.seek(0)
-                image_file = BufferedInputFile(buffer.getvalue(), filename="observation.png")
-                if is_message:
-                    await target.answer_photo(image_file, caption=caption)
-                else:
-                    await target.send_photo(chat_id, image_file, caption=caption)
-            except Exception as e:
-                logging.error(f"Failed to send nudge image to chat {chat_id}: {e}")
+async def send_nudge_with_image(
+    target, chat_id, answer, caption="", is_message=True, *, image=None, generate_image=True
+):
+    """Send ``answer`` as a nudge and, for plain text, attach an image.
+
+    ``image`` is an already generated picture (media handle); without one an
+    image is queued for generation by chance unless ``generate_image`` is off.
+    """
+    reply = await _send_agent_reply(target, chat_id, agent_client.parse_reply(answer), is_message)
+    if reply.image or reply.voice or reply.command:
+        return
+    if image:
+        try:
+            photo = _input_file(image, "observation.jpg")
+            if is_message:
+                await target.answer_photo(photo, caption=caption)
+            else:
+                await target.send_photo(chat_id, photo, caption=caption)
+        except Exception as e:
+            logging.error(f"Failed to send nudge image to chat {chat_id}: {e}")
+    elif (
+        generate_image
+        and usage_ledger.budget_state(chat_id) == "ok"
+        and random.random() < IMAGE_SEND_CHANCE
+    ):
+        enqueue_image_job(target, chat_id, reply.text, caption=caption, is_message=is_message)
 
 
 @dp.message(F.text)
@@ -584,6 +961,8 @@ async def handle_message(message: Message):
     last_time = last_activity_time.get(chat_id)
     last_activity_time[chat_id] = datetime.now()
     messages_since_bot_reply[chat_id] = messages_since_bot_reply.get(chat_id, 0) + 1
+    # Silent bots are candidates in chime-in elections too
+    bot_bus.mark_seen(chat_id, BOT_USERNAME)
 
     # Clear stale history after a long silence so the bot starts fresh
     if last_time and (datetime.now() - last_time).total_seconds() / 60 >= INACTIVITY_CLEAR_MINUTES:
@@ -609,17 +988,8 @@ async def handle_message(message: Message):
         date = date_arg[1] if len(date_arg) > 1 else ""
         try:
             img_data, caption = await get_picture_of_the_day(date)
-            styled = await style_caption(caption, chat_id=chat_id)
-            if isinstance(img_data, bytes):
-                photo = BufferedInputFile(img_data, filename="potd.jpg")
-            else:
-                photo = FSInputFile(img_data)
-            await message.answer_photo(photo, caption=styled)
-            if isinstance(img_data, str):
-                try:
-                    os.remove(img_data)
-                except Exception:
-                    pass
+            photo = _input_file(img_data, "potd.jpg")
+            await send_captioned_photo(message, chat_id, photo, caption)
             mark_bot_replied(chat_id)
         except Exception as e:
             await message.answer(f"Error: {e}")
@@ -628,14 +998,9 @@ async def handle_message(message: Message):
         if not await try_claim_message(message):
             return
         try:
-            path = await retrieve_joke()
-            photo = FSInputFile(path)
-            await message.answer_photo(photo)
+            media = await retrieve_joke()
+            await message.answer_photo(_input_file(media, "meme.jpg"))
             mark_bot_replied(chat_id)
-            try:
-                os.remove(path)
-            except Exception:
-                pass
         except Exception as e:
             await message.answer(f"Error: {e}")
         return
@@ -658,19 +1023,15 @@ async def handle_message(message: Message):
             return
         text = parts[1]
         try:
-            path = await generate_voice_file(text)
-            voice = FSInputFile(path)
+            handle = await generate_voice_file(text, chat_id)
+            voice = _input_file(handle, "voice.ogg")
             logging.debug(
                 "answer_voice: sending file %s (%d bytes)",
-                path,
-                os.path.getsize(path),
+                voice.path,
+                os.path.getsize(voice.path),
             )
             await message.answer_voice(voice)
             mark_bot_replied(chat_id)
-            try:
-                os.remove(path)
-            except Exception:
-                pass
         except Exception as e:
             await message.answer(f"Error: {e}")
         return
@@ -688,51 +1049,21 @@ async def handle_message(message: Message):
             username=username,
             chat_id=chat_id,
             tool_choice=tool_choice,
+            structured=True,
         )
-        voice = await _extract_voice_file(answer)
-        if voice is None and tool_choice == "generate_voice":
-            try:
-                path = await generate_voice_file(answer)
-                voice = (path, "")
-            except Exception:
-                voice = None
-
-        if voice:
-            path, text = voice
-            voice_file = FSInputFile(path)
-            await message.answer_voice(voice_file)
-            mark_bot_replied(chat_id)
+        reply = agent_client.parse_reply(answer)
+        if reply.voice is None and tool_choice == "generate_voice":
             try:
-                os.remove(path)
+                handle = await generate_voice_file(reply.text, chat_id)
+                reply = reply.model_copy(update={"voice": handle, "text": ""})
             except Exception:
                 pass
-            answer = text
-        json_img = await _extract_json_image(answer)
-        if json_img:
-            img_data, raw_caption = json_img
-            styled = raw_caption
-            if raw_caption:
-                try:
-                    styled = await style_caption(raw_caption, chat_id=chat_id)
-                except Exception:
-                    pass
-            if isinstance(img_data, bytes):
-                photo = BufferedInputFile(img_data, filename="assistant.jpg")
-            else:
-                photo = FSInputFile(img_data)
-            await message.answer_photo(photo, caption=styled)
-            if isinstance(img_data, str):
-                try:
-                    os.remove(img_data)
-                except Exception:
-                    pass
-            mark_bot_replied(chat_id)
-        else:
-            mark_bot_replied(chat_id)
-            await message.answer(answer, parse_mode=ParseMode.HTML)
+
+        mark_bot_replied(chat_id)
+        reply = await _send_agent_reply(message, chat_id, reply)
         # Broadcast reply to bot bus so other bots can see it
-        if answer:
-            bot_bus.broadcast(chat_id, BOT_USERNAME, answer)
+        if reply.text:
+            bot_bus.broadcast(chat_id, BOT_USERNAME, reply.text)
         # Reset unmentioned counter since bot was mentioned
         bot_unmentioned_count[chat_id] = 0
         return
@@ -752,6 +1083,9 @@ async def handle_message(message: Message):
     # Don't respond if we've hit the unmentioned reply limit
     if bot_unmentioned >= MAX_UNMENTIONED_REPLIES:
         return
+    # Chime-ins are optional work: none once the chat is over its hard budget
+    if usage_ledger.budget_state(chat_id) == "hard":
+        return
 
     # Determine if bot should respond based on various factors
     should_respond = False
@@ -764,6 +1098,9 @@ async def handle_message(message: Message):
         and (now - last_bot_time).total_seconds() <= RECENT_ACTIVITY_SECONDS
     ):
         should_respond = True
+    elif not _chime_in_elected(message):
+        # Another bot was elected to consider chiming in on this message
+        return
     else:
         # Probabilistic response based on message count since last bot message
         if non_bot_count == 0:
@@ -779,6 +1116,15 @@ async def handle_message(message: Message):
 
     if not should_respond:
         return
+    if not chime_gate.allow(message.text, non_bot_count):
+        logging.info(
+            f"[chime_gate] Skipped low-relevance message in chat {chat_id} "
+            f"({chime_gate.stats()['avoided']} LLM calls avoided)"
+        )
+        return
+    if not _claim_chime_in_slot(message):
+        logging.info(f"[claim] {BOT_USERNAME} found all chime-in slots taken in chat {chat_id}")
+        return
 
     # Increment unmentioned counter since we're replying without being mentioned
     bot_unmentioned_count[chat_id] = bot_unmentioned + 1
@@ -791,74 +1137,116 @@ async def handle_message(message: Message):
         {"role": "system", "content": CHAT_REACT_PROMPT},
     ]
     try:
-        raw_answer = await ask_agent(message_list, chat_id=chat_id, tool_choice=tool_choice)
-        answer = clean_openai_reply(raw_answer)
+        raw_answer = await ask_agent(
+            message_list, chat_id=chat_id, tool_choice=tool_choice, structured=True,
+            request_class="chime_in",
+        )
     except Exception as e:
-        answer = f"OpenAI error: {e}"
-    voice = await _extract_voice_file(answer)
-    if voice:
-        path, text = voice
-        voice_file = FSInputFile(path)
-        await message.answer_voice(voice_file)
-        mark_bot_replied(chat_id)
-        try:
-            os.remove(path)
-        except Exception:
-            pass
-        answer = text
-    json_img = await _extract_json_image(answer)
-    if json_img:
-        img_data, raw_caption = json_img
-        styled = raw_caption
-        if raw_caption:
-            try:
-                styled = await style_caption(raw_caption, chat_id=chat_id)
-            except Exception:
-                pass
-        if isinstance(img_data, bytes):
-            photo = BufferedInputFile(img_data, filename="assistant.jpg")
-        else:
-            photo = FSInputFile(img_data)
-        await message.answer_photo(photo, caption=styled)
-        if isinstance(img_data, str):
-            try:
-                os.remove(img_data)
-            except Exception:
-                pass
-        mark_bot_replied(chat_id)
-    else:
-        mark_bot_replied(chat_id)
-        await message.answer(answer, parse_mode=ParseMode.HTML)
+        raw_answer = f"OpenAI error: {e}"
+    mark_bot_replied(chat_id)
+    reply = await _send_agent_reply(message, chat_id, _clean_reply(raw_answer))
     # Broadcast probabilistic reply to bot bus
-    if answer:
-        bot_bus.broadcast(chat_id, BOT_USERNAME, answer)
+    if reply.text:
+        bot_bus.broadcast(chat_id, BOT_USERNAME, reply.text)
 
 
 @dp.message(F.photo)
 async def handle_photo(message: Message):
     if message.from_user and message.from_user.is_bot:
         return
-    if not await try_claim_message(message):
+    group_id = message.media_group_id
+    if group_id:
+        # Albums arrive as one update per photo: the first one waits for the
+        # rest and answers them all in one request
+        album = _media_groups.setdefault(group_id, [])
+        album.append(message)
+        if len(album) > 1:
+            return
+        await asyncio.sleep(MEDIA_GROUP_WINDOW)
+        messages = sorted(_media_groups.pop(group_id), key=lambda m: m.message_id)
+    else:
+        messages = [message]
+    if not await try_claim_message(messages[0]):
         return
-    print(f"Received photo from {message.from_user.username or message.from_user.id}")
-    photo = message.photo[-1]  # Get the highest resolution photo
-    photo_bytes = await bot.download(photo)
-    image_bytes = photo_bytes.read()
-    prompt = message.caption if message.caption else IMAGE_DEFAULT_PROMPT
-    chat_id = message.chat.id
+    print(
+        f"Received {len(messages)} photo(s) from "
+        f"{message.from_user.username or message.from_user.id}"
+    )
+    await _answer_photos(messages)
+
+
+async def _photo_parts(
+    photo, full_image: bool, *, chat_id: int, describe: bool = True
+) -> list[dict]:
+    """Return agent content parts for a Telegram photo, downloading only if needed.
+
+    Without ``describe`` a photo with no cached description is sent whole
+    instead of paying for a separate description call.
+    """
+    unique_id = photo.file_unique_id
+    description = _cached_image_description(unique_id)
+    if description is None and not describe:
+        full_image = True
+    image_bytes = None
+    if description is None or (full_image and _cached_vision_file(unique_id) is None):
+        photo_bytes = await bot.download(photo)
+        image_bytes = photo_bytes.read()
+    if description is None and describe:
+        try:
+            description = await describe_image(image_bytes, unique_id, chat_id)
+        except Exception as e:
+            logging.warning(f"[vision] Describing photo failed, sending it whole: {e}")
+            full_image = True
+    return await _image_parts(image_bytes, unique_id, description, full_image, chat_id)
+
+
+async def _answer_photos(messages: list[Message]) -> None:
+    """Answer one photo or a whole album with a single agent request.
+
+    Album photos are not described one by one; those without a cached
+    description go into the request as images, so an album costs one call.
+    """
+    first = messages[0]
+    caption = next((m.caption for m in messages if m.caption), None)
+    full_image = _needs_full_image(caption)
+    prompt = caption if caption else IMAGE_DEFAULT_PROMPT
+    chat_id = first.chat.id
     last_activity_time[chat_id] = datetime.now()
     messages_since_bot_reply[chat_id] = messages_since_bot_reply.get(chat_id, 0) + 1
-    answer = await ask_openai_image(image_bytes, prompt, chat_id=chat_id)
+    try:
+        contents = [{"type": "input_text", "text": prompt}]
+        for m in messages:
+            contents += await _photo_parts(
+                _pick_photo_size(m.photo), full_image, chat_id=chat_id,
+                describe=len(messages) == 1,
+            )
+    except Exception as e:
+        answer = f"OpenAI error: {e}"
+    else:
+        answer = await ask_openai_contents(chat_id, contents, request_class="photo")
     mark_bot_replied(chat_id)
-    await message.reply(answer)
+    await first.reply(answer)
 
 
-async def get_picture_of_the_day(date: str = "") -> tuple[str | bytes, str]:
-    """Fetch picture of the day via MCP tool and return image path and caption.
+async def get_picture_of_the_day(date: str = "") -> tuple[bytes, str]:
+    """Return the picture of the day image bytes and caption.
 
-    The MCP server now returns a direct URL, which is downloaded and saved to
-    ``/tmp``. The file path is returned along with the caption.
+    Results are kept in memory per date, so only the first request of the day
+    (normally the prefetch job) talks to the MCP server. The image is read
+    from the media store when the server returned a handle of its prefetched
+    copy, otherwise it is downloaded from the returned URL. Raises
+    ``ValueError`` unless ``date`` is empty or ``YYYY-MM-DD``.
     """
+    if date:
+        try:
+            date = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"date must be YYYY-MM-DD, got {date!r}") from None
+    key = date or datetime.now().strftime("%Y-%m-%d")
+    cached = _potd_cache.get(key)
+    if cached:
+        return cached[1], cached[2]
+
     async with sse_client(MCP_SERVER_URL) as (read, write):
         async with ClientSession(read, write) as session:
             await session.initialize()
@@ -866,19 +1254,57 @@ async def get_picture_of_the_day(date: str = "") -> tuple[str | bytes, str]:
                 "get_picture_of_the_day", {"date": date}
             )
             data = json.loads(resp.content[0].text)
-            url = data.get("url") or data.get("image_url")
-            caption = data.get("caption", "")
-            if not url:
-                raise ValueError("no url returned")
-            path = await download_image_to_tmp(url)
-            return path, caption
+    url = data.get("url") or data.get("image_url")
+    caption = data.get("caption", "")
+    if not url:
+        raise ValueError("no url returned")
+
+    handle = data.get("image")
+    if media_store.exists(handle or ""):
+        image = media_store.read(handle)
+    else:
+        image = await download_image_bytes(url)
+
+    _potd_cache[key] = (url, image, caption)
+    for stale in sorted(_potd_cache)[:-POTD_CACHE_DAYS]:
+        del _potd_cache[stale]
+    return image, caption
+
+
+def _cached_potd_image(url: str) -> bytes | None:
+    """Return prefetched picture-of-the-day bytes for ``url`` if present."""
+    for cached_url, image, _caption in _potd_cache.values():
+        if cached_url == url:
+            return image
+    return None
+
+
+async def prefetch_potd_daily():
+    """Warm the picture of the day cache at startup and after each midnight."""
+    try:
+        while True:
+            try:
+                _, caption = await get_picture_of_the_day()
+                logging.info("[potd] Prefetched picture of the day")
+                if caption and CAPTION_STYLE_MODE != "off":
+                    await style_caption(caption)  # for every chat, recorded as shared
+            except Exception as e:
+                logging.warning(f"[potd] Prefetch failed: {e}")
+                await asyncio.sleep(15 * 60)
+                continue
+            now = datetime.now()
+            tomorrow = datetime.combine(now.date() + timedelta(days=1), time(0, 10))
+            await asyncio.sleep((tomorrow - now).total_seconds())
+    except asyncio.CancelledError:
+        logging.info("[potd] Prefetch loop cancelled.")
+        raise
 
 
-async def retrieve_joke() -> str:
+async def retrieve_joke() -> bytearray | str:
     """Fetch a random meme image via the MCP tool.
 
-    The MCP server returns the original image URL. This function downloads the
-    image to ``/tmp`` and returns the local file path.
+    The MCP server hands out an already downloaded image from its reservoir
+    as a media handle. A URL (fallback image) is downloaded instead.
     """
 
     async with sse_client(MCP_SERVER_URL) as (read, write):
@@ -887,10 +1313,11 @@ async def retrieve_joke() -> str:
             resp = await session.call_tool("retrieve_joke", {})
             if not resp.content:
                 raise ValueError("no data returned")
-            url = resp.content[0].text
+            result = resp.content[0].text
 
-    path = await download_image_to_tmp(url)
-    return path
+    if media_store.exists(result):
+        return result
+    return await download_media(result)
 
 
 async def retrieve_fact() -> str:
@@ -905,8 +1332,12 @@ async def retrieve_fact() -> str:
             return resp.content[0].text.strip()
 
 
-async def generate_voice_file(text: str) -> str:
-    """Generate a voice message via MCP and return the local file path."""
+async def generate_voice_file(text: str, chat_id: int | None = None) -> str:
+    """Generate a voice message via MCP and return its media handle.
+
+    TTS characters are recorded against ``chat_id`` only when the server
+    synthesized the clip, not when it came from the voice cache.
+    """
 
     logging.debug("generate_voice_file: requesting voice for text %r", text)
     async with sse_client(MCP_SERVER_URL) as (read, write):
@@ -915,29 +1346,116 @@ async def generate_voice_file(text: str) -> str:
             resp = await session.call_tool("generate_voice", {"text": text})
             if not resp.content:
                 raise ValueError("no data returned")
-            path = resp.content[0].text
-    logging.debug("generate_voice_file: received path %s", path)
-    return path
+            handle = resp.content[0].text
+            synthesized = (resp.content[0].meta or {}).get("synthesized", True)
+    logging.debug("generate_voice_file: received %s", handle)
+    if synthesized:
+        usage_ledger.record(chat_id, "voice", tts_chars=len(text))
+    return handle
+
+
+def _caption_style_key(caption: str) -> tuple[str, str]:
+    import hashlib
 
+    return BOT_USERNAME, hashlib.sha256(caption.encode()).hexdigest()
 
-async def style_caption(caption: str, *, chat_id: int) -> str:
-    """Rewrite ``caption`` using the bot's system prompt for style."""
+
+async def _restyle_caption(caption: str, chat_id: int | None) -> str:
+    global _caption_style_slot
+    if _caption_style_slot is None:
+        _caption_style_slot = asyncio.Semaphore(1)
     prompt = (
         "Rewrite the following picture caption in your own style, keeping the "
-        f"same meaning:\n{caption}"
+        f"same meaning. Reply with the caption only.\n{caption}"
+    )
+    async with _caption_style_slot:
+        response = await openai_client.responses.create(
+            model=CAPTION_STYLE_MODEL,
+            instructions=load_system_prompt() or None,
+            input=prompt,
+        )
+    usage_ledger.record_usage(
+        chat_id, "caption", CAPTION_STYLE_MODEL, getattr(response, "usage", None)
     )
-    return await ask_openai(prompt, chat_id=chat_id)
+    return clean_openai_reply(response.output_text) or caption
+
+
+async def style_caption(caption: str, chat_id: int | None = None) -> str:
+    """Rewrite ``caption`` in the bot's persona.
+
+    The rewrite is a separate call with only the system prompt, so chat
+    histories are untouched. Results are cached per persona and caption, and
+    concurrent requests for the same caption share one call, recorded against
+    the ``chat_id`` that started it (None for cross-chat prefetches). The raw
+    caption is returned if restyling fails.
+    """
+    key = _caption_style_key(caption)
+    styled = _styled_captions.get(key)
+    if styled is not None:
+        return styled
+    task = _caption_style_flights.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_restyle_caption(caption, chat_id))
+        _caption_style_flights[key] = task
+        task.add_done_callback(lambda _: _caption_style_flights.pop(key, None))
+    try:
+        styled = await asyncio.shield(task)
+    except Exception as e:
+        logging.warning(f"[caption] Restyling failed, keeping the original: {e}")
+        return caption
+    _styled_captions[key] = styled
+    while len(_styled_captions) > CAPTION_STYLE_CACHE_MAX:
+        del _styled_captions[next(iter(_styled_captions))]
+    return styled
+
+
+async def _edit_in_styled_caption(sent, caption: str, chat_id: int) -> None:
+    styled = await style_caption(caption, chat_id)
+    if styled == caption:
+        return
+    try:
+        await sent.edit_caption(caption=styled)
+    except Exception as e:
+        logging.warning(f"[caption] Failed to edit caption in chat {sent.chat.id}: {e}")
+
+
+async def send_captioned_photo(target, chat_id, photo, caption: str, is_message=True):
+    """Send ``photo`` with ``caption`` restyled according to CAPTION_STYLE_MODE.
+
+    In ``edit`` mode a caption not styled yet is sent as is and replaced by
+    the styled one in the background, so the photo is not held back by the
+    restyle call.
+    """
+    restyle_later = False
+    if caption and CAPTION_STYLE_MODE != "off":
+        if CAPTION_STYLE_MODE == "wait" or _caption_style_key(caption) in _styled_captions:
+            caption = await style_caption(caption, chat_id)
+        else:
+            restyle_later = True
+    if is_message:
+        sent = await target.answer_photo(photo, caption=caption)
+    else:
+        sent = await target.send_photo(chat_id, photo, caption=caption)
+    if restyle_later and sent is not None:
+        task = asyncio.create_task(_edit_in_styled_caption(sent, caption, chat_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return sent
 
 
-async def generate_image_from_observation(observation: str) -> bytes:
+async def generate_image_from_observation(
+    observation: str, size: str = "1024x1024", quality: str | None = None
+) -> bytes:
     """Enhance observation and generate an image using OpenAI Images API."""
+    extra = {"quality": quality} if quality else {}
     try:
         response = await _openai_images_client.images.generate(
             model=IMAGE_GEN_MODEL,
             prompt=IMAGE_GEN_INPUT_PROMPT.format(observation=observation),
             n=1,
-            size="1024x1024",
+            size=size,
             response_format="b64_json",
+            **extra,
         )
         if response.data and response.data[0].b64_json:
             return base64.b64decode(response.data[0].b64_json)
@@ -947,6 +1465,103 @@ async def generate_image_from_observation(observation: str) -> bytes:
         return None
 
 
+def _image_job_queue() -> asyncio.Queue:
+    """Return the job queue, (re)starting workers bound to the running loop."""
+    global _image_jobs
+    loop = asyncio.get_running_loop()
+    if _image_jobs is None or not _image_workers or _image_workers[0].get_loop() is not loop:
+        _image_jobs = asyncio.Queue(maxsize=IMAGE_JOB_QUEUE_MAX)
+        _image_job_chats.clear()
+        _image_workers[:] = [
+            asyncio.create_task(_image_job_worker(_image_jobs)) for _ in range(IMAGE_JOB_WORKERS)
+        ]
+    return _image_jobs
+
+
+def _image_hourly_slot(take: bool = True) -> bool:
+    """Return whether an image may start under IMAGE_JOBS_PER_HOUR, counting it if ``take``."""
+    import time as _time
+
+    now = _time.monotonic()
+    while _image_job_starts and now - _image_job_starts[0] > 3600:
+        _image_job_starts.popleft()
+    if len(_image_job_starts) >= IMAGE_JOBS_PER_HOUR:
+        return False
+    if take:
+        _image_job_starts.append(now)
+    return True
+
+
+def enqueue_image_job(target, chat_id, observation, caption="", is_message=True) -> bool:
+    """Queue an image for ``observation`` to be sent to the chat once it is ready.
+
+    Returns False when the chat already waits for an image, the queue is full
+    or the hourly cap is reached.
+    """
+    import time as _time
+
+    queue = _image_job_queue()
+    if chat_id in _image_job_chats:
+        reason = "pending"
+    elif not _image_hourly_slot(take=False):
+        reason = "hourly cap"
+    elif queue.full():
+        reason = "queue full"
+    else:
+        queue.put_nowait((_time.monotonic(), target, chat_id, observation, caption, is_message))
+        _image_job_chats.add(chat_id)
+        _image_hourly_slot()
+        _image_job_stats["queued"] += 1
+        return True
+    _image_job_stats["dropped"] += 1
+    logging.info(f"[image_jobs] Dropped image for chat {chat_id}: {reason}")
+    return False
+
+
+async def _image_job_worker(queue: asyncio.Queue) -> None:
+    import time as _time
+
+    while True:
+        queued_at, target, chat_id, observation, caption, is_message = await queue.get()
+        try:
+            started = _time.monotonic()
+            size, quality = IMAGE_GEN_BUSY_TIER if queue.qsize() else IMAGE_GEN_TIER
+            image_bytes = await generate_image_from_observation(observation, size=size, quality=quality)
+            wait_ms = int((started - queued_at) * 1000)
+            gen_ms = int((_time.monotonic() - started) * 1000)
+            _image_job_stats["wait_ms"] += wait_ms
+            _image_job_stats["max_wait_ms"] = max(_image_job_stats["max_wait_ms"], wait_ms)
+            _image_job_stats["gen_ms"] += gen_ms
+            _image_job_stats["max_gen_ms"] = max(_image_job_stats["max_gen_ms"], gen_ms)
+            if not image_bytes:
+                _image_job_stats["failed"] += 1
+                continue
+            usage_ledger.record(chat_id, "nudge_image", images=1, image_quality=quality)
+            image_bytes, ext = await image_pipeline.encode_for_telegram(image_bytes)
+            image_file = _input_file(image_bytes, f"observation.{ext}")
+            if is_message:
+                await target.answer_photo(image_file, caption=caption)
+            else:
+                await target.send_photo(chat_id, image_file, caption=caption)
+            _image_job_stats["done"] += 1
+            logging.info(
+                "[image_jobs] chat %s: %s %s image, waited %d ms, generated in %d ms",
+                chat_id, size, quality, wait_ms, gen_ms,
+            )
+        except Exception as e:
+            _image_job_stats["failed"] += 1
+            logging.error(f"Failed to send nudge image to chat {chat_id}: {e}")
+        finally:
+            _image_job_chats.discard(chat_id)
+            queue.task_done()
+
+
+async def drain_image_jobs() -> None:
+    """Wait until every queued image has been generated and delivered."""
+    if _image_jobs is not None:
+        await _image_jobs.join()
+
+
 async def nudge_inactive_chats(
     force: bool = False, force_chat_id: int = None, force_message=None
 ):
@@ -954,97 +1569,303 @@ async def nudge_inactive_chats(
         # Manual nudge for a specific chat
         system_prompt = get_nudge_prompt(force_chat_id)
         message_list = [{"role": "system", "content": system_prompt}]
-        raw_answer = await ask_agent(message_list, chat_id=force_chat_id)
-        answer = clean_openai_reply(raw_answer)
+        raw_answer = await ask_agent(
+            message_list, chat_id=force_chat_id, structured=True, request_class="nudge"
+        )
+        answer = _clean_reply(raw_answer)
         mark_bot_replied(force_chat_id)
         await send_nudge_with_image(
             force_message, force_chat_id, answer, is_message=True
         )
-        if answer:
-            bot_bus.broadcast(force_chat_id, BOT_USERNAME, answer)
+        if answer.text:
+            bot_bus.broadcast(force_chat_id, BOT_USERNAME, answer.text)
         return
-    global nudge_loop_started_at
-    last_reset = datetime.now()
+    global nudge_loop_started_at, _nudge_wakeup, _nudge_slots
+    import time as _time
+
     if nudge_loop_started_at is None:
         nudge_loop_started_at = datetime.now()
-    logging.info(f"[nudge] Starting nudge loop. NUDGE_ENABLED_CHATS={NUDGE_ENABLED_CHATS}, NUDGE_MINUTES={NUDGE_MINUTES}, Active hours: {ACTIVE_START}-{ACTIVE_END} {BOT_TIMEZONE}")
+    logging.info(f"[nudge] Starting nudge scheduler. NUDGE_ENABLED_CHATS={NUDGE_ENABLED_CHATS}, NUDGE_MINUTES={NUDGE_MINUTES}, Active hours: {ACTIVE_START}-{ACTIVE_END} {BOT_TIMEZONE}")
+    _nudge_wakeup = asyncio.Event()
+    _nudge_slots = asyncio.Semaphore(NUDGE_MAX_CONCURRENT)
+    _nudge_heap.clear()
+    for chat_id in NUDGE_ENABLED_CHATS:
+        _arm_nudge(chat_id)
+    next_reset = _time.monotonic() + NUDGE_RESET_INTERVAL
     while True:
         try:
-            current_time = datetime.now(BOT_TIMEZONE).time()
-            if not is_active_hours():
-                logging.info(f"[nudge] Outside active hours (current: {current_time}), sleeping...")
-                await asyncio.sleep(NUDGE_CHECK_INTERVAL)
-                continue
-            logging.info(f"[nudge] Active hours check passed (current: {current_time})")
-            now = datetime.now()
+            now = _time.monotonic()
             # Reset bot_unmentioned_count every 5 minutes
-            if (now - last_reset).total_seconds() >= NUDGE_RESET_INTERVAL:
+            if now >= next_reset:
                 bot_unmentioned_count.clear()
-                last_reset = now
-            all_chats = set(agent_client._histories.keys()) | set(last_activity_time.keys()) | NUDGE_ENABLED_CHATS
-            logging.debug(f"[nudge] Checking {len(all_chats)} chats: {all_chats}")
-            for chat_id in all_chats:
-                if chat_id not in NUDGE_ENABLED_CHATS:
-                    logging.debug(f"[nudge] Skipping chat {chat_id} - not in enabled list")
-                    continue
-                last_time = last_activity_time.get(chat_id)
-                if last_time is None:
-                    # No activity recorded (e.g. just restarted) — seed
-                    # with current time so the nudge timer starts counting
-                    last_activity_time[chat_id] = now
-                    continue
+                next_reset = now + NUDGE_RESET_INTERVAL
+            while _nudge_heap and _nudge_heap[0][0] <= now:
+                _, chat_id, action = heapq.heappop(_nudge_heap)
+                if action == "prepare":
+                    _start_nudge_prepare(chat_id)
                 else:
-                    minutes_passed = (now - last_time).total_seconds() / 60
-                logging.info(f"[nudge] Chat {chat_id}: {minutes_passed:.1f} minutes since last message (threshold: {NUDGE_MINUTES})")
-                # Don't nudge until NUDGE_MINUTES has passed since startup
-                minutes_since_start = (now - nudge_loop_started_at).total_seconds() / 60
-                if minutes_since_start < NUDGE_MINUTES:
-                    logging.debug(f"[nudge] Chat {chat_id}: skipping — only {minutes_since_start:.1f} min since startup")
-                    continue
-                if minutes_passed >= NUDGE_MINUTES:
-                    # Check bus for recent activity from any bot
-                    import time as _time
-                    last_bus_ts = bot_bus.last_message_time(chat_id)
-                    if last_bus_ts is not None:
-                        bus_age_min = (_time.time() - last_bus_ts) / 60
-                        if bus_age_min < NUDGE_MINUTES:
-                            logging.info(f"[nudge] Skipping chat {chat_id} — bus activity {bus_age_min:.0f} min ago")
-                            continue
-                    # Random delay so the fastest bot broadcasts before others check
-                    await asyncio.sleep(random.uniform(5, 60))
-                    # Re-check bus after delay — another bot may have nudged
-                    last_bus_ts = bot_bus.last_message_time(chat_id)
-                    if last_bus_ts is not None:
-                        bus_age_min = (_time.time() - last_bus_ts) / 60
-                        if bus_age_min < NUDGE_MINUTES:
-                            logging.info(f"[nudge] Skipping chat {chat_id} — bus activity {bus_age_min:.0f} min ago (after delay)")
-                            continue
-                    try:
-                        logging.info(f"[nudge] Sending automatic nudge to chat {chat_id}")
-                        agent_client.clear_history(chat_id)
-                        system_prompt = get_nudge_prompt(chat_id)
-                        message_list = [{"role": "system", "content": system_prompt}]
-                        raw_answer = await ask_agent(message_list, chat_id=chat_id)
-                        answer = clean_openai_reply(raw_answer)
-                        mark_bot_replied(chat_id)
-                        await send_nudge_with_image(
-                            bot, chat_id, answer, caption="", is_message=False
-                        )
-                        if answer:
-                            bot_bus.broadcast(chat_id, BOT_USERNAME, answer)
-                        logging.info(f"[nudge] Nudge sent to chat {chat_id}")
-                    except Exception as e:
-                        logging.error(f"[nudge] Error sending nudge to chat {chat_id}: {e}", exc_info=True)
-                        continue
-            await asyncio.sleep(NUDGE_CHECK_INTERVAL)  # Check every minute
+                    _check_nudge(chat_id)
+            wake_at = min(next_reset, _nudge_heap[0][0]) if _nudge_heap else next_reset
+            _nudge_wakeup.clear()
+            try:
+                await asyncio.wait_for(_nudge_wakeup.wait(), max(0.0, wake_at - _time.monotonic()))
+            except TimeoutError:
+                pass
         except asyncio.CancelledError:
             logging.info("[nudge] Nudge loop cancelled, shutting down.")
+            for task in list(_nudge_tasks):
+                task.cancel()
             raise
         except Exception as e:
             logging.error(f"[nudge] Unexpected error in nudge loop: {e}", exc_info=True)
             await asyncio.sleep(NUDGE_CHECK_INTERVAL)  # Sleep before retry
 
 
+def _push_nudge(chat_id: int, delay: float, action: str = "nudge") -> None:
+    """Fire a timer for ``chat_id`` after ``delay`` seconds."""
+    import time as _time
+
+    heapq.heappush(_nudge_heap, (_time.monotonic() + max(0.0, delay), chat_id, action))
+    if _nudge_wakeup is not None:
+        _nudge_wakeup.set()
+
+
+def _arm_nudge(chat_id: int) -> None:
+    """Schedule the next nudge NUDGE_MINUTES after the chat's last activity.
+
+    Chats without recorded activity (e.g. just after a restart) start
+    counting now; nothing is due before NUDGE_MINUTES after startup.
+    """
+    now = datetime.now()
+    last_time = last_activity_time.setdefault(chat_id, now)
+    since = max(last_time, nudge_loop_started_at or now)
+    due = since + timedelta(minutes=NUDGE_MINUTES)
+    delay = (due - now).total_seconds()
+    _push_nudge(chat_id, delay)
+    if NUDGE_PREPARE_LEAD_SECONDS > 0 and delay > 0:
+        _push_nudge(chat_id, delay - NUDGE_PREPARE_LEAD_SECONDS, "prepare")
+
+
+def _active_at(moment: datetime) -> bool:
+    """Return whether the local time ``moment`` falls within active hours."""
+    return ACTIVE_START <= moment.astimezone(BOT_TIMEZONE).time() <= ACTIVE_END
+
+
+def _seconds_until_active_hours(moment: datetime | None = None) -> float:
+    now = moment.astimezone(BOT_TIMEZONE) if moment else datetime.now(BOT_TIMEZONE)
+    start = now.replace(hour=ACTIVE_START.hour, minute=ACTIVE_START.minute, second=0, microsecond=0)
+    if start <= now:
+        start += timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+def _bus_quiet_seconds(chat_id: int) -> float:
+    """Return how long until the bus has been quiet for NUDGE_MINUTES (0 if it has)."""
+    import time as _time
+
+    last_bus_ts = bot_bus.last_message_time(chat_id)
+    if last_bus_ts is None:
+        return 0.0
+    return max(0.0, last_bus_ts + NUDGE_MINUTES * 60 - _time.time())
+
+
+def _check_nudge(chat_id: int) -> None:
+    """Handle a fired timer: start the nudge if it is still due, else re-arm."""
+    now = datetime.now()
+    minutes_passed = (now - last_activity_time.get(chat_id, now)).total_seconds() / 60
+    minutes_since_start = (now - nudge_loop_started_at).total_seconds() / 60
+    if minutes_passed < NUDGE_MINUTES or minutes_since_start < NUDGE_MINUTES:
+        # Activity since the timer was armed, or still in the startup grace
+        _arm_nudge(chat_id)
+        return
+    if not is_active_hours():
+        _push_nudge(chat_id, _seconds_until_active_hours())
+        return
+    quiet_in = _bus_quiet_seconds(chat_id)
+    if quiet_in > 0:
+        logging.info(f"[nudge] Skipping chat {chat_id} — recent bus activity")
+        _push_nudge(chat_id, quiet_in)
+        return
+    if not leases.acquire(
+        _nudge_lease(chat_id), BOT_USERNAME, NUDGE_LEASE_TTL, turn_grace=NUDGE_TURN_GRACE
+    ):
+        # Another bot nudges this window (or it is its turn); check again shortly
+        _push_nudge(chat_id, NUDGE_LEASE_RETRY)
+        return
+    task = asyncio.create_task(_send_auto_nudge(chat_id))
+    _nudge_tasks.add(task)
+    task.add_done_callback(_nudge_tasks.discard)
+
+
+def _nudge_lease(chat_id: int) -> str:
+    return f"nudge_{chat_id}"
+
+
+def _nudge_send_time(chat_id: int) -> datetime:
+    """Return when ``chat_id`` would be nudged if it stays quiet.
+
+    That is NUDGE_MINUTES after its last activity, or the next start of
+    active hours if the deadline falls outside them.
+    """
+    now = datetime.now()
+    since = max(last_activity_time.get(chat_id, now), nudge_loop_started_at or now)
+    due = max(now, since + timedelta(minutes=NUDGE_MINUTES))
+    if _active_at(due):
+        return due
+    return due + timedelta(seconds=_seconds_until_active_hours(due))
+
+
+def _start_nudge_prepare(chat_id: int) -> None:
+    """Start preparing ``chat_id``'s nudge once it is due within the lead time.
+
+    A prepare timer armed before newer activity, or for a nudge that will
+    only go out when active hours start, is pushed back instead.
+    """
+    wait = (_nudge_send_time(chat_id) - datetime.now()).total_seconds()
+    if wait > NUDGE_PREPARE_LEAD_SECONDS:
+        _push_nudge(chat_id, wait - NUDGE_PREPARE_LEAD_SECONDS, "prepare")
+        return
+    if chat_id in _preparing or _take_prepared_nudge(chat_id, keep=True):
+        return
+    if leases.turn(_nudge_lease(chat_id)) not in (None, BOT_USERNAME):
+        return  # another bot is next to nudge this chat
+    _preparing.add(chat_id)
+    task = asyncio.create_task(_prepare_nudge(chat_id))
+    _nudge_tasks.add(task)
+    task.add_done_callback(_nudge_tasks.discard)
+
+
+async def _prepare_nudge(chat_id: int) -> None:
+    """Generate ``chat_id``'s next nudge, media included, in the background lane.
+
+    Media is resolved into the media store and the caption styled ahead, so
+    sending it needs no model, tool or download calls.
+    """
+    import time as _time
+
+    stamp = last_activity_time.get(chat_id)
+    # Recorded in the prompt history only once the nudge is taken for sending
+    prompt = get_nudge_prompt(chat_id, record=False)
+    try:
+        message_list = [{"role": "system", "content": prompt}]
+        reply = _clean_reply(await agent_client.ask_detached(
+            message_list, structured=True, chat_id=chat_id, request_class="nudge"
+        ))
+        if reply.command == "/fact":
+            fact = await retrieve_fact()
+            reply = reply.model_copy(update={"text": f"{fact}\n\n{reply.text}".strip(), "command": None})
+        voice = await _reply_voice(reply)
+        if voice:
+            media = voice[0] if isinstance(voice[0], str) else media_store.put(bytes(voice[0]), "ogg")
+            reply = reply.model_copy(update={"voice": media})
+        image = await _reply_image(reply)
+        generated = None
+        if image:
+            media, caption = image
+            if not isinstance(media, str):
+                media = media_store.put(bytes(media), "jpg")
+            reply = reply.model_copy(update={"image": media, "text": caption, "command": None})
+            if caption and CAPTION_STYLE_MODE != "off":
+                await style_caption(caption, chat_id)
+        elif (
+            not reply.voice
+            and usage_ledger.budget_state(chat_id) == "ok"
+            and random.random() < IMAGE_SEND_CHANCE
+            and _image_hourly_slot()
+        ):
+            # Counted against the same hourly cap as queued image jobs
+            image_bytes = await generate_image_from_observation(reply.text, *IMAGE_GEN_TIER)
+            if image_bytes:
+                usage_ledger.record(chat_id, "nudge_image", images=1, image_quality=IMAGE_GEN_TIER[1])
+                data, ext = await image_pipeline.encode_for_telegram(image_bytes)
+                generated = media_store.put(data, ext)
+    except Exception as e:
+        logging.warning(f"[nudge] Preparing nudge for chat {chat_id} failed: {e}")
+        return
+    finally:
+        _preparing.discard(chat_id)
+    if last_activity_time.get(chat_id) != stamp:
+        return  # the conversation resumed while generating
+    _prepared_nudges[chat_id] = (stamp, _time.time(), reply, generated, prompt)
+    logging.info(f"[nudge] Prepared nudge for chat {chat_id}")
+
+
+def _take_prepared_nudge(chat_id: int, keep: bool = False):
+    """Return ``(reply, image)`` prepared for ``chat_id`` if still valid.
+
+    A prepared nudge is dropped once the chat has new activity, another bot
+    has posted since it was made, or it is older than one idle window.
+    """
+    import time as _time
+
+    prepared = _prepared_nudges.get(chat_id)
+    if prepared is None:
+        return None
+    stamp, prepared_at, reply, image, prompt = prepared
+    last_bus_ts = bot_bus.last_message_time(chat_id)
+    if (
+        last_activity_time.get(chat_id) != stamp
+        or (last_bus_ts or 0) > prepared_at
+        or _time.time() - prepared_at > NUDGE_MINUTES * 60
+    ):
+        del _prepared_nudges[chat_id]
+        return None
+    if not keep:
+        del _prepared_nudges[chat_id]
+        _record_nudge_prompt(prompt)
+    return reply, image
+
+
+async def _send_auto_nudge(chat_id: int) -> None:
+    """Nudge ``chat_id`` under its lease within the concurrency cap, then re-arm.
+
+    A prepared nudge is sent as is; otherwise one is generated now. The lease
+    passes to the next bot only if a nudge was actually sent.
+    """
+    lease = _nudge_lease(chat_id)
+    heartbeat = asyncio.create_task(leases.keep_alive(lease, BOT_USERNAME, NUDGE_LEASE_TTL))
+    sent = False
+    try:
+        async with _nudge_slots:
+            # Checked under the lease: the previous holder may have just nudged
+            if _bus_quiet_seconds(chat_id) > 0:
+                logging.info(f"[nudge] Skipping chat {chat_id} — bus activity (after lease)")
+                _arm_nudge(chat_id)
+                return
+            logging.info(f"[nudge] Sending automatic nudge to chat {chat_id}")
+            agent_client.clear_history(chat_id)
+            prepared = _take_prepared_nudge(chat_id)
+            if prepared:
+                answer, image = prepared
+                agent_client.record_reply(chat_id, answer.text)
+            else:
+                system_prompt = get_nudge_prompt(chat_id)
+                message_list = [{"role": "system", "content": system_prompt}]
+                raw_answer = await ask_agent(
+                    message_list, chat_id=chat_id, structured=True, request_class="nudge"
+                )
+                answer, image = _clean_reply(raw_answer), None
+            mark_bot_replied(chat_id)
+            await send_nudge_with_image(
+                bot, chat_id, answer, caption="", is_message=False,
+                image=image, generate_image=not prepared,
+            )
+            sent = True
+            if answer.text:
+                bot_bus.broadcast(chat_id, BOT_USERNAME, answer.text)
+            logging.info(f"[nudge] Nudge sent to chat {chat_id}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"[nudge] Error sending nudge to chat {chat_id}: {e}", exc_info=True)
+        _push_nudge(chat_id, NUDGE_CHECK_INTERVAL)
+        return
+    finally:
+        heartbeat.cancel()
+        leases.release(lease, BOT_USERNAME, rotate=sent)
+    _arm_nudge(chat_id)
+
+
 def mark_bot_replied(chat_id):
     """Record that the bot sent a message in ``chat_id``."""
     now = datetime.now()
@@ -1062,31 +1883,49 @@ def clean_openai_reply(text: str) -> str:
     return re.sub(pattern, "", text).strip()
 
 
-def get_random_nudge_prompt():
-    """Return a random nudge prompt from the predefined list, avoiding recent repeats."""
-    global nudge_prompt_history
+def _pick_nudge_prompt() -> str:
+    """Return a random nudge prompt avoiding recent repeats, without recording it."""
     available_prompts = [
         p for p in NUDGE_SYSTEM_PROMPTS if p not in nudge_prompt_history
     ]
     if not available_prompts:
-        # If all prompts are in history, reset history except the last one
-        nudge_prompt_history = nudge_prompt_history[-1:]
+        # All prompts are in history: only the last one is still avoided
         available_prompts = [
-            p for p in NUDGE_SYSTEM_PROMPTS if p not in nudge_prompt_history
+            p for p in NUDGE_SYSTEM_PROMPTS if p not in nudge_prompt_history[-1:]
         ]
-    prompt = random.choice(available_prompts)
+    return random.choice(available_prompts)
+
+
+def _record_nudge_prompt(prompt: str) -> None:
+    """Add a sent ``prompt`` to the history that random picks avoid."""
+    global nudge_prompt_history
+    if prompt not in NUDGE_SYSTEM_PROMPTS:
+        return
+    if all(p in nudge_prompt_history for p in NUDGE_SYSTEM_PROMPTS):
+        # If all prompts are in history, reset history except the last one
+        nudge_prompt_history = nudge_prompt_history[-1:]
     nudge_prompt_history.append(prompt)
     if len(nudge_prompt_history) > NUDGE_PROMPT_HISTORY_LEN:
         nudge_prompt_history = nudge_prompt_history[-NUDGE_PROMPT_HISTORY_LEN:]
+
+
+def get_random_nudge_prompt():
+    """Return a random nudge prompt from the predefined list, avoiding recent repeats."""
+    prompt = _pick_nudge_prompt()
+    _record_nudge_prompt(prompt)
     return prompt
 
 
-def get_nudge_prompt(chat_id: int) -> str:
-    """Return the first nudge during the morning window, otherwise random."""
+def get_nudge_prompt(chat_id: int, record: bool = True) -> str:
+    """Return the first nudge during the morning window, otherwise random.
+
+    With ``record=False`` the random pick is not added to the history yet,
+    for nudges that may be thrown away before they are sent.
+    """
     now = datetime.now(BOT_TIMEZONE).time()
     if FIRST_NUDGE_ENABLED and FIRST_NUDGE_START <= now < FIRST_NUDGE_END:
         return FIRST_NUDGE_PROMPT
-    return get_random_nudge_prompt()
+    return get_random_nudge_prompt() if record else _pick_nudge_prompt()
 
 
 def load_system_prompt() -> str:
@@ -1100,6 +1939,61 @@ def load_system_prompt() -> str:
 # History loading and scheduled summarization removed - now handled by agent_client
 
 
+def _chime_in_weight(replies: int) -> float:
+    return 1.0 / (1 + replies)
+
+
+def _chime_in_elected(message: Message) -> bool:
+    """Return whether this bot is among the MAX_CHIME_IN_BOTS elected for ``message``.
+
+    Every bot ranks the bots present in the chat by weighted rendezvous
+    hashing of the claim key, so all of them reach the same result without
+    talking to each other. Candidates are the bots that posted on the bus or
+    were marked as seen in the chat, including ones that never replied. Bots
+    that replied less within CHIME_IN_WEIGHT_WINDOW get a higher weight and
+    win more often.
+    """
+    import hashlib
+    import math
+    import time as _time
+
+    key = _claim_key(message)
+    now = _time.time()
+    counts = bot_bus.reply_counts(message.chat.id, now - CHIME_IN_WEIGHT_WINDOW)
+    for name in bot_bus.members(message.chat.id, now - CHIME_IN_MEMBER_TTL):
+        counts.setdefault(name, 0)
+    counts.setdefault(BOT_USERNAME, 0)
+
+    def score(name: str) -> float:
+        digest = hashlib.sha256(f"{key}:{name}".encode()).digest()
+        point = (int.from_bytes(digest[:8], "big") + 1) / (2**64 + 2)  # in (0, 1)
+        return -_chime_in_weight(counts[name]) / math.log(point)
+
+    elected = sorted(counts, key=score, reverse=True)[:MAX_CHIME_IN_BOTS]
+    return BOT_USERNAME in elected
+
+
+def _claim_chime_in_slot(message: Message) -> bool:
+    """Take one of MAX_CHIME_IN_BOTS claim files for an unmentioned reply.
+
+    Bots that see different bus histories may disagree on the election; the
+    slots still cap how many of them call the model for one message.
+    """
+    key = _claim_key(message)
+    for slot in range(MAX_CHIME_IN_BOTS):
+        try:
+            fd = os.open(
+                os.path.join(CLAIM_DIR, f"{key}_chime{slot}"),
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+            )
+        except FileExistsError:
+            continue
+        os.write(fd, BOT_USERNAME.encode())
+        os.close(fd)
+        return True
+    return False
+
+
 def _cleanup_old_claims(max_age: int = 300):
     """Remove claim files older than ``max_age`` seconds."""
     import time as _time
@@ -1123,6 +2017,7 @@ async def periodic_history_save():
             await asyncio.sleep(300)  # Save every 5 minutes
             agent_client.save_histories_to_disk()
             _cleanup_old_claims()
+            media_store.collect_garbage()
             # Trim bot bus files
             for chat_id in list(_bus_positions.keys()):
                 bot_bus.trim(chat_id)
@@ -1132,6 +2027,17 @@ async def periodic_history_save():
         raise
 
 
+async def periodic_usage_flush():
+    """Periodically write the usage ledger to disk."""
+    try:
+        while True:
+            await asyncio.sleep(usage_ledger.USAGE_FLUSH_SECONDS)
+            usage_ledger.flush()
+    except asyncio.CancelledError:
+        usage_ledger.flush()
+        raise
+
+
 async def poll_bot_bus():
     """Poll the bot bus for messages from other bots."""
     mention_tag = f"@{BOT_USERNAME}".lower()
@@ -1206,7 +2112,7 @@ async def poll_bot_bus():
                         count=1, flags=re.IGNORECASE,
                     ).strip()
                     answer = await ask_openai(
-                        prompt, username=other_bot, chat_id=chat_id
+                        prompt, username=other_bot, chat_id=chat_id, request_class="bus"
                     )
                     if answer:
                         try:
@@ -1241,16 +2147,25 @@ async def startup() -> None:
     # Initialize the agent with system prompt (also patches any loaded histories)
     system_prompt = load_system_prompt()
     agent_client.load_histories_from_disk()
+    usage_ledger.load()
     if system_prompt:
         await create_thread_with_system_prompt(system_prompt, BOT_USERNAME)
 
     # Initialize bot bus for inter-bot communication
     bot_bus.init_bus()
+    if os.path.exists(chime_gate.CHIME_GATE_WEIGHTS):
+        chime_gate.load_weights()
+
+    bot.session.middleware(_reuse_telegram_file_id)
+    bot.session.middleware(_measure_media_send)
 
     # Start background tasks
     asyncio.create_task(nudge_inactive_chats())
     asyncio.create_task(periodic_history_save())
+    asyncio.create_task(periodic_usage_flush())
     asyncio.create_task(poll_bot_bus())
+    asyncio.create_task(prefetch_potd_daily())
+    asyncio.create_task(vision_file_janitor())
 
     await dp.start_polling(bot)
 
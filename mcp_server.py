@@ -1,14 +1,23 @@
 from mcp.server.fastmcp import FastMCP
-from datetime import datetime
+from mcp.types import TextContent
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from urllib.parse import quote
 import json
 import random
 import os
 from hashlib import sha256
+from collections import Counter
+import asyncio
+import mmap
 import aiohttp
 import dotenv
 
+from reservoir import Reservoir
+from tool_cache import cached_tool
+import media_store
+import tool_cache
+
 dotenv.load_dotenv()
 
 _CYRILLIC_TO_LATIN_MAP = {
@@ -26,10 +35,6 @@ def _cyrillic_to_latin(text: str) -> str:
     """Return `text` with Cyrillic letters transliterated to Latin."""
     return "".join(_CYRILLIC_TO_LATIN_MAP.get(ch, ch) for ch in text)
 
-STORY_HISTORY_LIMIT = 20
-
-_story_history_hashes: set[str] = set()
-
 _DEFAULT_USER_AGENT = (
     os.getenv("HTTP_USER_AGENT")
     or "telebot/1.0 (+https://github.com/urban-roman/telebot)"
@@ -38,6 +43,58 @@ _DEFAULT_USER_AGENT = (
 MCP_PORT = int(os.getenv("MCP_PORT", "8888"))
 mcp = FastMCP(port=MCP_PORT)
 
+MCP_DATA_DIR = os.getenv("MCP_DATA_DIR", "mcp_data")
+DAY_SECONDS = 24 * 60 * 60
+
+WEATHER_CACHE_SECONDS = int(os.getenv("WEATHER_CACHE_SECONDS", "600"))
+WEATHER_REFRESH_SECONDS = WEATHER_CACHE_SECONDS * 4 // 5
+WEATHER_HOT_LOCATIONS = 5
+WEATHER_COORD_DECIMALS = 2  # ~1 km, so nearby lookups share a forecast
+GEOCODE_CACHE_FILE = os.path.join(MCP_DATA_DIR, "geocode.json")
+
+_geocodes: dict[str, list[float]] | None = None  # loaded lazily from disk
+_weather_cache = tool_cache.LRUCache(256)  # "lat,lon" -> forecast JSON text
+_weather_hotness: Counter[str] = Counter()
+_weather_flights = tool_cache.Singleflight()
+
+DECK_DIR = os.path.join(MCP_DATA_DIR, "decks")
+RESERVOIR_SIZE = int(os.getenv("RESERVOIR_SIZE", "10"))
+RESERVOIR_LOW_WATERMARK = RESERVOIR_SIZE // 3
+MEME_BATCH = 5  # images downloaded per scraped page
+
+PROVERB_CORPUS = os.path.join(MCP_DATA_DIR, "proverbs.txt")
+PROVERB_REFRESH_PAGES = 5
+
+POTD_DIR = os.path.join(MCP_DATA_DIR, "potd")
+POTD_KEEP_DAYS = 7
+_potd_flights = tool_cache.Singleflight()
+
+ELEVEN_MODEL = "eleven_multilingual_v2"
+ELEVEN_VOICE_SETTINGS = {
+    "stability": 0.68,
+    "similarity_boost": 1.0,
+    "style": 0.0,
+    "use_speaker_boost": True,
+    "speed": 0.9,
+}
+VOICE_CACHE_DIR = os.getenv("VOICE_CACHE_DIR", "/tmp/telebot_voice_cache")
+VOICE_CACHE_MAX_BYTES = int(os.getenv("VOICE_CACHE_MAX_MB", "200")) * 1024 * 1024
+VOICE_OPUS_BITRATE = os.getenv("VOICE_OPUS_BITRATE", "32k")
+VOICE_ENCODE_WORKERS = int(os.getenv("VOICE_ENCODE_WORKERS", "2"))
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+_voice_flights = tool_cache.Singleflight()
+_voice_encode_slots = asyncio.Semaphore(VOICE_ENCODE_WORKERS)
+_voice_encode_stats = {"encoded": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0, "encode_ms": 0}
+
+# (path, separator) -> ((mtime_ns, size), [(start, end), ...])
+_block_indexes: dict[tuple[str, bytes], tuple[tuple[int, int], list[tuple[int, int]]]] = {}
+# deck name -> (state, permutation)
+_decks: dict[str, tuple[dict, list[int]]] = {}
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
 @mcp.tool()
 def get_current_datetime() -> str:
     """Return the current Riga time with the weekday name.
@@ -50,34 +107,234 @@ def get_current_datetime() -> str:
     return f"{now.isoformat()} ({weekday})"
 
 
-@mcp.tool()
-async def get_current_weather(location: str) -> str:
-    """Return current weather for a given location.
+def _load_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
 
-    `location` is a human readable place name, like "Riga" or "Riga, Latvia".
-    The function will geocode it and return the current weather data as JSON.
-    Anything after a comma is ignored so "Riga, Latvia" becomes "Riga".
-    """
-    location = location.split(",", 1)[0].strip()
-    query = quote(_cyrillic_to_latin(location))
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={query}&count=1"
+def _save_json(path: str, data) -> None:
+    """Write ``data`` to ``path`` atomically via a temporary file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _geocode_key(location: str) -> str:
+    """Normalize a place name the same way it is sent to the geocoder."""
+    return _cyrillic_to_latin(location.split(",", 1)[0].strip()).lower()
+
+
+def _geocode_cache() -> dict[str, list[float]]:
+    global _geocodes
+    if _geocodes is None:
+        _geocodes = _load_json(GEOCODE_CACHE_FILE, {})
+    return _geocodes
+
+
+async def _geocode(session: aiohttp.ClientSession, key: str) -> tuple[float, float]:
+    """Return rounded ``(lat, lon)`` for ``key``, persisting new lookups."""
+    cached = _geocode_cache().get(key)
+    if cached:
+        tool_cache.record_stat("get_current_weather", "geocode_hits")
+        return cached[0], cached[1]
+
+    async def fetch() -> tuple[float, float]:
+        geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={quote(key)}&count=1"
         async with session.get(geo_url, ssl=False) as resp:
             geo_data = await resp.json()
-
         if not geo_data.get("results"):
             raise ValueError("location not found")
+        lat = round(geo_data["results"][0]["latitude"], WEATHER_COORD_DECIMALS)
+        lon = round(geo_data["results"][0]["longitude"], WEATHER_COORD_DECIMALS)
+        geocodes = _geocode_cache()
+        geocodes[key] = [lat, lon]
+        try:
+            _save_json(GEOCODE_CACHE_FILE, geocodes)
+        except OSError as e:
+            print(f"[weather] Failed to persist geocode cache: {e}")
+        return lat, lon
+
+    tool_cache.record_stat("get_current_weather", "geocode_misses")
+    coords, _ = await _weather_flights.do(f"geo:{key}", fetch)
+    return coords
 
-        lat = geo_data["results"][0]["latitude"]
-        lon = geo_data["results"][0]["longitude"]
 
+async def _fetch_forecast(session: aiohttp.ClientSession, lat: float, lon: float) -> str:
+    coord_key = f"{lat},{lon}"
+
+    async def fetch() -> str:
         url = (
             "https://api.open-meteo.com/v1/forecast"
             f"?latitude={lat}&longitude={lon}&current=temperature_2m"
         )
         async with session.get(url, ssl=False) as resp:
-            return await resp.text()
+            text = await resp.text()
+        json.loads(text)  # don't cache error pages
+        _weather_cache.set(coord_key, text, WEATHER_CACHE_SECONDS)
+        return text
+
+    text, _ = await _weather_flights.do(f"wx:{coord_key}", fetch)
+    return text
+
+
+@mcp.tool()
+async def get_current_weather(location: str) -> str:
+    """Return current weather for a given location.
+
+    `location` is a human readable place name, like "Riga" or "Riga, Latvia".
+    The function will geocode it and return the current weather data as JSON.
+    Anything after a comma is ignored so "Riga, Latvia" becomes "Riga".
+    """
+    key = _geocode_key(location)
+    coords = _geocode_cache().get(key)
+    if coords:
+        coord_key = f"{coords[0]},{coords[1]}"
+        _weather_hotness[coord_key] += 1
+        cached = _weather_cache.get(coord_key)
+        if cached is not None:
+            tool_cache.record_stat("get_current_weather", "hits")
+            return cached
+
+    tool_cache.record_stat("get_current_weather", "misses")
+    async with aiohttp.ClientSession(trust_env=True) as session:
+        lat, lon = await _geocode(session, key)
+        if not coords:
+            _weather_hotness[f"{lat},{lon}"] += 1
+        return await _fetch_forecast(session, lat, lon)
+
+
+async def refresh_hot_weather() -> None:
+    """Keep forecasts for the most requested coordinates warm.
+
+    Runs every WEATHER_REFRESH_SECONDS (shorter than the cache TTL) and
+    re-fetches the WEATHER_HOT_LOCATIONS most popular coordinates, so their
+    requests never wait on the network. Popularity decays every cycle.
+    """
+    while True:
+        await asyncio.sleep(WEATHER_REFRESH_SECONDS)
+        hot = [k for k, _ in _weather_hotness.most_common(WEATHER_HOT_LOCATIONS)]
+        for coord_key in list(_weather_hotness):
+            _weather_hotness[coord_key] //= 2
+            if not _weather_hotness[coord_key]:
+                del _weather_hotness[coord_key]
+        if not hot:
+            continue
+        refreshed = 0
+        try:
+            async with aiohttp.ClientSession(trust_env=True) as session:
+                for coord_key in hot:
+                    try:
+                        lat, lon = (float(v) for v in coord_key.split(","))
+                        await _fetch_forecast(session, lat, lon)
+                    except Exception as e:
+                        print(f"[weather] Failed to refresh {coord_key}: {e}")
+                        continue
+                    refreshed += 1
+            print(f"[weather] Refreshed {refreshed} of {len(hot)} hot locations")
+        except Exception as e:
+            print(f"[weather] Background refresh failed: {e}")
+
+
+def _block_index(path: str, sep: bytes) -> tuple[tuple[int, int], list[tuple[int, int]]]:
+    """Return the file signature and byte spans of non-empty blocks in ``path``.
+
+    The file is scanned once through ``mmap``; the spans are reused until the
+    file's mtime or size changes.
+    """
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _block_indexes.get((path, sep))
+    if cached and cached[0] == signature:
+        return cached
+
+    spans: list[tuple[int, int]] = []
+    if st.st_size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while True:
+                pos = mm.find(sep, start)
+                end = pos if pos != -1 else len(mm)
+                if mm[start:end].strip():
+                    spans.append((start, end))
+                if pos == -1:
+                    break
+                start = pos + len(sep)
+    _block_indexes[(path, sep)] = (signature, spans)
+    return signature, spans
+
+
+def _read_block(path: str, span: tuple[int, int]) -> str:
+    with open(path, "rb") as f:
+        f.seek(span[0])
+        return f.read(span[1] - span[0]).decode("utf-8").strip()
+
+
+def _deck_order(state: dict) -> list[int]:
+    order = list(range(state.get("base", state["count"])))
+    random.Random(state["seed"]).shuffle(order)
+    # Don't start a new round with the item that ended the previous one
+    if len(order) > 1 and order[0] == state.get("avoid"):
+        order[0], order[1] = order[1], order[0]
+    # Items appended mid-round were shuffled into the part not drawn yet
+    for cursor, count, seed in state.get("grown", []):
+        rest = order[cursor:] + list(range(len(order), count))
+        random.Random(seed).shuffle(rest)
+        order[cursor:] = rest
+    return order
+
+
+def _deck_draw(name: str, count: int, signature, *, append_only: bool = False) -> int:
+    """Return the next index of a persisted shuffled deck of ``count`` items.
+
+    The deck is a seeded permutation plus a cursor saved under DECK_DIR, so no
+    item repeats until every item has been drawn, even across restarts. The
+    deck is reshuffled when exhausted or when ``signature`` changes. With
+    ``append_only`` a source that only gained items keeps its round: the new
+    indices are shuffled into the items not drawn yet.
+    """
+    path = os.path.join(DECK_DIR, f"{name}.json")
+    if name in _decks:
+        state, order = _decks[name]
+    else:
+        state = _load_json(path, {})
+        order = _deck_order(state) if state.get("count") else []
+
+    previous = state.get("count") or 0
+    if append_only and "seed" in state and 0 < previous < count:
+        state = {
+            **state,
+            "signature": list(signature),
+            "count": count,
+            "base": state.get("base", previous),
+            "grown": state.get("grown", []) + [[state["cursor"], count, random.getrandbits(32)]],
+        }
+        order = _deck_order(state)
+    elif state.get("signature") != list(signature) or previous != count:
+        state = {"signature": list(signature), "count": count, "cursor": count}
+    if state["cursor"] >= count:
+        avoid = order[-1] if order and state.get("count") == count else None
+        state = {
+            "signature": list(signature),
+            "count": count,
+            "seed": random.getrandbits(32),
+            "cursor": 0,
+            "avoid": avoid,
+        }
+        order = _deck_order(state)
+
+    index = order[state["cursor"]]
+    state["cursor"] += 1
+    _decks[name] = (state, order)
+    try:
+        _save_json(path, state)
+    except OSError as e:
+        print(f"[deck] Failed to persist {name}: {e}")
+    return index
 
 
 @mcp.tool()
@@ -86,32 +343,19 @@ def get_random_story(path: str = "dataset/neuroyury_bot/stories.txt") -> str:
 
     The file should contain blocks separated by lines with '---'. The first line
     of each block is treated as the topic and the rest as the text. The function
-    returns them joined with a colon and a space. Previously returned stories are
-    tracked by hash to minimize repetition. After STORY_HISTORY_LIMIT unique
-    stories, the history is cleared so they may repeat again.
+    returns them joined with a colon and a space. Stories are drawn from a
+    shuffled deck that survives restarts, so none repeats until all of them
+    have been told.
     """
-    global _story_history_hashes
-
     if not os.path.exists(path):
         raise FileNotFoundError(path)
 
-    if len(_story_history_hashes) >= STORY_HISTORY_LIMIT:
-        _story_history_hashes.clear()
-
-    with open(path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    entries = [block.strip() for block in content.split("---") if block.strip()]
-    if not entries:
+    signature, spans = _block_index(path, b"---")
+    if not spans:
         raise ValueError("no entries found")
 
-    available = [e for e in entries if sha256(e.encode()).hexdigest() not in _story_history_hashes]
-    if not available:
-        _story_history_hashes.clear()
-        available = entries
-
-    choice = random.choice(available)
-    _story_history_hashes.add(sha256(choice.encode()).hexdigest())
+    deck_name = "story_" + sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    choice = _read_block(path, spans[_deck_draw(deck_name, len(spans), signature)])
 
     lines = [line.strip() for line in choice.splitlines() if line.strip()]
     if not lines:
@@ -122,6 +366,7 @@ def get_random_story(path: str = "dataset/neuroyury_bot/stories.txt") -> str:
 
 
 @mcp.tool()
+@cached_tool(DAY_SECONDS, key=lambda date: date.strip().lower(), disk=True)
 async def get_wikipedia_extract(date: str) -> str:
     """Return the Russian Wikipedia extract for a given date.
 
@@ -150,15 +395,8 @@ async def get_wikipedia_extract(date: str) -> str:
     return extract
 
 
-@mcp.tool()
-async def get_random_proverb() -> str:
-    """Вернуть случайную пословицу или поговорку из русской Викицитатника.
-
-    Используй функцию, когда просят выдать "случайную" или "рандомную"
-    пословицу, поговорку, крылатое выражение, цитату, афоризм. Она выбирает
-    произвольную страницу в категории "Пословицы", берет одну из записей и
-    возвращает её вместе с названием страницы.
-    """
+async def _scrape_proverbs() -> list[str]:
+    """Fetch a random ru.wikiquote proverbs page as ``"title: proverb"`` items."""
     import re
     from html import unescape
     from urllib.parse import urlparse, unquote
@@ -181,20 +419,87 @@ async def get_random_proverb() -> str:
     if not proverbs:
         raise ValueError("no proverbs found")
 
-    return f"{title}: {random.choice(proverbs)}"
+    return [f"{title}: {p}" for p in proverbs]
+
+
+def _proverb_line(item: str) -> str:
+    return " ".join(item.split())
+
+
+def _write_proverb_corpus(proverbs: list[str]) -> int:
+    """Merge ``proverbs`` into PROVERB_CORPUS and return how many were new.
+
+    The corpus is a plain UTF-8 file with one ``"title: proverb"`` per line;
+    it is rewritten atomically so a concurrent reader never sees a partial
+    file.
+    """
+    try:
+        with open(PROVERB_CORPUS, "r", encoding="utf-8") as f:
+            existing = [line.rstrip("\n") for line in f if line.strip()]
+    except OSError:
+        existing = []
+    known = set(existing)
+    added = []
+    for item in proverbs:
+        line = _proverb_line(item)
+        if line and line not in known:
+            known.add(line)
+            added.append(line)
+    if not added:
+        return 0
+    os.makedirs(os.path.dirname(PROVERB_CORPUS) or ".", exist_ok=True)
+    tmp_path = f"{PROVERB_CORPUS}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(existing + added) + "\n")
+    os.replace(tmp_path, PROVERB_CORPUS)
+    return len(added)
+
+
+async def crawl_proverbs(pages: int) -> int:
+    """Scrape ``pages`` random wikiquote pages into the corpus; return lines added."""
+    added = 0
+    for _ in range(pages):
+        try:
+            added += _write_proverb_corpus(await _scrape_proverbs())
+        except Exception as e:
+            print(f"[proverbs] Failed to scrape a page: {e}")
+    return added
+
+
+async def refresh_proverb_corpus() -> None:
+    """Grow the local corpus by a few pages a day, off the request path."""
+    while True:
+        added = await crawl_proverbs(PROVERB_REFRESH_PAGES)
+        print(f"[proverbs] Refresh added {added} proverbs")
+        await asyncio.sleep(DAY_SECONDS)
 
 
 @mcp.tool()
-async def get_picture_of_the_day(date: str = "") -> str:
-    """Return Wikimedia picture of the day URL and caption as JSON.
+async def get_random_proverb() -> str:
+    """Вернуть случайную пословицу или поговорку из русского Викицитатника.
 
-    ``date`` should be ``YYYY-MM-DD``. If omitted, today's date is used.
-    The JSON contains ``url`` (direct link to the image) and ``caption``.
+    Используй функцию, когда просят выдать "случайную" или "рандомную"
+    пословицу, поговорку, крылатое выражение, цитату, афоризм. Она берет
+    запись из локального корпуса, собранного со страниц категории
+    "Пословицы" и пополняемого в фоне раз в день, и возвращает её вместе с
+    названием страницы. Записи не повторяются, пока не будут выданы все.
     """
-    import re
+    if not os.path.exists(PROVERB_CORPUS):
+        # First run without a prebuilt corpus: seed it from one page
+        await crawl_proverbs(1)
+    if not os.path.exists(PROVERB_CORPUS):
+        raise ValueError("no proverbs found")
+    signature, spans = _block_index(PROVERB_CORPUS, b"\n")
+    if not spans:
+        raise ValueError("no proverbs found")
+    # The corpus only ever gains lines, so a refresh keeps the current round
+    index = _deck_draw("proverbs", len(spans), signature, append_only=True)
+    return _read_block(PROVERB_CORPUS, spans[index])
 
-    if not date:
-        date = datetime.now().strftime("%Y-%m-%d")
+
+async def _resolve_picture_of_the_day(date: str) -> dict:
+    """Parse the POTD template for ``date`` into an image URL and caption."""
+    import re
 
     url = (
         "https://en.wikipedia.org/wiki/Template:POTD/"
@@ -224,41 +529,141 @@ async def get_picture_of_the_day(date: str = "") -> str:
         "https://commons.wikimedia.org/wiki/Special:FilePath/" + quote(image_name) + "?width=800"
     )
 
-    return json.dumps({"url": image_url, "caption": caption})
+    return {"url": image_url, "caption": caption}
 
 
-@mcp.tool()
-async def retrieve_joke() -> str:
-    """Fetch a random meme image and return the direct image URL."""
+async def prefetch_picture_of_the_day(date: str) -> dict:
+    """Resolve and download the picture of the day for ``date`` into POTD_DIR.
 
-    import re
-    import aiohttp
+    Returns the stored record with ``url``, ``caption`` and the local image
+    ``path``. A record already on disk is returned without network access.
+    """
+    record_path = os.path.join(POTD_DIR, f"{date}.json")
+    record = _load_json(record_path, None)
+    if record and os.path.exists(record.get("path", "")):
+        return record
+
+    async def fetch() -> dict:
+        record = await _resolve_picture_of_the_day(date)
+        headers = {"User-Agent": _DEFAULT_USER_AGENT}
+        async with aiohttp.ClientSession(headers=headers, trust_env=True) as session:
+            async with session.get(record["url"], ssl=False) as resp:
+                resp.raise_for_status()
+                data = await resp.read()
+        name = record["url"].split("?")[0].rsplit("/", 1)[-1]
+        suffix = os.path.splitext(name)[1].lower() or ".jpg"
+        image_path = os.path.abspath(os.path.join(POTD_DIR, f"{date}{suffix}"))
+        os.makedirs(POTD_DIR, exist_ok=True)
+        with open(f"{image_path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{image_path}.tmp", image_path)
+        record["path"] = image_path
+        _save_json(record_path, record)
+        print(f"[potd] Stored {date} ({len(data)} bytes)")
+        return record
+
+    record, _ = await _potd_flights.do(date, fetch)
+    return record
+
+
+def _prune_pictures_of_the_day(keep: int = POTD_KEEP_DAYS) -> None:
+    try:
+        names = sorted(os.listdir(POTD_DIR))
+    except OSError:
+        return
+    dates = sorted({n.split(".", 1)[0] for n in names}, reverse=True)
+    stale = set(dates[keep:])
+    for name in names:
+        if name.split(".", 1)[0] in stale:
+            try:
+                os.remove(os.path.join(POTD_DIR, name))
+            except OSError:
+                pass
+
+
+async def prefetch_potd_daily() -> None:
+    """Store today's picture of the day now and again shortly after midnight."""
+    while True:
+        try:
+            await prefetch_picture_of_the_day(_today())
+            _prune_pictures_of_the_day()
+        except Exception as e:
+            print(f"[potd] Prefetch failed: {e}")
+            await asyncio.sleep(15 * 60)
+            continue
+        now = datetime.now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((tomorrow - now).total_seconds() + 5 * 60)
+
+
+# Not wrapped in cached_tool: the per-day record in POTD_DIR is the cache, and
+# a day served without a local copy is retried on the next call
+@mcp.tool()
+async def get_picture_of_the_day(date: str = "") -> str:
+    """Return Wikimedia picture of the day URL and caption as JSON.
 
-    headers = {"User-Agent": "Mozilla/5.0"}
-    async with aiohttp.ClientSession(headers=headers, trust_env=True) as session:
+    ``date`` should be ``YYYY-MM-DD``. If omitted, today's date is used.
+    The JSON contains ``url`` (direct link to the image) and ``caption``, plus
+    ``image``, a media handle of the prefetched image, when it has been stored.
+    """
+    if not date:
+        date = _today()
+    try:
+        # The date names files in POTD_DIR, so nothing else may get through
+        date = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"date must be YYYY-MM-DD, got {date!r}") from None
+
+    try:
+        record = await prefetch_picture_of_the_day(date)
+    except (OSError, aiohttp.ClientError) as e:
+        # Storage or image download failed; the URL alone is still usable
+        print(f"[potd] Serving {date} without a local copy: {e}")
+        record = await _resolve_picture_of_the_day(date)
+
+    record = dict(record)  # concurrent calls share the prefetched record
+    path = record.pop("path", None)
+    if path:
         try:
-            async with session.get("https://www.memify.ru/highfive/", ssl=False) as resp:
-                html = await resp.text()
-            urls = re.findall(
-                r"https://[^\"']*?memify\.ru/[^\"']+\.(?:jpe?g|png|gif|webp)",
-                html,
-                re.IGNORECASE,
-            )
-        except Exception:
-            urls = []
-        if not urls:
-            return "https://i.imgflip.com/1bij.jpg"
-        img_url = random.choice(urls)
-    return img_url
+            record["image"] = media_store.put_file(path)
+        except OSError as e:
+            print(f"[potd] Local copy of {date} is unusable: {e}")
+    return json.dumps(record)
 
 
-@mcp.tool()
-async def retrieve_fact() -> str:
-    """Fetch a random fact from randstuff.ru and return the text."""
+async def _produce_memes() -> list[dict]:
+    """Scrape memify.ru and download a batch of meme images into the media store."""
+    import re
 
+    headers = {"User-Agent": "Mozilla/5.0"}
+    items = []
+    async with aiohttp.ClientSession(headers=headers, trust_env=True) as session:
+        async with session.get("https://www.memify.ru/highfive/", ssl=False) as resp:
+            html = await resp.text()
+        urls = re.findall(
+            r"https://[^\"']*?memify\.ru/[^\"']+\.(?:jpe?g|png|gif|webp)",
+            html,
+            re.IGNORECASE,
+        )
+        urls = list(dict.fromkeys(urls))
+        random.shuffle(urls)
+        for url in urls[:MEME_BATCH]:
+            try:
+                async with session.get(url, ssl=False) as resp:
+                    resp.raise_for_status()
+                    data = await resp.read()
+            except Exception as e:
+                print(f"[meme] Failed to download {url}: {e}")
+                continue
+            handle = media_store.put(data, os.path.splitext(url)[1])
+            items.append({"url": url, "handle": handle})
+    return items
+
+
+async def _produce_facts() -> list[str]:
+    """Scrape one fact from randstuff.ru."""
     import re
     from html import unescape
-    import aiohttp
 
     headers = {"User-Agent": _DEFAULT_USER_AGENT}
     async with aiohttp.ClientSession(headers=headers, trust_env=True) as session:
@@ -272,21 +677,149 @@ async def retrieve_fact() -> str:
     fact = unescape(re.sub(r"<.*?>", "", match.group(1))).strip()
     if not fact:
         raise ValueError("fact not found")
-    return fact
+    return [fact]
+
+
+_memes = Reservoir(
+    "memes",
+    _produce_memes,
+    capacity=RESERVOIR_SIZE,
+    low_watermark=RESERVOIR_LOW_WATERMARK,
+    key=lambda item: item["handle"],
+)
+_facts = Reservoir(
+    "facts", _produce_facts, capacity=RESERVOIR_SIZE, low_watermark=RESERVOIR_LOW_WATERMARK
+)
 
 
 @mcp.tool()
-async def generate_voice(text: str) -> str:
-    """Convert ``text`` to speech using ElevenLabs and return a local mp3 path."""
+async def retrieve_joke() -> str:
+    """Return a random meme image as a media handle (``media:<sha256>.<ext>``).
 
-    import aiohttp
-    from tempfile import NamedTemporaryFile
+    Falls back to a direct image URL if no meme could be fetched.
+    """
+    try:
+        for _ in range(RESERVOIR_SIZE):
+            item = await _memes.take()
+            # Pooled files may have been garbage collected in the meantime
+            if media_store.exists(item["handle"]):
+                return item["handle"]
+        raise LookupError("memes: pooled files are gone")
+    except LookupError as e:
+        print(f"[meme] Serving fallback image: {e}")
+        return "https://i.imgflip.com/1bij.jpg"
 
-    api_key = os.getenv("ELEVEN_API_KEY")
-    if not api_key:
-        raise RuntimeError("ELEVEN_API_KEY not set")
 
-    voice_id = os.getenv("ELEVEN_VOICE_ID", "EZQLe5vG5r2BoTGdGRL7")
+@mcp.tool()
+async def retrieve_fact() -> str:
+    """Fetch a random fact from randstuff.ru and return the text."""
+    try:
+        return await _facts.take()
+    except LookupError:
+        raise ValueError("fact not found")
+
+
+@mcp.resource("reservoir://stats", mime_type="application/json")
+def get_reservoir_stats() -> str:
+    """Pool sizes and counters of the prefetched content reservoirs."""
+    return json.dumps({r.name: r.stats() for r in (_memes, _facts)})
+
+
+def _voice_cache_key(text: str, voice_id: str) -> str:
+    """Hash everything that changes the synthesized audio."""
+    material = json.dumps(
+        {
+            "text": text,
+            "voice_id": voice_id,
+            "model": ELEVEN_MODEL,
+            "voice_settings": ELEVEN_VOICE_SETTINGS,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return sha256(material.encode()).hexdigest()
+
+
+def _voice_cache_path(digest: str, ext: str) -> str:
+    return os.path.join(VOICE_CACHE_DIR, f"{digest}.{ext}")
+
+
+def _voice_cached(digest: str) -> str | None:
+    """Return the cached clip for ``digest``, preferring Opus over mp3."""
+    for ext in ("ogg", "mp3"):
+        path = _voice_cache_path(digest, ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+async def _encode_opus(data: bytes) -> bytes | None:
+    """Transcode mp3 ``data`` into a low-bitrate OGG/Opus voice note.
+
+    ffmpeg runs as a subprocess, at most VOICE_ENCODE_WORKERS at a time, so
+    encoding never blocks the event loop. Returns None when ffmpeg is missing
+    or fails; the caller then keeps the mp3.
+    """
+    import shutil
+    import time
+
+    ffmpeg = shutil.which(FFMPEG_BIN)
+    if not ffmpeg:
+        return None
+
+    async with _voice_encode_slots:
+        started = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg, "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0", "-vn",
+            "-c:a", "libopus", "-b:a", VOICE_OPUS_BITRATE, "-application", "voip",
+            "-f", "ogg", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(data)
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+
+    if proc.returncode != 0 or not out:
+        _voice_encode_stats["failed"] += 1
+        print(f"[voice] Opus encoding failed: {err.decode(errors='replace').strip()}")
+        return None
+
+    _voice_encode_stats["encoded"] += 1
+    _voice_encode_stats["bytes_in"] += len(data)
+    _voice_encode_stats["bytes_out"] += len(out)
+    _voice_encode_stats["encode_ms"] += elapsed_ms
+    print(
+        f"[voice] Opus {len(data)} -> {len(out)} bytes "
+        f"({len(data) - len(out)} saved) in {elapsed_ms} ms"
+    )
+    return out
+
+
+def _evict_voice_cache(max_bytes: int) -> None:
+    """Delete least recently used clips until the cache fits in ``max_bytes``."""
+    entries = []
+    try:
+        with os.scandir(VOICE_CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith((".ogg", ".mp3")):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+async def _synthesize_voice(text: str, voice_id: str, api_key: str) -> bytes:
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
     headers = {
         "xi-api-key": api_key,
@@ -295,25 +828,113 @@ async def generate_voice(text: str) -> str:
     }
     payload = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {
-            "stability": 0.68,
-            "similarity_boost": 1.0,
-            "style": 0.0,
-            "use_speaker_boost": True,
-            "speed": 0.9,
-        },
+        "model_id": ELEVEN_MODEL,
+        "voice_settings": ELEVEN_VOICE_SETTINGS,
     }
 
     async with aiohttp.ClientSession(trust_env=True) as session:
         async with session.post(url, headers=headers, json=payload) as resp:
             if resp.status != 200:
                 raise ValueError(f"request failed with status {resp.status}")
-            data = await resp.read()
+            return await resp.read()
+
+
+@mcp.tool(structured_output=False)
+async def generate_voice(text: str) -> TextContent:
+    """Convert ``text`` to speech using ElevenLabs and return a media handle.
+
+    The clip is an OGG/Opus voice note, or mp3 when ffmpeg is unavailable.
+    Clips are cached by text, voice, model and settings, so repeated phrases
+    are served from VOICE_CACHE_DIR without calling ElevenLabs again. The
+    result's ``_meta["synthesized"]`` tells whether ElevenLabs was billed for
+    this call, so callers can record TTS spend only then.
+    """
+    api_key = os.getenv("ELEVEN_API_KEY")
+    if not api_key:
+        raise RuntimeError("ELEVEN_API_KEY not set")
+
+    text = text.strip()
+    voice_id = os.getenv("ELEVEN_VOICE_ID", "EZQLe5vG5r2BoTGdGRL7")
+    digest = _voice_cache_key(text, voice_id)
+    cached = _voice_cached(digest)
+
+    if cached:
+        try:
+            os.utime(cached)  # mtime doubles as the LRU timestamp
+            handle = media_store.put_file(cached)
+        except OSError:
+            pass
+        else:
+            tool_cache.record_stat("generate_voice", "hits")
+            return TextContent(type="text", text=handle, _meta={"synthesized": False})
+
+    async def synthesize() -> str:
+        data = await _synthesize_voice(text, voice_id, api_key)
+        opus = await _encode_opus(data)
+        ext = "mp3" if opus is None else "ogg"
+        path = _voice_cache_path(digest, ext)
+        os.makedirs(VOICE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data if opus is None else opus)
+        os.replace(tmp_path, path)
+        _evict_voice_cache(VOICE_CACHE_MAX_BYTES)
+        return path
+
+    try:
+        cached, shared = await _voice_flights.do(digest, synthesize)
+    except Exception:
+        tool_cache.record_stat("generate_voice", "errors")
+        raise
+    tool_cache.record_stat("generate_voice", "coalesced" if shared else "misses")
+    return TextContent(
+        type="text", text=media_store.put_file(cached), _meta={"synthesized": not shared}
+    )
+
+
+@mcp.resource("cache://stats", mime_type="application/json")
+def get_cache_stats() -> str:
+    """Per-tool cache hit/miss counters and voice encoding totals."""
+    return json.dumps({**tool_cache.stats(), "voice_encoding": _voice_encode_stats})
+
+
+async def _serve() -> None:
+    """Run the SSE server together with the background refresh jobs."""
+    media_store.collect_garbage()
+    jobs = [
+        asyncio.create_task(refresh_hot_weather()),
+        asyncio.create_task(prefetch_potd_daily()),
+        _memes.refill(),
+        _facts.refill(),
+        asyncio.create_task(refresh_proverb_corpus()),
+    ]
+    try:
+        await mcp.run_sse_async()
+    finally:
+        for job in jobs:
+            job.cancel()
+
+
+def _build_proverbs_cli(args: list[str]) -> None:
+    """``python mcp_server.py build-proverbs [PAGES] [--import FILE ...]``"""
+    imports = []
+    while "--import" in args:
+        i = args.index("--import")
+        imports.append(args[i + 1])
+        del args[i : i + 2]
+    pages = int(args[0]) if args else 50
+    added = 0
+    for path in imports:
+        with open(path, "r", encoding="utf-8") as f:
+            added += _write_proverb_corpus(f.read().splitlines())
+    added += asyncio.run(crawl_proverbs(pages))
+    print(f"[proverbs] Added {added} proverbs to {PROVERB_CORPUS}")
 
-    with NamedTemporaryFile(delete=False, suffix=".mp3", dir="/tmp") as f:
-        f.write(data)
-        return f.name
 
 if __name__ == "__main__":
-    mcp.run(transport="sse")
+    import sys
+
+    if sys.argv[1:2] == ["build-proverbs"]:
+        _build_proverbs_cli(sys.argv[2:])
+    else:
+        asyncio.run(_serve())
@@ -0,0 +1,146 @@
+"""Content-addressed store for images and audio shared by the bots and MCP server.
+
+Files live in MEDIA_DIR named by the SHA-256 of their bytes, so the same
+media is written once no matter how often it is fetched. Producers hand out
+handles such as ``media:<sha256>.jpg`` instead of temporary paths; consumers
+resolve them with :func:`path` and never delete them. Files untouched for
+MEDIA_TTL_SECONDS, or beyond MEDIA_MAX_BYTES (least recently used first), are
+removed by :func:`collect_garbage`.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import time
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "/tmp/telebot_media")
+MEDIA_TTL_SECONDS = int(os.getenv("MEDIA_TTL_HOURS", "24")) * 60 * 60
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_MB", "500")) * 1024 * 1024
+
+HANDLE_RE = re.compile(r"media:([0-9a-f]{64})\.([a-z0-9]{2,5})\b")
+
+
+def _normalize_ext(ext: str) -> str:
+    ext = ext.lstrip(".").lower()
+    return ext if re.fullmatch(r"[a-z0-9]{2,5}", ext) else "bin"
+
+
+def _file_path(digest: str, ext: str) -> str:
+    return os.path.join(MEDIA_DIR, f"{digest}.{ext}")
+
+
+def _handle(digest: str, ext: str) -> str:
+    return f"media:{digest}.{ext}"
+
+
+def put(data: bytes, ext: str) -> str:
+    """Store ``data`` and return its handle; existing content is not rewritten."""
+    ext = _normalize_ext(ext)
+    digest = hashlib.sha256(data).hexdigest()
+    path = _file_path(digest, ext)
+    if os.path.exists(path):
+        os.utime(path)
+        return _handle(digest, ext)
+
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{os.urandom(4).hex()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return _handle(digest, ext)
+
+
+def put_file(src: str, ext: str | None = None) -> str:
+    """Store the file at ``src`` (hard-linked when possible) and return its handle."""
+    if ext is None:
+        ext = os.path.splitext(src)[1]
+    ext = _normalize_ext(ext)
+    digest = hashlib.sha256()
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    path = _file_path(digest.hexdigest(), ext)
+    if os.path.exists(path):
+        os.utime(path)
+        return _handle(digest.hexdigest(), ext)
+
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{os.urandom(4).hex()}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, path)
+    os.utime(path)
+    return _handle(digest.hexdigest(), ext)
+
+
+def is_handle(value) -> bool:
+    return isinstance(value, str) and HANDLE_RE.fullmatch(value) is not None
+
+
+def find(text: str) -> re.Match | None:
+    """Return the first handle mentioned in ``text``."""
+    return HANDLE_RE.search(text)
+
+
+def path(handle: str) -> str:
+    """Return the file backing ``handle`` and mark it as recently used.
+
+    Raises ``ValueError`` for malformed handles and ``FileNotFoundError``
+    when the file has been collected.
+    """
+    m = HANDLE_RE.fullmatch(handle)
+    if not m:
+        raise ValueError(f"not a media handle: {handle!r}")
+    file_path = _file_path(m.group(1), m.group(2))
+    os.utime(file_path)
+    return file_path
+
+
+def exists(handle: str) -> bool:
+    try:
+        path(handle)
+    except (ValueError, OSError):
+        return False
+    return True
+
+
+def read(handle: str) -> bytes:
+    with open(path(handle), "rb") as f:
+        return f.read()
+
+
+def collect_garbage(max_age: float | None = None, max_bytes: int | None = None) -> int:
+    """Delete expired files, then the least recently used ones over the size cap.
+
+    Returns the number of files removed.
+    """
+    max_age = MEDIA_TTL_SECONDS if max_age is None else max_age
+    max_bytes = MEDIA_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+    entries = []
+    try:
+        with os.scandir(MEDIA_DIR) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return 0
+
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, file_path in sorted(entries):
+        if mtime >= now - max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,250 @@
+"""Per-chat long-term memory with a NumPy vector index.
+
+Chat history sent to the model is short and is wiped after a quiet spell.
+This module keeps an embedding of every message per chat in a float16
+matrix memory-mapped from ``MEMORY_DIR/<chat_id>.npy``, with the texts
+alongside in ``<chat_id>.jsonl``. :func:`recall` returns the older messages
+most similar to a query (cosine top-k over the whole matrix in one product),
+trimmed to a token budget, for :func:`agent_client.ask_agent` to inject.
+
+Embedders are pluggable async callables mapping texts, and the chat they
+belong to, to a 2-D array: :class:`OpenAIEmbedder` calls the embeddings API
+and records its usage for that chat, :class:`HashEmbedder` is a
+deterministic local stand-in. MEMORY_INDEX selects one (``off`` by
+default).
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Sequence
+
+import numpy as np
+
+import usage_ledger
+
+MEMORY_INDEX = os.getenv("MEMORY_INDEX", "off").lower()  # off | hash | openai
+MEMORY_DIR = os.getenv(
+    "MEMORY_DIR", os.path.join("memory_index", os.getenv("BOT_USERNAME", "telebot"))
+)
+MEMORY_EMBED_MODEL = os.getenv("MEMORY_EMBED_MODEL", "text-embedding-3-small")
+MEMORY_EMBED_DIM = int(os.getenv("MEMORY_EMBED_DIM", "256"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "5"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "300"))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.3"))
+MEMORY_MAX_ITEMS = int(os.getenv("MEMORY_MAX_ITEMS", "5000"))  # per chat; oldest half dropped
+INITIAL_CAPACITY = 256
+
+Embedder = Callable[[Sequence[str], int | None], Awaitable[np.ndarray]]
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashEmbedder:
+    """Deterministic bag of hashed words and character trigrams; no network."""
+
+    def __init__(self, dim: int = MEMORY_EMBED_DIM) -> None:
+        self.dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = _TOKEN_RE.findall(text.lower())
+        grams = [w[i : i + 3] for w in words if len(w) > 3 for i in range(len(w) - 2)]
+        for token in words + grams:
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "big")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        return vector
+
+    async def __call__(self, texts: Sequence[str], chat_id: int | None = None) -> np.ndarray:
+        return np.stack([self._embed(t) for t in texts]) if texts else np.zeros((0, self.dim))
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, shortened to ``dim`` dimensions."""
+
+    def __init__(self, client, model: str = MEMORY_EMBED_MODEL, dim: int = MEMORY_EMBED_DIM) -> None:
+        self.client = client
+        self.model = model
+        self.dim = dim
+
+    async def __call__(self, texts: Sequence[str], chat_id: int | None = None) -> np.ndarray:
+        response = await self.client.embeddings.create(
+            model=self.model, input=list(texts), dimensions=self.dim
+        )
+        usage = getattr(response, "usage", None)
+        usage_ledger.record(
+            chat_id,
+            "embedding",
+            model=self.model,
+            requests=1,
+            input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        )
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class _ChatIndex:
+    """Embeddings and texts of one chat; rows ``[:count]`` of ``vectors`` are used."""
+
+    def __init__(self, chat_id: int, dim: int) -> None:
+        self.vectors_path = os.path.join(MEMORY_DIR, f"{chat_id}.npy")
+        self.texts_path = os.path.join(MEMORY_DIR, f"{chat_id}.jsonl")
+        self.dim = dim
+        self.texts: list[str] = []
+        self.vectors = None
+        if os.path.exists(self.vectors_path) and os.path.exists(self.texts_path):
+            vectors = np.load(self.vectors_path, mmap_mode="r+")
+            with open(self.texts_path, "r", encoding="utf-8") as f:
+                texts = [json.loads(line) for line in f if line.strip()]
+            if vectors.shape[1] == dim and len(texts) <= len(vectors):
+                self.vectors, self.texts = vectors, texts
+            else:
+                logging.warning(f"[memory] Index for chat {chat_id} does not match, starting over")
+        if self.vectors is None:
+            self._rewrite(np.zeros((0, dim), dtype=np.float16), [], INITIAL_CAPACITY)
+
+    def _rewrite(self, rows: np.ndarray, texts: list[str], capacity: int) -> None:
+        os.makedirs(MEMORY_DIR, exist_ok=True)
+        tmp_path = f"{self.vectors_path}.tmp.npy"
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float16, shape=(capacity, self.dim)
+        )
+        vectors[: len(rows)] = rows
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+        with open(self.texts_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(t, ensure_ascii=False) + "\n" for t in texts)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.texts = list(texts)
+
+    def add(self, texts: list[str], rows: np.ndarray) -> None:
+        count = len(self.texts)
+        needed = count + len(texts)
+        if needed > len(self.vectors):
+            keep = count
+            if needed > MEMORY_MAX_ITEMS:
+                keep = max(0, min(count, MEMORY_MAX_ITEMS // 2 - len(texts)))
+            capacity = max(keep + len(texts), min(MEMORY_MAX_ITEMS, 2 * len(self.vectors)))
+            self._rewrite(
+                np.array(self.vectors[count - keep : count]), self.texts[count - keep :], capacity
+            )
+            count = keep
+        self.vectors[count : count + len(texts)] = rows
+        self.vectors.flush()
+        with open(self.texts_path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(t, ensure_ascii=False) + "\n" for t in texts)
+        self.texts.extend(texts)
+
+    def search(self, query: np.ndarray, k: int) -> list[tuple[float, int]]:
+        count = len(self.texts)
+        if not count:
+            return []
+        scores = np.asarray(self.vectors[:count], dtype=np.float32) @ query
+        top = np.argpartition(-scores, min(k, count) - 1)[:k]
+        return sorted(((float(scores[i]), int(i)) for i in top), reverse=True)
+
+
+_embedder: Embedder | None = None
+_indexes: dict[int, _ChatIndex] = {}
+_pending: dict[int, list[str]] = {}
+_flush_task: asyncio.Task | None = None
+
+
+def set_embedder(embedder: Embedder | None) -> None:
+    """Use ``embedder`` for new and queried messages; ``None`` turns memory off."""
+    global _embedder
+    _embedder = embedder
+    _indexes.clear()
+
+
+def configure(openai_client) -> None:
+    """Pick the embedder named by MEMORY_INDEX."""
+    if MEMORY_INDEX == "hash":
+        set_embedder(HashEmbedder())
+    elif MEMORY_INDEX == "openai":
+        set_embedder(OpenAIEmbedder(openai_client))
+
+
+def enabled() -> bool:
+    return _embedder is not None
+
+
+def _normalize(rows: np.ndarray) -> np.ndarray:
+    rows = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(rows, axis=-1, keepdims=True)
+    return rows / np.where(norms == 0, 1.0, norms)
+
+
+def _index(chat_id: int, dim: int) -> _ChatIndex:
+    index = _indexes.get(chat_id)
+    if index is None or index.dim != dim:
+        index = _indexes[chat_id] = _ChatIndex(chat_id, dim)
+    return index
+
+
+async def remember(chat_id: int, texts: Sequence[str]) -> None:
+    """Embed ``texts`` in one batch and append them to the chat's index."""
+    texts = [t.strip() for t in texts if t and t.strip()]
+    if not texts or _embedder is None:
+        return
+    rows = _normalize(await _embedder(texts, chat_id))
+    _index(chat_id, rows.shape[1]).add(texts, rows.astype(np.float16))
+
+
+def remember_later(chat_id: int, texts: Sequence[str]) -> None:
+    """Queue ``texts`` for indexing; queued messages are embedded in batches."""
+    global _flush_task
+    if _embedder is None:
+        return
+    _pending.setdefault(chat_id, []).extend(texts)
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush())
+
+
+async def _flush() -> None:
+    while _pending:
+        chat_id, texts = _pending.popitem()
+        try:
+            await remember(chat_id, texts)
+        except Exception as e:
+            logging.warning(f"[memory] Indexing {len(texts)} messages for chat {chat_id} failed: {e}")
+
+
+async def recall(
+    chat_id: int,
+    query: str,
+    *,
+    exclude: Sequence[str] = (),
+    k: int | None = None,
+    token_budget: int | None = None,
+) -> list[str]:
+    """Return earlier messages most similar to ``query``, oldest first.
+
+    Messages in ``exclude`` (those already in the prompt) are skipped, and
+    the result stops before it exceeds ``token_budget`` (about four
+    characters per token).
+    """
+    k = MEMORY_TOP_K if k is None else k
+    budget = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    if _embedder is None or not query.strip() or k <= 0 or budget <= 0:
+        return []
+    query_row = _normalize(await _embedder([query], chat_id))[0]
+    index = _index(chat_id, len(query_row))
+    skip = set(exclude)
+    hits = index.search(query_row, k + len(skip))
+    chosen, used = [], 0
+    for score, row in hits:
+        text = index.texts[row]
+        if score < MEMORY_MIN_SCORE or text in skip:
+            continue
+        tokens = len(text) // 4 + 1
+        if used + tokens > budget or len(chosen) >= k:
+            break
+        skip.add(text)
+        chosen.append(row)
+        used += tokens
+    return [index.texts[row] for row in sorted(chosen)]
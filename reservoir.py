@@ -0,0 +1,121 @@
+"""Background-filled pools of ready-to-serve content.
+
+A :class:`Reservoir` keeps up to ``capacity`` items produced by an async
+``produce`` callable. Taking an item that leaves the pool at or below
+``low_watermark`` schedules a refill in the background, so callers are
+answered from memory and upstream slowness stays off their path. Items are
+deduplicated by a hash of their content.
+"""
+
+import asyncio
+import hashlib
+import random
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class Reservoir:
+    """Bounded pool of prefetched items with low-watermark refills."""
+
+    def __init__(
+        self,
+        name: str,
+        produce: Callable[[], Awaitable[list[Any]]],
+        *,
+        capacity: int = 10,
+        low_watermark: int = 3,
+        key: Callable[[Any], str | bytes] = str,
+        discard: Callable[[Any], None] | None = None,
+        seen_limit: int = 500,
+        max_failures: int = 3,
+    ) -> None:
+        self.name = name
+        self.produce = produce
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.key = key
+        self.discard = discard
+        self.seen_limit = seen_limit
+        self.max_failures = max_failures
+        self._items: list[Any] = []
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._task: asyncio.Task | None = None
+        self._available = asyncio.Event()
+        self._stats = {"served": 0, "waited": 0, "duplicates": 0, "failures": 0}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _digest(self, item: Any) -> str:
+        value = self.key(item)
+        if isinstance(value, str):
+            value = value.encode()
+        return hashlib.sha256(value).hexdigest()
+
+    def _drop(self, item: Any) -> None:
+        if self.discard is not None:
+            try:
+                self.discard(item)
+            except Exception as e:
+                print(f"[reservoir] {self.name}: failed to discard item: {e}")
+
+    async def _fill(self) -> None:
+        failures = 0
+        while len(self._items) < self.capacity and failures < self.max_failures:
+            try:
+                batch = await self.produce()
+            except Exception as e:
+                failures += 1
+                self._stats["failures"] += 1
+                print(f"[reservoir] {self.name}: produce failed: {e}")
+                continue
+            added = 0
+            for item in batch:
+                digest = self._digest(item)
+                if len(self._items) >= self.capacity or digest in self._seen:
+                    if digest in self._seen:
+                        self._stats["duplicates"] += 1
+                    self._drop(item)
+                    continue
+                self._seen[digest] = None
+                while len(self._seen) > self.seen_limit:
+                    self._seen.popitem(last=False)
+                self._items.append(item)
+                self._available.set()
+                added += 1
+            if not added:
+                failures += 1
+
+    def refill(self) -> asyncio.Task:
+        """Start a background refill unless one is already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._fill())
+        return self._task
+
+    async def take(self) -> Any:
+        """Return a random pooled item, waiting for the refill if the pool is empty.
+
+        Raises ``LookupError`` when a refill finished without producing anything.
+        """
+        if not self._items:
+            self._stats["waited"] += 1
+        while not self._items:
+            task = self.refill()
+            waiter = asyncio.ensure_future(self._available.wait())
+            try:
+                await asyncio.wait({waiter, task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if not self._items and task.done():
+                raise LookupError(f"{self.name}: no items available")
+
+        item = self._items.pop(random.randrange(len(self._items)))
+        if not self._items:
+            self._available.clear()
+        if len(self._items) <= self.low_watermark:
+            self.refill()
+        self._stats["served"] += 1
+        return item
+
+    def stats(self) -> dict[str, int]:
+        return {"pooled": len(self._items), **self._stats}
@@ -206,3 +206,85 @@ def test_clear_history_nonexistent():
     # Should not raise
     agent_client.clear_history(999)
     assert 999 not in agent_client._histories
+
+
+@pytest.mark.asyncio
+async def test_image_sent_but_only_text_stored(monkeypatch):
+    monkeypatch.setattr(agent_client, "MCP_SERVER_URL", "http://example.com/sse")
+    monkeypatch.setattr(agent_client.MCPServerSse, "connect", AsyncMock())
+    await agent_client.create_thread_with_system_prompt("sys", bot_name="bot")
+    run_mock = AsyncMock(return_value=Mock(final_output="nice cat"))
+    monkeypatch.setattr(agent_client.Runner, "run", run_mock)
+    agent_client._histories.pop(5, None)
+
+    content = [
+        {"type": "input_text", "text": "what is this?"},
+        {"type": "input_text", "text": "[Photo: a cat on a sofa]"},
+        {"type": "input_image", "file_id": "f1"},
+    ]
+    await agent_client.ask_agent([{"role": "user", "content": content}], chat_id=5)
+
+    api_input = run_mock.await_args.args[1]
+    assert api_input[-1]["content"][-1] == {"type": "input_image", "file_id": "f1"}
+    assert agent_client._histories[5][0] == {"role": "user", "content": content[:2]}
+
+
+@pytest.mark.asyncio
+async def test_structured_reply_uses_output_type(monkeypatch):
+    monkeypatch.setattr(agent_client.MCPServerSse, "connect", AsyncMock())
+    await agent_client.create_thread_with_system_prompt("sys", bot_name="bot")
+    agent_client._histories.clear()
+    handle = "media:" + "a" * 64 + ".jpg"
+    output = agent_client.AgentReply(text="look", image=handle, voice=None, command=None)
+    run_mock = AsyncMock(return_value=Mock(final_output=output))
+    monkeypatch.setattr(agent_client.Runner, "run", run_mock)
+
+    reply = await agent_client.ask_agent(
+        [{"role": "user", "content": "hi"}], chat_id=1, structured=True
+    )
+
+    assert reply is output
+    assert run_mock.await_args.args[0].output_type is agent_client.AgentReply
+    assert agent_client._histories[1][-1] == {"role": "assistant", "content": "look"}
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("use {braces} freely", {"text": "use {braces} freely"}),
+        ('{"url": "http://e.com/a.jpg", "caption": "c"}', {"text": "c", "image": "http://e.com/a.jpg"}),
+        ('Here\n{"image_url": "http://e.com/a.png"}\nNice', {"text": "Nice", "image": "http://e.com/a.png"}),
+        (json.dumps(json.dumps({"voice": "b2dn", "caption": "hi"})), {"text": "hi", "voice": "b2dn"}),
+        ('{"command": "/fact"}', {"text": "", "command": "/fact"}),
+        ('{"note": "just data"}', {"text": '{"note": "just data"}'}),
+        ("Check this http://e.com/a.jpg", {"text": "", "image": "http://e.com/a.jpg"}),
+        ("Take it media:" + "b" * 64 + ".ogg please", {"text": "Take it please", "voice": "media:" + "b" * 64 + ".ogg"}),
+    ],
+)
+def test_parse_reply_legacy_formats(raw, expected):
+    reply = agent_client.parse_reply(raw)
+
+    assert reply.model_dump() == {"text": "", "image": None, "voice": None, "command": None, **expected}
+
+
+@pytest.mark.asyncio
+async def test_detached_call_waits_for_interactive_and_skips_history(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(agent_client.MCPServerSse, "connect", AsyncMock())
+    await agent_client.create_thread_with_system_prompt("sys", bot_name="bot")
+    agent_client._histories.clear()
+    monkeypatch.setattr(agent_client, "BACKGROUND_IDLE_POLL", 0.01)
+    monkeypatch.setattr(agent_client, "_background_slot", None)
+    run_mock = AsyncMock(return_value=Mock(final_output="later"))
+    monkeypatch.setattr(agent_client.Runner, "run", run_mock)
+
+    monkeypatch.setattr(agent_client, "_inflight", 1)
+    task = asyncio.create_task(agent_client.ask_detached([{"role": "system", "content": "nudge"}]))
+    await asyncio.sleep(0.05)
+    assert run_mock.await_count == 0
+
+    agent_client._inflight = 0
+    assert await task == "later"
+    assert run_mock.await_args.args[1][0] == {"role": "system", "content": "sys"}
+    assert agent_client._histories == {}
@@ -133,3 +133,26 @@ def test_trim_missing_file(tmp_bus_dir):
     bot_bus.init_bus()
     # Should not raise
     bot_bus.trim(999, max_lines=5)
+
+
+def test_reply_counts_since(monkeypatch):
+    bot_bus.broadcast(100, "a_bot", "old")
+    since = bot_bus.last_message_time(100) + 1e-6
+    bot_bus.broadcast(100, "a_bot", "one")
+    bot_bus.broadcast(100, "a_bot", "two")
+    bot_bus.broadcast(100, "b_bot", "three")
+
+    assert bot_bus.reply_counts(100, since) == {"a_bot": 2, "b_bot": 1}
+    assert bot_bus.reply_counts(200, since) == {}
+
+
+def test_members_include_silent_bots(tmp_bus_dir):
+    import time
+
+    bot_bus.mark_seen(100, "b_bot")
+    bot_bus.mark_seen(100, "a_bot")
+    bot_bus.mark_seen(200, "c_bot")
+
+    assert bot_bus.members(100, time.time() - 60) == ["a_bot", "b_bot"]
+    assert bot_bus.members(100, time.time() + 60) == []
+    assert bot_bus.members(300, 0) == []
@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+
+import chime_gate
+
+
+@pytest.fixture(autouse=True)
+def default_gate(monkeypatch):
+    monkeypatch.setattr(chime_gate, "_weights", chime_gate.DEFAULT_WEIGHTS)
+    monkeypatch.setattr(chime_gate, "_scorer", None)
+    monkeypatch.setattr(chime_gate, "_stats", {"scored": 0, "avoided": 0})
+
+
+@pytest.mark.parametrize("text", ["ok", "ок", "+", "))", "ага", "lol 😂"])
+def test_acknowledgements_are_skipped(text):
+    assert not chime_gate.allow(text)
+
+
+@pytest.mark.parametrize(
+    "text", ["hello", "hey", "привет всем", "кто смотрел вчерашний матч?",
+             "I think the new season was much better than the first one"],
+)
+def test_greetings_questions_and_sentences_pass(text):
+    assert chime_gate.allow(text)
+
+
+def test_avoided_calls_counted():
+    chime_gate.allow("ok")
+    chime_gate.allow("hello")
+
+    assert chime_gate.stats() == {"scored": 2, "avoided": 1}
+
+
+def test_batch_scores_match_single(monkeypatch):
+    texts = ["ok", "hello", "what do you think?"]
+
+    batch = chime_gate.score(texts, [0, 1, 2])
+
+    assert batch.shape == (3,)
+    for text, since, expected in zip(texts, [0, 1, 2], batch):
+        assert chime_gate.score([text], since)[0] == pytest.approx(expected)
+
+
+def test_pluggable_scorer(monkeypatch):
+    chime_gate.set_scorer(lambda x: np.zeros(len(x)))
+
+    assert not chime_gate.allow("hello")
+
+
+def test_train_from_history_and_load(tmp_path, monkeypatch):
+    history = []
+    for _ in range(20):
+        history += [
+            {"role": "user", "content": "anna: ok"},
+            {"role": "user", "content": "anna: what are we doing tonight?"},
+            {"role": "assistant", "content": "Cinema!"},
+        ]
+    history_dir = tmp_path / "chat_history"
+    history_dir.mkdir()
+    (history_dir / "100.json").write_text(json.dumps(history))
+    weights_path = tmp_path / "gate.npz"
+
+    assert chime_gate.main(["chime_gate.py", "train", str(history_dir), str(weights_path)]) == 0
+    assert chime_gate.load_weights(str(weights_path))
+
+    scores = chime_gate.score(["ok", "what are we doing tonight?"], [0, 1])
+    assert scores[0] < 0.5 < scores[1]
+
+
+def test_load_weights_rejects_missing_file(tmp_path):
+    assert not chime_gate.load_weights(str(tmp_path / "missing.npz"))
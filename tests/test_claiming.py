@@ -92,3 +92,66 @@ async def test_try_claim_second_loses(monkeypatch, tmp_path):
 
     second = await main.try_claim_message(msg)
     assert second is False
+
+
+@pytest.fixture
+def election(monkeypatch, tmp_path):
+    os.makedirs(tmp_path / "claims")
+    monkeypatch.setattr(main, "CLAIM_DIR", str(tmp_path / "claims"))
+    monkeypatch.setattr(main.bot_bus, "BOT_BUS_DIR", str(tmp_path / "bus"))
+    for bot_name in ("alpha_bot", "beta_bot", "gamma_bot"):
+        main.bot_bus.broadcast(100, bot_name, "hi")
+
+
+def _elected(monkeypatch, msg):
+    elected = []
+    for bot_name in ("alpha_bot", "beta_bot", "gamma_bot"):
+        monkeypatch.setattr(main, "BOT_USERNAME", bot_name)
+        if main._chime_in_elected(msg):
+            elected.append(bot_name)
+    return elected
+
+
+def test_chime_in_election_agrees_across_bots(monkeypatch, election):
+    for i in range(20):
+        assert len(_elected(monkeypatch, FakeMessage(f"message {i}"))) == 1
+
+    monkeypatch.setattr(main, "MAX_CHIME_IN_BOTS", 2)
+    assert len(_elected(monkeypatch, FakeMessage("message"))) == 2
+
+
+def test_chime_in_election_counts_bots_without_replies(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.bot_bus, "BOT_BUS_DIR", str(tmp_path / "bus"))
+    bots = ("quiet_bot", "shy_bot")
+    for bot_name in bots:
+        main.bot_bus.mark_seen(100, bot_name)
+
+    for i in range(20):
+        msg = FakeMessage(f"first words {i}")
+        elected = []
+        for bot_name in bots:
+            monkeypatch.setattr(main, "BOT_USERNAME", bot_name)
+            if main._chime_in_elected(msg):
+                elected.append(bot_name)
+        assert len(elected) == 1
+
+
+def test_chime_in_election_favours_quieter_bots(monkeypatch, election):
+    for _ in range(9):
+        main.bot_bus.broadcast(100, "alpha_bot", "chatty")
+
+    wins = {}
+    for i in range(300):
+        for bot_name in _elected(monkeypatch, FakeMessage(f"message {i}")):
+            wins[bot_name] = wins.get(bot_name, 0) + 1
+
+    # alpha_bot has weight 1/11 against 1/2 for the others
+    assert wins.get("alpha_bot", 0) < wins["beta_bot"] / 2
+    assert wins.get("alpha_bot", 0) < wins["gamma_bot"] / 2
+
+
+def test_chime_in_slots_cap_callers(monkeypatch, election):
+    monkeypatch.setattr(main, "MAX_CHIME_IN_BOTS", 2)
+    msg = FakeMessage("hello")
+
+    assert [main._claim_chime_in_slot(msg) for _ in range(3)] == [True, True, False]
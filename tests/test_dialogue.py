@@ -14,6 +14,7 @@ from datetime import datetime
 
 import main
 import agent_client
+import media_store
 
 
 class FakeUser:
@@ -49,6 +50,14 @@ class FakeMessage:
         self.voice_replies.append(voice)
 
 
+@pytest.fixture(autouse=True)
+def isolated_claims(monkeypatch, tmp_path):
+    """Keep chime-in claims and bus reads out of the shared /tmp directories."""
+    os.makedirs(tmp_path / "claims")
+    monkeypatch.setattr(main, "CLAIM_DIR", str(tmp_path / "claims"))
+    monkeypatch.setattr(main.bot_bus, "BOT_BUS_DIR", str(tmp_path / "bus"))
+
+
 @pytest.mark.asyncio
 async def test_direct_mention(monkeypatch):
     agent_client._histories.clear()
@@ -186,21 +195,20 @@ async def test_voice_command(monkeypatch, tmp_path):
     main.last_bot_reply_time.clear()
     msg = FakeMessage('/voice hello world')
     monkeypatch.setattr(main, 'try_claim_message', AsyncMock(return_value=True))
-    voice_path = tmp_path / 'v.ogg'
-    voice_path.write_text('x')
-    gen_mock = AsyncMock(return_value=str(voice_path))
+    monkeypatch.setattr(media_store, 'MEDIA_DIR', str(tmp_path / 'media'))
+    handle = media_store.put(b'x', '.ogg')
+    gen_mock = AsyncMock(return_value=handle)
     monkeypatch.setattr(main, 'generate_voice_file', gen_mock)
-    removed = []
-    monkeypatch.setattr(main.os, 'remove', lambda p: removed.append(p))
 
     await main.handle_message(msg)
 
-    gen_mock.assert_awaited_once_with('hello world')
+    gen_mock.assert_awaited_once_with('hello world', 100)
     assert len(msg.voice_replies) == 1
     voice_file = msg.voice_replies[0]
     assert isinstance(voice_file, main.FSInputFile)
-    assert voice_file.path == str(voice_path)
-    assert removed == [str(voice_path)]
+    assert voice_file.path == media_store.path(handle)
+    # Store files are shared and collected by age, never deleted after sending
+    assert media_store.exists(handle)
 
 
 @pytest.mark.asyncio
@@ -229,20 +237,17 @@ async def test_voice_in_assistant_reply(monkeypatch, tmp_path):
     main.last_activity_time.clear()
     main.last_bot_reply_time.clear()
     msg = FakeMessage(f'@{main.BOT_USERNAME} hi')
-    voice_path = tmp_path / 'a.mp3'
-    voice_path.write_text('x')
-    ask_mock = AsyncMock(return_value=f"Take it {voice_path}")
+    monkeypatch.setattr(media_store, 'MEDIA_DIR', str(tmp_path / 'media'))
+    handle = media_store.put(b'x', '.mp3')
+    ask_mock = AsyncMock(return_value=f"Take it {handle}")
     monkeypatch.setattr(main, 'ask_openai', ask_mock)
-    remove_list = []
-    monkeypatch.setattr(main.os, 'remove', lambda p: remove_list.append(p))
 
     await main.handle_message(msg)
 
     assert ask_mock.await_count == 1
     assert len(msg.voice_replies) == 1
-    assert msg.voice_replies[0].path == str(voice_path)
+    assert msg.voice_replies[0].path == media_store.path(handle)
     assert msg.replies == ['Take it']
-    assert remove_list == [str(voice_path)]
 
 
 @pytest.mark.asyncio
@@ -259,3 +264,40 @@ async def test_voice_trigger_prefix(monkeypatch):
 
     assert ask_mock.await_count == 1
     assert ask_mock.await_args.kwargs['tool_choice'] == 'generate_voice'
+
+
+@pytest.mark.asyncio
+async def test_unmentioned_acknowledgement_skipped_by_gate(monkeypatch):
+    agent_client._histories.clear()
+    main.bot_unmentioned_count.clear()
+    main.last_bot_reply_time.clear()
+    main.messages_since_bot_reply.clear()
+    fake_msg = FakeMessage('ok')
+    ask_mock = AsyncMock(return_value='should-not-reply')
+    monkeypatch.setattr(main, 'ask_agent', ask_mock)
+    monkeypatch.setattr(main.chime_gate, '_stats', {'scored': 0, 'avoided': 0})
+    # The probability ladder alone would always respond
+    main.messages_since_bot_reply[fake_msg.chat.id] = 4
+
+    await main.handle_message(fake_msg)
+
+    ask_mock.assert_not_awaited()
+    assert main.chime_gate.stats()['avoided'] == 1
+    assert main.bot_unmentioned_count.get(fake_msg.chat.id, 0) == 0
+
+
+@pytest.mark.asyncio
+async def test_no_chime_in_over_hard_budget(monkeypatch):
+    agent_client._histories.clear()
+    main.bot_unmentioned_count.clear()
+    main.last_bot_reply_time.clear()
+    main.messages_since_bot_reply.clear()
+    fake_msg = FakeMessage('hello')
+    ask_mock = AsyncMock(return_value='should-not-reply')
+    monkeypatch.setattr(main, 'ask_agent', ask_mock)
+    monkeypatch.setattr(main.usage_ledger, 'budget_state', lambda chat_id: 'hard')
+    main.messages_since_bot_reply[fake_msg.chat.id] = 4
+
+    await main.handle_message(fake_msg)
+
+    ask_mock.assert_not_awaited()
@@ -12,18 +12,23 @@ os.environ.setdefault('ELEVEN_API_KEY', 'sk-test')
 sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, '..'))))
 
 import main
+import media_store
+
+
+@pytest.fixture(autouse=True)
+def isolated_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
 
 
 @pytest.mark.asyncio
 async def test_extract_json_image_from_nested(monkeypatch, tmp_path):
-    file_path = tmp_path / "poster.jpg"
-    file_path.write_text("x")
+    handle = media_store.put(b"x", ".jpg")
 
     async def fake_download(url: str) -> str:
         assert url == "https://commons.wikimedia.org/wiki/Special:FilePath/Jaws%20movie%20poster.jpg?width=800"
-        return str(file_path)
+        return handle
 
-    monkeypatch.setattr(main, "download_image_to_tmp", fake_download)
+    monkeypatch.setattr(main, "download_media", fake_download)
 
     inner = {
         "url": "https://commons.wikimedia.org/wiki/Special:FilePath/Jaws%20movie%20poster.jpg?width=800",
@@ -37,54 +42,54 @@ async def test_extract_json_image_from_nested(monkeypatch, tmp_path):
     reply = json.dumps(wrapper)
 
     result = await main._extract_json_image(reply)
-    assert result == (str(file_path), inner["caption"])
+    assert result == (handle, inner["caption"])
+
+
+@pytest.mark.asyncio
+async def test_extract_json_image_media_handle():
+    handle = media_store.put(b"x", ".jpg")
+
+    result = await main._extract_json_image(f"[meme] {handle} so true")
+
+    assert result == (handle, "so true")
 
 
 @pytest.mark.asyncio
-async def test_extract_json_image_local_path():
-    import tempfile
-    with tempfile.NamedTemporaryFile(dir="/tmp", suffix=".jpg", delete=False) as f:
-        f.write(b"x")
-        file_path = f.name
-    try:
-        reply = f"[meme] {file_path}"
-        result = await main._extract_json_image(reply)
-        assert result == (file_path, "")
-    finally:
-        os.remove(file_path)
+async def test_extract_json_image_ignores_audio_handle():
+    handle = media_store.put(b"x", ".ogg")
+
+    assert await main._extract_json_image(f"listen {handle}") is None
 
 
 @pytest.mark.asyncio
 async def test_extract_json_image_caption_after_json(monkeypatch, tmp_path):
-    file_path = tmp_path / "img.jpg"
-    file_path.write_text("x")
+    handle = media_store.put(b"x", ".jpg")
 
     async def fake_download(url: str) -> str:
         assert url == "http://example.com/img.jpg"
-        return str(file_path)
+        return handle
 
-    monkeypatch.setattr(main, "download_image_to_tmp", fake_download)
+    monkeypatch.setattr(main, "download_media", fake_download)
 
     reply = "Here it is\n{" + "\"url\": \"http://example.com/img.jpg\"}" + "\nNice view"
 
     result = await main._extract_json_image(reply)
-    assert result == (str(file_path), "Nice view")
+    assert result == (handle, "Nice view")
 
 
 @pytest.mark.asyncio
 async def test_extract_json_image_json_string(monkeypatch, tmp_path):
-    file_path = tmp_path / "img.jpg"
-    file_path.write_text("x")
+    handle = media_store.put(b"x", ".jpg")
 
     async def fake_download(url: str) -> str:
         assert url == "http://example.com/img.jpg"
-        return str(file_path)
+        return handle
 
-    monkeypatch.setattr(main, "download_image_to_tmp", fake_download)
+    monkeypatch.setattr(main, "download_media", fake_download)
 
     inner = {"url": "http://example.com/img.jpg", "caption": "Nice"}
     reply = json.dumps(json.dumps(inner))
 
     result = await main._extract_json_image(reply)
 
-    assert result == (str(file_path), "Nice")
+    assert result == (handle, "Nice")
@@ -10,28 +10,36 @@ os.environ.setdefault('ELEVEN_API_KEY', 'sk-test')
 sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, '..'))))
 
 import main
+import media_store
+
+
+@pytest.fixture(autouse=True)
+def isolated_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+
+
+@pytest.mark.asyncio
+async def test_extract_voice_file_media_handle():
+    handle = media_store.put(b"x", ".mp3")
+
+    result = await main._extract_voice_file(f"Here {handle}")
+
+    assert result == (handle, "Here")
 
 
 @pytest.mark.asyncio
-async def test_extract_voice_file_local_path():
-    import tempfile
-    with tempfile.NamedTemporaryFile(dir="/tmp", suffix=".mp3", delete=False) as f:
-        f.write(b"x")
-        file_path = f.name
-    try:
-        reply = f"Here {file_path}"
-        result = await main._extract_voice_file(reply)
-        assert result == (file_path, "Here")
-    finally:
-        os.remove(file_path)
+async def test_extract_voice_file_json():
+    handle = media_store.put(b"x", ".ogg")
+    reply = json.dumps({"voice": handle, "caption": "hi"})
+
+    result = await main._extract_voice_file(reply)
+    assert result == (handle, "hi")
 
 
 @pytest.mark.asyncio
-async def test_extract_voice_file_json(monkeypatch, tmp_path):
-    file_path = tmp_path / "voice.ogg"
-    file_path.write_text('x')
-    data = {"path": str(file_path), "caption": "hi"}
-    reply = json.dumps(data)
+async def test_extract_voice_file_base64_stays_in_memory():
+    reply = json.dumps({"voice": "b2dnLWJ5dGVz", "caption": "hi"})
 
     result = await main._extract_voice_file(reply)
-    assert result == (str(file_path), "hi")
+
+    assert result == (b"ogg-bytes", "hi")
@@ -28,8 +28,11 @@ class FakeChat:
 
 
 class FakePhoto:
-    def __init__(self, data=b'img'):
+    def __init__(self, data=b'img', width=1280, height=960, file_unique_id='uniq-1280'):
         self.data = data
+        self.width = width
+        self.height = height
+        self.file_unique_id = file_unique_id
         self.download_called = False
         self.read_called = False
 
@@ -45,13 +48,14 @@ class FakePhoto:
 class FakeMessage:
     _next_id = 1
 
-    def __init__(self, caption=None):
+    def __init__(self, caption=None, media_group_id=None, photo=None):
         self.caption = caption
+        self.media_group_id = media_group_id
         self.text = None
         self.message_id = FakeMessage._next_id
         FakeMessage._next_id += 1
         self.date = datetime.now()
-        self.photo = [FakePhoto()]
+        self.photo = [photo or FakePhoto()]
         self.from_user = FakeUser()
         self.chat = FakeChat()
         self.replies = []
@@ -72,18 +76,134 @@ async def test_handle_photo(monkeypatch):
     async def fake_download(photo):
         return await photo.download()
 
+    main._vision_files.clear()
+    monkeypatch.setattr(main, 'VISION_INLINE_MAX_BYTES', 0)
     monkeypatch.setattr(main, 'try_claim_message', AsyncMock(return_value=True))
     monkeypatch.setattr(main.bot, 'download', fake_download)
     file_mock = AsyncMock(return_value=type('F', (), {'id': 'f1'}))
+    describe_mock = AsyncMock(side_effect=RuntimeError('no vision model'))
     ask_mock = AsyncMock(return_value='got it')
     monkeypatch.setattr(main.openai_client.files, 'create', file_mock)
+    monkeypatch.setattr(main, 'describe_image', describe_mock)
     monkeypatch.setattr(main, 'ask_agent', ask_mock)
 
     await main.handle_photo(msg)
 
     assert photo_obj.download_called is True
     assert photo_obj.read_called is True
+    # Without a description the full image is sent
     file_mock.assert_awaited_once()
     ask_mock.assert_awaited_once()
     assert file_mock.await_args.kwargs['file'].getvalue() == photo_obj.data
     assert msg.replies == ['got it']
+
+
+@pytest.fixture
+def vision_mocks(monkeypatch, tmp_path):
+    agent_client._histories.clear()
+    main._vision_files.clear()
+    monkeypatch.setattr(main, 'IMAGE_DESCRIPTION_DIR', str(tmp_path / 'descriptions'))
+    monkeypatch.setattr(main, 'VISION_INLINE_MAX_BYTES', 0)
+
+    async def fake_download(photo):
+        return await photo.download()
+
+    mocks = type('Mocks', (), {})()
+    mocks.files = AsyncMock(return_value=type('F', (), {'id': 'f1'}))
+    mocks.describe = AsyncMock(return_value=type('R', (), {'output_text': 'A cat on a sofa.'}))
+    mocks.ask = AsyncMock(return_value='got it')
+    monkeypatch.setattr(main, 'try_claim_message', AsyncMock(return_value=True))
+    monkeypatch.setattr(main.bot, 'download', fake_download)
+    monkeypatch.setattr(main.openai_client.files, 'create', mocks.files)
+    monkeypatch.setattr(main.openai_client.responses, 'create', mocks.describe)
+    monkeypatch.setattr(main, 'ask_agent', mocks.ask)
+    return mocks
+
+
+@pytest.mark.asyncio
+async def test_handle_photo_sends_description_instead_of_image(vision_mocks):
+    first, forwarded = FakeMessage(), FakeMessage()
+    await main.handle_photo(first)
+    await main.handle_photo(forwarded)
+
+    # Described once, shared by the forward without downloading it again
+    vision_mocks.describe.assert_awaited_once()
+    assert forwarded.photo[-1].download_called is False
+    content = vision_mocks.ask.await_args.args[0][0]['content']
+    assert content[1] == {'type': 'input_text', 'text': '[Photo: A cat on a sofa.]'}
+    assert all(part['type'] == 'input_text' for part in content)
+
+
+@pytest.mark.asyncio
+async def test_handle_photo_reuses_upload_for_same_file(vision_mocks):
+    first, forwarded = FakeMessage('прочитай, что там написано'), FakeMessage('что написано?')
+    await main.handle_photo(first)
+    await main.handle_photo(forwarded)
+
+    vision_mocks.files.assert_awaited_once()
+    assert forwarded.photo[-1].download_called is False
+    content = vision_mocks.ask.await_args.args[0][0]['content']
+    assert content[-1]['file_id'] == 'f1'
+
+
+@pytest.mark.asyncio
+async def test_handle_photo_records_vision_cost_for_chat(vision_mocks, monkeypatch):
+    monkeypatch.setattr(main.usage_ledger, '_totals', {})
+    usage = type('U', (), {'input_tokens': 900, 'output_tokens': 40})()
+    vision_mocks.describe.return_value = type(
+        'R', (), {'output_text': 'A sign.', 'usage': usage}
+    )()
+    await main.handle_photo(FakeMessage('прочитай, что там написано'))
+
+    chat = main.usage_ledger.summary(100)
+    assert chat['vision']['vision_uploads'] == 1
+    assert chat['describe']['input_tokens'] == 900
+    assert main.usage_ledger.summary().keys() == chat.keys()
+
+
+def test_pick_photo_size_smallest_sufficient(monkeypatch):
+    sizes = [
+        FakePhoto(width=90, height=68),
+        FakePhoto(width=320, height=240),
+        FakePhoto(width=800, height=600),
+        FakePhoto(width=1280, height=960),
+    ]
+
+    monkeypatch.setattr(main, 'VISION_DETAIL', 'low')
+    assert main._pick_photo_size(sizes) is sizes[2]
+    monkeypatch.setattr(main, 'VISION_DETAIL', 'high')
+    assert main._pick_photo_size(sizes) is sizes[3]
+    assert main._pick_photo_size(sizes[:2]) is sizes[1]
+
+
+@pytest.mark.asyncio
+async def test_album_gets_one_claim_one_request_one_reply(vision_mocks, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(main, 'MEDIA_GROUP_WINDOW', 0.01)
+    claim_mock = AsyncMock(return_value=True)
+    monkeypatch.setattr(main, 'try_claim_message', claim_mock)
+    album = [
+        FakeMessage('наш отпуск' if i == 0 else None, media_group_id='album-1',
+                    photo=FakePhoto(data=b'img%d' % i, file_unique_id=f'uniq-{i}'))
+        for i in range(3)
+    ]
+
+    await asyncio.gather(*(main.handle_photo(m) for m in album))
+
+    claim_mock.assert_awaited_once_with(album[0])
+    vision_mocks.ask.assert_awaited_once()
+    vision_mocks.describe.assert_not_awaited()
+    content = vision_mocks.ask.await_args.args[0][0]['content']
+    assert content[0] == {'type': 'input_text', 'text': 'наш отпуск'}
+    assert [part['type'] for part in content[1:]] == ['input_image'] * 3
+    assert album[0].replies == ['got it']
+    assert album[1].replies == album[2].replies == []
+    assert main._media_groups == {}
+
+
+def test_album_claim_key_shared():
+    first = FakeMessage('caption', media_group_id='album-1')
+    second = FakeMessage(None, media_group_id='album-1')
+
+    assert main._claim_key(first) == main._claim_key(second)
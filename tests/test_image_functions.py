@@ -1,6 +1,7 @@
 import sys
 import os
 import base64
+import json
 
 os.environ.setdefault("TELEGRAM_TOKEN", "123456:TESTTOKEN")
 os.environ.setdefault("OPENAI_API_KEY", "sk-test")
@@ -58,6 +59,7 @@ async def test_ask_openai_image(monkeypatch):
 
     monkeypatch.setattr(main.openai_client.files, "create", file_mock)
     monkeypatch.setattr(main, "ask_agent", agent_mock)
+    monkeypatch.setattr(main, "VISION_INLINE_MAX_BYTES", 0)
 
     result = await main.ask_openai_image(dummy, prompt="p", chat_id=1)
 
@@ -67,13 +69,112 @@ async def test_ask_openai_image(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_style_caption(monkeypatch):
-    ask_mock = AsyncMock(return_value="styled")
-    monkeypatch.setattr(main, "ask_openai", ask_mock)
+async def test_ask_openai_image_inlines_small_images(monkeypatch):
+    file_mock = AsyncMock()
+    agent_mock = AsyncMock(return_value="final reply")
+    monkeypatch.setattr(main.openai_client.files, "create", file_mock)
+    monkeypatch.setattr(main, "ask_agent", agent_mock)
+
+    await main.ask_openai_image(b"tiny", prompt="p", chat_id=1)
+
+    file_mock.assert_not_awaited()
+    image_part = agent_mock.await_args.args[0][0]["content"][1]
+    assert image_part["image_url"] == "data:image/jpeg;base64," + base64.b64encode(b"tiny").decode()
+
+
+class FakeFiles:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete(self, file_id):
+        self.deleted.append(file_id)
+
+
+@pytest.mark.asyncio
+async def test_vision_file_janitor_deletes_own_expired_uploads(monkeypatch, tmp_path):
+    import time
+
+    now = time.time()
+    files = FakeFiles()
+    monkeypatch.setattr(main.openai_client, "files", files)
+    monkeypatch.setattr(main, "VISION_UPLOADS_FILE", str(tmp_path / "uploads.json"))
+    # Uploads by other bots or applications are never in this bot's record
+    monkeypatch.setattr(main, "_vision_uploads", {
+        "old": now - main.VISION_FILE_TTL_SECONDS - 60, "new": now - 60,
+    })
+    main._vision_files.clear()
+    main._vision_files["u-old"] = ("old", now - main.VISION_FILE_TTL_SECONDS - 60)
+    main._vision_files["u-new"] = ("new", now - 60)
+
+    async def stop(_seconds):
+        raise main.asyncio.CancelledError
+
+    monkeypatch.setattr(main.asyncio, "sleep", stop)
+    with pytest.raises(main.asyncio.CancelledError):
+        await main.vision_file_janitor()
+
+    assert files.deleted == ["old"]
+    assert list(main._vision_files) == ["u-new"]
+    with open(tmp_path / "uploads.json", encoding="utf-8") as f:
+        assert list(json.load(f)) == ["new"]
+    main._vision_files.clear()
+
+
+@pytest.mark.asyncio
+async def test_vision_upload_is_recorded(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "VISION_UPLOADS_FILE", str(tmp_path / "uploads.json"))
+    monkeypatch.setattr(main, "_vision_uploads", None)
+    monkeypatch.setattr(main, "VISION_INLINE_MAX_BYTES", 0)
+    file_mock = AsyncMock(return_value=type("F", (), {"id": "f9"}))
+    monkeypatch.setattr(main.openai_client.files, "create", file_mock)
+
+    await main._vision_image_content(b"img", None)
+
+    assert file_mock.await_args.kwargs["file"].name.startswith("telebot-")
+    monkeypatch.setattr(main, "_vision_uploads", None)
+    assert list(main._vision_upload_record()) == ["f9"]
+
+
+class FakeResponses:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        await main.asyncio.sleep(0)
+        return type("Response", (), {"output_text": "styled"})()
+
+
+@pytest.mark.asyncio
+async def test_style_caption_history_free_cached_and_coalesced(monkeypatch):
+    responses = FakeResponses()
+    monkeypatch.setattr(main.openai_client, "responses", responses)
+    monkeypatch.setattr(main, "_styled_captions", {})
+    monkeypatch.setattr(main, "_caption_style_slot", None)
+    ask_mock = AsyncMock()
+    monkeypatch.setattr(main, "ask_agent", ask_mock)
+
+    results = await main.asyncio.gather(
+        main.style_caption("original"), main.style_caption("original")
+    )
+    again = await main.style_caption("original")
+
+    assert results == ["styled", "styled"]
+    assert again == "styled"
+    assert len(responses.calls) == 1
+    assert "original" in responses.calls[0]["input"]
+    assert responses.calls[0]["model"] == main.CAPTION_STYLE_MODEL
+    ask_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_style_caption_failure_keeps_original(monkeypatch):
+    async def fail(**kwargs):
+        raise RuntimeError("boom")
 
-    result = await main.style_caption("original", chat_id=42)
+    monkeypatch.setattr(main.openai_client.responses, "create", fail)
+    monkeypatch.setattr(main, "_styled_captions", {})
+    monkeypatch.setattr(main, "_caption_style_slot", None)
 
-    assert result == "styled"
-    assert ask_mock.await_count == 1
-    assert "original" in ask_mock.await_args.args[0]
-    assert ask_mock.await_args.kwargs["chat_id"] == 42
+    assert await main.style_caption("original") == "original"
+    assert main._styled_captions == {}
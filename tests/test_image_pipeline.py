@@ -0,0 +1,74 @@
+import io
+
+import pytest
+
+import image_pipeline
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _png(width, height):
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 16)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    out = io.BytesIO()
+    image.convert("RGBA").save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def clear_stats():
+    image_pipeline._stats.clear()
+
+
+@pytest.mark.asyncio
+async def test_generated_png_reencoded_under_limit(monkeypatch):
+    monkeypatch.setattr(image_pipeline, "IMAGE_OUTPUT_MAX_BYTES", 200 * 1024)
+    png = _png(1024, 1024)
+
+    data, ext = await image_pipeline.encode_for_telegram(png)
+
+    assert ext == "jpg"
+    assert len(data) <= 200 * 1024 < len(png)
+    assert Image.open(io.BytesIO(data)).size == (1024, 1024)
+    stats = image_pipeline.stats()["telegram"]
+    assert stats["images"] == 1
+    assert stats["bytes_saved"] == len(png) - len(data)
+
+
+@pytest.mark.asyncio
+async def test_webp_output(monkeypatch):
+    monkeypatch.setattr(image_pipeline, "IMAGE_OUTPUT_FORMAT", "webp")
+
+    data, ext = await image_pipeline.encode_for_telegram(_png(256, 256))
+
+    assert ext == "webp"
+    assert Image.open(io.BytesIO(data)).format == "WEBP"
+
+
+@pytest.mark.asyncio
+async def test_vision_downscale_to_effective_resolution():
+    photo = _png(2560, 1440)
+
+    high = await image_pipeline.downscale_for_vision(photo, "high")
+    low = await image_pipeline.downscale_for_vision(photo, "low")
+
+    assert Image.open(io.BytesIO(high)).size == (1365, 768)
+    assert Image.open(io.BytesIO(low)).size == (512, 288)
+
+
+@pytest.mark.asyncio
+async def test_small_or_undecodable_images_pass_through():
+    small = _png(600, 400)
+
+    assert await image_pipeline.downscale_for_vision(small, "high") is small
+    assert await image_pipeline.encode_for_telegram(b"not an image") == (b"not an image", "png")
+
+
+@pytest.mark.asyncio
+async def test_without_pillow_images_unchanged(monkeypatch):
+    monkeypatch.setattr(image_pipeline, "Image", None)
+
+    assert await image_pipeline.encode_for_telegram(b"png-bytes") == (b"png-bytes", "png")
+    assert await image_pipeline.downscale_for_vision(b"jpeg-bytes") == b"jpeg-bytes"
+    assert image_pipeline.stats() == {}
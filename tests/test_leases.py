@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import leases
+
+
+@pytest.fixture(autouse=True)
+def lease_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(leases, "LEASE_DIR", str(tmp_path))
+
+
+def test_single_holder_until_release():
+    assert leases.acquire("chat", "a", 60)
+    assert leases.acquire("chat", "a", 60)  # re-entrant for the holder
+    assert not leases.acquire("chat", "b", 60)
+
+    leases.release("chat", "a")
+
+    assert leases.acquire("chat", "b", 60)
+
+
+def test_expired_lease_can_be_taken(monkeypatch):
+    assert leases.acquire("chat", "a", 60)
+    now = leases.time.time()
+    monkeypatch.setattr(leases.time, "time", lambda: now + 61)
+
+    assert leases.acquire("chat", "b", 60)
+    assert not leases.renew("chat", "a", 60)
+
+
+def test_turn_rotates_through_members(monkeypatch):
+    for bot in ("c", "a", "b"):
+        leases.acquire("chat", bot, 60)
+        leases.release("chat", bot, rotate=False)
+
+    order = []
+    for _ in range(4):
+        bot = leases.turn("chat")
+        assert leases.acquire("chat", bot, 60, turn_grace=60)
+        leases.release("chat", bot)
+        order.append(bot)
+
+    assert order == ["a", "b", "c", "a"]
+
+
+def test_out_of_turn_member_waits_grace(monkeypatch):
+    leases.acquire("chat", "a", 60)
+    leases.acquire("chat", "b", 60)  # joins while a holds the lease
+    leases.release("chat", "a")
+    now = leases.time.time()
+
+    assert leases.turn("chat") == "b"
+    assert not leases.acquire("chat", "a", 60, turn_grace=300)
+    monkeypatch.setattr(leases.time, "time", lambda: now + 301)
+    assert leases.acquire("chat", "a", 60, turn_grace=300)
+
+
+def test_release_by_non_owner_is_ignored():
+    leases.acquire("chat", "a", 60)
+    leases.release("chat", "b")
+
+    assert not leases.acquire("chat", "b", 60)
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_renews_lease(monkeypatch):
+    leases.acquire("chat", "a", 0.03)
+    task = asyncio.create_task(leases.keep_alive("chat", "a", 0.03))
+    await asyncio.sleep(0.08)
+
+    assert not leases.acquire("chat", "b", 60)
+    task.cancel()
@@ -10,6 +10,8 @@ import anyio
 from mcp.client.sse import sse_client
 from mcp.client.session import ClientSession
 
+import media_store
+
 
 def test_mcp_server_responds():
     proc = subprocess.Popen([sys.executable, "mcp_server.py"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -279,7 +281,8 @@ def test_retrieve_joke():
         proc.terminate()
         proc.wait(timeout=5)
 
-    assert result.startswith("http")
+    # A pooled meme is returned as a media handle, the fallback as a URL
+    assert result.startswith("http") or media_store.exists(result)
 
 
 async def _call_datetime_tool() -> str:
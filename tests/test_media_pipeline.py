@@ -0,0 +1,180 @@
+import sys
+import os
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:TESTTOKEN")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault('ELEVEN_API_KEY', 'sk-test')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, ".."))))
+
+import pytest
+
+import main
+import media_store
+
+
+class FakeContent:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start : start + size]
+
+
+class FakeResponse:
+    def __init__(self, body, content_length=None):
+        self.content = FakeContent(body)
+        self.content_length = content_length
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+
+def fake_session(body, content_length=None):
+    class FakeSession:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def get(self, url):
+            return FakeResponse(body, content_length)
+
+    return FakeSession
+
+
+@pytest.fixture(autouse=True)
+def isolated_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+
+
+@pytest.mark.asyncio
+async def test_small_download_stays_in_memory(monkeypatch):
+    monkeypatch.setattr(main.aiohttp, "ClientSession", fake_session(b"x" * 100))
+
+    result = await main.download_media("http://example.com/a.jpg")
+
+    assert result == b"x" * 100
+    assert not os.path.exists(media_store.MEDIA_DIR)
+
+
+@pytest.mark.asyncio
+async def test_large_download_spills_to_store(monkeypatch):
+    monkeypatch.setattr(main, "MEDIA_SPILL_BYTES", 50)
+    monkeypatch.setattr(main.aiohttp, "ClientSession", fake_session(b"x" * 100))
+
+    result = await main.download_media("http://example.com/a.png?width=800")
+
+    assert media_store.is_handle(result)
+    assert result.endswith(".png")
+    assert media_store.read(result) == b"x" * 100
+
+
+@pytest.mark.asyncio
+async def test_download_size_limit(monkeypatch):
+    monkeypatch.setattr(main, "MEDIA_MAX_DOWNLOAD_BYTES", 50)
+    monkeypatch.setattr(main.aiohttp, "ClientSession", fake_session(b"x" * 100))
+    with pytest.raises(ValueError):
+        await main.download_media("http://example.com/a.jpg")
+
+    monkeypatch.setattr(main.aiohttp, "ClientSession", fake_session(b"", content_length=100))
+    with pytest.raises(ValueError):
+        await main.download_media("http://example.com/a.jpg")
+
+
+@pytest.mark.asyncio
+async def test_memory_input_file_shares_buffer():
+    data = bytearray(b"abcdefgh")
+    file = main._input_file(data, "a.jpg")
+    file.chunk_size = 3
+
+    chunks = [chunk async for chunk in file.read(None)]
+
+    assert isinstance(file, main.BufferedInputFile)
+    assert all(isinstance(chunk, memoryview) for chunk in chunks)
+    assert b"".join(chunks) == b"abcdefgh"
+    data[0:1] = b"z"  # no copy was taken
+    assert chunks[0].tobytes() == b"zbc"
+
+
+@pytest.mark.asyncio
+async def test_media_send_is_measured(monkeypatch):
+    monkeypatch.setattr(main, "_media_send_stats", dict.fromkeys(main._media_send_stats, 0))
+    method = main.SendPhoto(chat_id=1, photo=main._input_file(b"x" * 10, "a.jpg"))
+
+    async def make_request(bot, method):
+        return "sent"
+
+    assert await main._measure_media_send(make_request, None, method) == "sent"
+    assert main._media_send_stats["sends"] == 1
+    assert main._media_send_stats["bytes"] == 10
+    assert main._media_send_stats["peak_rss_kb"] > 0
+
+
+class FakeFile:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeSentMessage:
+    def __init__(self, file_id):
+        self.photo = [FakeFile("small"), FakeFile(file_id)]
+
+
+@pytest.mark.asyncio
+async def test_repeated_photo_is_sent_by_file_id(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "FILE_ID_CACHE_FILE", str(tmp_path / "file_ids" / "bot.json"))
+    monkeypatch.setattr(main, "_file_ids", None)
+    monkeypatch.setattr(main, "_file_id_stats", dict.fromkeys(main._file_id_stats, 0))
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.photo)
+        return FakeSentMessage("AgAD-photo")
+
+    handle = media_store.put(b"potd", ".jpg")
+    for media in (b"potd", handle):
+        method = main.SendPhoto(chat_id=1, photo=main._input_file(media, "potd.jpg"))
+        await main._reuse_telegram_file_id(make_request, None, method)
+
+    assert isinstance(sent[0], main.BufferedInputFile)
+    assert sent[1] == "AgAD-photo"
+    assert main._file_id_stats == {"hits": 1, "misses": 1, "stale": 0}
+
+    # The mapping survives a restart
+    monkeypatch.setattr(main, "_file_ids", None)
+    assert list(main._file_id_cache().values()) == ["AgAD-photo"]
+
+
+@pytest.mark.asyncio
+async def test_rejected_file_id_falls_back_to_upload(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "FILE_ID_CACHE_FILE", str(tmp_path / "bot.json"))
+    monkeypatch.setattr(main, "_file_ids", {})
+    monkeypatch.setattr(main, "_file_id_stats", dict.fromkeys(main._file_id_stats, 0))
+    method = main.SendPhoto(chat_id=1, photo=main._input_file(b"meme", "meme.jpg"))
+    main._file_ids[f"photo:{main._input_file_digest(method.photo)}"] = "expired"
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.photo)
+        if method.photo == "expired":
+            raise main.TelegramBadRequest(method=method, message="wrong file identifier")
+        return FakeSentMessage("fresh")
+
+    await main._reuse_telegram_file_id(make_request, None, method)
+
+    assert sent[0] == "expired"
+    assert isinstance(sent[1], main.BufferedInputFile)
+    assert list(main._file_ids.values()) == ["fresh"]
+    assert main._file_id_stats["stale"] == 1
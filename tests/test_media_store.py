@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import media_store
+
+
+@pytest.fixture(autouse=True)
+def isolated_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+
+
+def test_put_is_content_addressed():
+    first = media_store.put(b"same bytes", ".JPG")
+    second = media_store.put(b"same bytes", "jpg")
+
+    assert first == second
+    assert media_store.is_handle(first)
+    assert first.endswith(".jpg")
+    assert len(os.listdir(media_store.MEDIA_DIR)) == 1
+    assert media_store.read(first) == b"same bytes"
+
+
+def test_put_file_matches_put(tmp_path):
+    src = tmp_path / "clip.ogg"
+    src.write_bytes(b"ogg-bytes")
+
+    handle = media_store.put_file(str(src))
+    src.unlink()
+
+    assert handle == media_store.put(b"ogg-bytes", ".ogg")
+    assert media_store.read(handle) == b"ogg-bytes"
+
+
+def test_find_handle_in_text():
+    handle = media_store.put(b"x", ".png")
+
+    match = media_store.find(f"Look: {handle}.")
+
+    assert match.group(0) == handle
+    assert media_store.find("/tmp/tmp123.png") is None
+
+
+def test_missing_and_malformed_handles():
+    handle = media_store.put(b"x", ".jpg")
+    os.remove(media_store.path(handle))
+
+    assert not media_store.exists(handle)
+    with pytest.raises(FileNotFoundError):
+        media_store.path(handle)
+    with pytest.raises(ValueError):
+        media_store.path("/tmp/tmp123.jpg")
+
+
+def test_collect_garbage_drops_expired_then_oldest():
+    handles = [media_store.put(bytes([i]) * 10, ".jpg") for i in range(4)]
+    for i, handle in enumerate(handles):
+        os.utime(media_store.path(handle), (1000 + i, 1000 + i))
+    os.utime(media_store.path(handles[3]))  # recently used
+
+    removed = media_store.collect_garbage(max_age=3600, max_bytes=100)
+
+    assert removed == 3
+    assert [media_store.exists(h) for h in handles] == [False, False, False, True]
+
+
+def test_collect_garbage_enforces_size_cap():
+    handles = [media_store.put(bytes([i]) * 10, ".jpg") for i in range(3)]
+    for i, handle in enumerate(handles):
+        os.utime(media_store.path(handle), (2_000_000_000 + i, 2_000_000_000 + i))
+
+    removed = media_store.collect_garbage(max_age=10**10, max_bytes=20)
+
+    assert removed == 1
+    assert not media_store.exists(handles[0])
@@ -0,0 +1,137 @@
+
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+import agent_client
+import memory_index
+
+
+@pytest.fixture(autouse=True)
+def memory(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory_index, "MEMORY_DIR", str(tmp_path / "memory"))
+    memory_index.set_embedder(memory_index.HashEmbedder(dim=128))
+    yield
+    memory_index.set_embedder(None)
+    memory_index._pending.clear()
+
+
+HISTORY = [
+    "anna: my cat Barsik hates the vacuum cleaner",
+    "boris: the football match tonight starts at eight",
+    "anna: we are going to Riga for the weekend",
+    "boris: anyone tried the new pizza place downtown?",
+]
+
+
+@pytest.mark.asyncio
+async def test_hash_embedder_is_deterministic():
+    embed = memory_index.HashEmbedder(dim=64)
+
+    first, second = await embed(["hello world"]), await embed(["hello world"])
+
+    assert first.shape == (1, 64)
+    assert np.array_equal(first, second)
+
+
+@pytest.mark.asyncio
+async def test_openai_embedder_records_usage_per_chat(monkeypatch):
+    monkeypatch.setattr(memory_index.usage_ledger, "_totals", {})
+    client = Mock()
+    client.embeddings.create = AsyncMock(return_value=Mock(
+        data=[Mock(embedding=[1.0, 0.0]), Mock(embedding=[0.0, 1.0])],
+        usage=Mock(prompt_tokens=12),
+    ))
+    memory_index.set_embedder(memory_index.OpenAIEmbedder(client, dim=2))
+
+    await memory_index.remember(100, ["one", "two"])
+    await memory_index.recall(100, "one")
+
+    embedding = memory_index.usage_ledger.summary(100)["embedding"]
+    assert embedding["requests"] == 2
+    assert embedding["input_tokens"] == 24
+
+
+@pytest.mark.asyncio
+async def test_recall_returns_relevant_messages():
+    await memory_index.remember(100, HISTORY)
+
+    snippets = await memory_index.recall(100, "how is Barsik the cat doing?", k=1)
+
+    assert snippets == [HISTORY[0]]
+    assert await memory_index.recall(200, "how is Barsik the cat doing?") == []
+
+
+@pytest.mark.asyncio
+async def test_recall_respects_exclude_and_token_budget(monkeypatch):
+    monkeypatch.setattr(memory_index, "MEMORY_MIN_SCORE", -1.0)
+    await memory_index.remember(100, HISTORY)
+
+    snippets = await memory_index.recall(100, "cat", k=4, exclude=[HISTORY[0]], token_budget=25)
+
+    assert HISTORY[0] not in snippets
+    assert 1 <= len(snippets) < 3
+    # Oldest first, as they were said
+    assert snippets == sorted(snippets, key=HISTORY.index)
+
+
+@pytest.mark.asyncio
+async def test_index_is_float16_memmap_and_persists():
+    await memory_index.remember(100, HISTORY)
+    index = memory_index._indexes[100]
+    assert isinstance(index.vectors, np.memmap)
+    assert index.vectors.dtype == np.float16
+
+    memory_index._indexes.clear()
+
+    assert await memory_index.recall(100, "Barsik the cat", k=1) == [HISTORY[0]]
+
+
+@pytest.mark.asyncio
+async def test_index_grows_and_drops_oldest_half(monkeypatch):
+    monkeypatch.setattr(memory_index, "INITIAL_CAPACITY", 4)
+    monkeypatch.setattr(memory_index, "MEMORY_MAX_ITEMS", 10)
+
+    for i in range(12):
+        await memory_index.remember(100, [f"message number {i}"])
+
+    texts = memory_index._indexes[100].texts
+    assert len(texts) <= 10
+    assert texts[-1] == "message number 11"
+    assert "message number 0" not in texts
+
+
+@pytest.mark.asyncio
+async def test_remember_later_batches_per_chat():
+    hash_embed = memory_index.HashEmbedder(dim=32)
+
+    async def embed_texts(texts, chat_id):
+        return await hash_embed(texts)
+
+    embed = AsyncMock(side_effect=embed_texts)
+    memory_index.set_embedder(embed)
+
+    memory_index.remember_later(100, ["one"])
+    memory_index.remember_later(100, ["two", "three"])
+    await memory_index._flush_task
+
+    embed.assert_awaited_once()
+    assert memory_index._indexes[100].texts == ["one", "two", "three"]
+
+
+@pytest.mark.asyncio
+async def test_ask_agent_injects_recalled_memory(monkeypatch):
+    await memory_index.remember(1, HISTORY)
+    agent_client._histories.clear()
+    monkeypatch.setattr(agent_client, "_agent", Mock())
+    monkeypatch.setattr(agent_client, "_system_history", [{"role": "system", "content": "sys"}])
+    run_mock = AsyncMock(return_value=Mock(final_output="Barsik is fine"))
+    monkeypatch.setattr(agent_client.Runner, "run", run_mock)
+
+    await agent_client.ask_agent([{"role": "user", "content": "kate: how is Barsik the cat?"}], 1)
+    await memory_index._flush_task
+
+    api_input = run_mock.await_args.args[1]
+    assert api_input[1]["role"] == "system"
+    assert HISTORY[0] in api_input[1]["content"]
+    assert memory_index._indexes[1].texts[-1] == "Barsik is fine"
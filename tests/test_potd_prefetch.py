@@ -0,0 +1,209 @@
+import sys
+import os
+import json
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:TESTTOKEN')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ.setdefault('ELEVEN_API_KEY', 'sk-test')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, '..'))))
+
+import pytest
+from unittest.mock import AsyncMock
+
+import main
+import mcp_server
+import media_store
+import tool_cache
+
+POTD_URL = "https://commons.wikimedia.org/wiki/Special:FilePath/Sunset.jpg?width=800"
+
+
+class FakeResponse:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return b"jpeg-bytes"
+
+
+class FakeSession:
+    downloads = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, url, ssl=None):
+        FakeSession.downloads += 1
+        return FakeResponse()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_stores_image_and_record(monkeypatch, tmp_path):
+    FakeSession.downloads = 0
+    monkeypatch.setattr(mcp_server, "POTD_DIR", str(tmp_path / "potd"))
+    monkeypatch.setattr(mcp_server.aiohttp, "ClientSession", FakeSession)
+    resolve_mock = AsyncMock(return_value={"url": POTD_URL, "caption": "A sunset"})
+    monkeypatch.setattr(mcp_server, "_resolve_picture_of_the_day", resolve_mock)
+
+    record = await mcp_server.prefetch_picture_of_the_day("2025-06-20")
+    again = await mcp_server.prefetch_picture_of_the_day("2025-06-20")
+
+    assert record["caption"] == "A sunset"
+    assert record["path"].endswith("2025-06-20.jpg")
+    with open(record["path"], "rb") as f:
+        assert f.read() == b"jpeg-bytes"
+    assert again == record
+    resolve_mock.assert_awaited_once()
+    assert FakeSession.downloads == 1
+
+
+@pytest.mark.asyncio
+async def test_tool_returns_media_handle_read_by_bot(monkeypatch, tmp_path):
+    monkeypatch.setattr(mcp_server, "POTD_DIR", str(tmp_path / "potd"))
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+    monkeypatch.setattr(tool_cache, "TOOL_CACHE_DIR", str(tmp_path / "cache"))
+    tool_cache.clear()
+    monkeypatch.setattr(mcp_server.aiohttp, "ClientSession", FakeSession)
+    monkeypatch.setattr(
+        mcp_server, "_resolve_picture_of_the_day",
+        AsyncMock(return_value={"url": POTD_URL, "caption": "A sunset"}),
+    )
+
+    data = json.loads(await mcp_server.get_picture_of_the_day("2025-06-20"))
+
+    assert "path" not in data
+    assert media_store.read(data["image"]) == b"jpeg-bytes"
+
+    class FakeClient:
+        async def __aenter__(self):
+            return None, None
+
+        async def __aexit__(self, *exc):
+            return False
+
+    class FakeMcpSession(FakeClient):
+        def __init__(self, *args):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def initialize(self):
+            pass
+
+        async def call_tool(self, name, args):
+            text = type("T", (), {"text": json.dumps(data)})()
+            return type("R", (), {"content": [text]})()
+
+    download_mock = AsyncMock()
+    main._potd_cache.clear()
+    monkeypatch.setattr(main, "sse_client", lambda url: FakeClient())
+    monkeypatch.setattr(main, "ClientSession", FakeMcpSession)
+    monkeypatch.setattr(main, "download_image_bytes", download_mock)
+
+    assert await main.get_picture_of_the_day("2025-06-20") == (b"jpeg-bytes", "A sunset")
+    download_mock.assert_not_awaited()
+    main._potd_cache.clear()
+    tool_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_day_served_without_local_copy_is_retried(monkeypatch, tmp_path):
+    monkeypatch.setattr(mcp_server, "POTD_DIR", str(tmp_path / "potd"))
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+    monkeypatch.setattr(
+        mcp_server, "_resolve_picture_of_the_day",
+        AsyncMock(return_value={"url": POTD_URL, "caption": "A sunset"}),
+    )
+    prefetch = mcp_server.prefetch_picture_of_the_day
+    monkeypatch.setattr(
+        mcp_server, "prefetch_picture_of_the_day", AsyncMock(side_effect=OSError("disk full"))
+    )
+
+    first = json.loads(await mcp_server.get_picture_of_the_day("2025-06-20"))
+    assert "image" not in first
+
+    monkeypatch.setattr(mcp_server, "prefetch_picture_of_the_day", prefetch)
+    monkeypatch.setattr(mcp_server.aiohttp, "ClientSession", FakeSession)
+    second = json.loads(await mcp_server.get_picture_of_the_day("2025-06-20"))
+    assert media_store.read(second["image"]) == b"jpeg-bytes"
+
+
+def test_prune_keeps_latest_days(monkeypatch, tmp_path):
+    potd_dir = tmp_path / "potd"
+    potd_dir.mkdir()
+    for day in ("2025-06-18", "2025-06-19", "2025-06-20"):
+        (potd_dir / f"{day}.json").write_text("{}")
+        (potd_dir / f"{day}.jpg").write_bytes(b"x")
+    monkeypatch.setattr(mcp_server, "POTD_DIR", str(potd_dir))
+
+    mcp_server._prune_pictures_of_the_day(keep=2)
+
+    assert sorted(os.listdir(potd_dir)) == [
+        "2025-06-19.jpg", "2025-06-19.json", "2025-06-20.jpg", "2025-06-20.json",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bot_serves_potd_from_cache(monkeypatch):
+    main._potd_cache.clear()
+    main._potd_cache["2025-06-20"] = (POTD_URL, b"jpeg-bytes", "A sunset")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("MCP should not be called")
+
+    monkeypatch.setattr(main, "sse_client", fail)
+
+    assert await main.get_picture_of_the_day("2025-06-20") == (b"jpeg-bytes", "A sunset")
+    main._potd_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_json_reply_with_potd_url_uses_prefetched_bytes(monkeypatch):
+    main._potd_cache.clear()
+    main._potd_cache["2025-06-20"] = (POTD_URL, b"jpeg-bytes", "A sunset")
+    download_mock = AsyncMock()
+    monkeypatch.setattr(main, "download_media", download_mock)
+
+    reply = json.dumps({"url": POTD_URL, "caption": "Look"})
+    result = await main._extract_json_image(reply)
+
+    assert result == (b"jpeg-bytes", "Look")
+    download_mock.assert_not_awaited()
+    main._potd_cache.clear()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("date", ["../../x", "2025-06-20/../../x", "tomorrow", "2025-13-01"])
+async def test_bad_date_is_rejected_before_any_work(monkeypatch, tmp_path, date):
+    monkeypatch.setattr(mcp_server, "POTD_DIR", str(tmp_path / "potd"))
+    prefetch_mock = AsyncMock()
+    resolve_mock = AsyncMock()
+    monkeypatch.setattr(mcp_server, "prefetch_picture_of_the_day", prefetch_mock)
+    monkeypatch.setattr(mcp_server, "_resolve_picture_of_the_day", resolve_mock)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("MCP should not be called")
+
+    monkeypatch.setattr(main, "sse_client", fail)
+
+    with pytest.raises(ValueError):
+        await mcp_server.get_picture_of_the_day(date)
+    with pytest.raises(ValueError):
+        await main.get_picture_of_the_day(date)
+    prefetch_mock.assert_not_awaited()
+    resolve_mock.assert_not_awaited()
+    assert not os.path.exists(tmp_path / "potd")
@@ -0,0 +1,68 @@
+import pytest
+from unittest.mock import AsyncMock
+
+import mcp_server
+
+
+@pytest.fixture(autouse=True)
+def isolated_corpus(monkeypatch, tmp_path):
+    monkeypatch.setattr(mcp_server, "PROVERB_CORPUS", str(tmp_path / "proverbs.txt"))
+    monkeypatch.setattr(mcp_server, "DECK_DIR", str(tmp_path / "decks"))
+    mcp_server._decks.clear()
+    mcp_server._block_indexes.clear()
+
+
+def test_write_corpus_deduplicates_and_flattens():
+    assert mcp_server._write_proverb_corpus(["Труд: Без труда\nне выловишь", "Труд: Без труда не выловишь"]) == 1
+    assert mcp_server._write_proverb_corpus(["Труд: Без труда не выловишь", "Дружба: Старый друг"]) == 1
+
+    with open(mcp_server.PROVERB_CORPUS, encoding="utf-8") as f:
+        assert f.read().splitlines() == ["Труд: Без труда не выловишь", "Дружба: Старый друг"]
+
+
+@pytest.mark.asyncio
+async def test_proverb_served_from_corpus_without_network(monkeypatch):
+    proverbs = [f"Page {i}: proverb {i}" for i in range(4)]
+    mcp_server._write_proverb_corpus(proverbs)
+    scrape_mock = AsyncMock(side_effect=AssertionError("network used"))
+    monkeypatch.setattr(mcp_server, "_scrape_proverbs", scrape_mock)
+
+    results = [await mcp_server.get_random_proverb() for _ in range(4)]
+
+    assert sorted(results) == proverbs
+    scrape_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_corpus_growth_keeps_drawn_proverbs_out_of_the_round():
+    old = [f"Page {i}: proverb {i}" for i in range(4)]
+    new = [f"Page {i}: proverb {i}" for i in range(4, 7)]
+    mcp_server._write_proverb_corpus(old)
+    drawn = [await mcp_server.get_random_proverb() for _ in range(2)]
+
+    mcp_server._write_proverb_corpus(new)
+    drawn.append(await mcp_server.get_random_proverb())
+    mcp_server._decks.clear()  # the grown deck survives a restart
+    drawn += [await mcp_server.get_random_proverb() for _ in range(4)]
+
+    assert sorted(drawn) == sorted(old + new)
+
+
+@pytest.mark.asyncio
+async def test_missing_corpus_is_seeded_by_a_crawl(monkeypatch):
+    scrape_mock = AsyncMock(return_value=["Page: only one"])
+    monkeypatch.setattr(mcp_server, "_scrape_proverbs", scrape_mock)
+
+    assert await mcp_server.get_random_proverb() == "Page: only one"
+    scrape_mock.assert_awaited_once()
+
+
+def test_build_proverbs_cli_imports_file(monkeypatch, tmp_path):
+    source = tmp_path / "import.txt"
+    source.write_text("A: one\nB: two\n\n", encoding="utf-8")
+    monkeypatch.setattr(mcp_server, "_scrape_proverbs", AsyncMock(return_value=["C: three"]))
+
+    mcp_server._build_proverbs_cli(["1", "--import", str(source)])
+
+    with open(mcp_server.PROVERB_CORPUS, encoding="utf-8") as f:
+        assert f.read().splitlines() == ["A: one", "B: two", "C: three"]
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from reservoir import Reservoir
+
+
+def _producer(batches):
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        if not batches:
+            return []
+        batch = batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    return produce, calls
+
+
+@pytest.mark.asyncio
+async def test_take_serves_from_pool_without_producing():
+    produce, calls = _producer([["a", "b", "c", "d"]])
+    pool = Reservoir("facts", produce, capacity=4, low_watermark=0)
+    await pool.refill()
+    assert len(calls) == 1
+
+    taken = {await pool.take() for _ in range(3)}
+
+    assert taken <= {"a", "b", "c", "d"}
+    assert len(taken) == 3
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_take_below_low_watermark_refills_in_background():
+    produce, calls = _producer([["a", "b", "c"], ["d", "e"]])
+    pool = Reservoir("facts", produce, capacity=3, low_watermark=2)
+    await pool.refill()
+
+    await pool.take()
+    await asyncio.sleep(0)
+    await pool._task
+
+    assert len(calls) == 2
+    assert len(pool) == 3
+
+
+@pytest.mark.asyncio
+async def test_duplicates_are_dropped_and_discarded():
+    discarded = []
+    produce, _ = _producer([["same", "same", "other"]])
+    pool = Reservoir("facts", produce, capacity=5, discard=discarded.append)
+
+    await pool.refill()
+
+    assert len(pool) == 2
+    assert discarded == ["same"]
+    assert pool.stats()["duplicates"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_is_bounded():
+    discarded = []
+    produce, _ = _producer([["a", "b", "c", "d"]])
+    pool = Reservoir("memes", produce, capacity=2, discard=discarded.append)
+
+    await pool.refill()
+
+    assert len(pool) == 2
+    assert len(discarded) == 2
+
+
+@pytest.mark.asyncio
+async def test_empty_pool_waits_for_first_item():
+    produce, _ = _producer([["fresh"]])
+    pool = Reservoir("facts", produce, capacity=1)
+
+    assert await pool.take() == "fresh"
+    assert pool.stats()["waited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_take_raises_when_upstream_fails():
+    produce, calls = _producer([ValueError("down"), ValueError("down"), ValueError("down")])
+    pool = Reservoir("facts", produce, capacity=2, max_failures=3)
+
+    with pytest.raises(LookupError):
+        await pool.take()
+    assert len(calls) == 3
@@ -7,12 +7,20 @@ os.environ.setdefault('ELEVEN_API_KEY', 'sk-test')
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.join(__file__, '..'))))
 
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock
 import json
 import base64
 
 import main
+import media_store
+
+
+@pytest.fixture(autouse=True)
+def isolated_media(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
 
 
 class FakeTarget:
@@ -51,6 +59,7 @@ async def test_send_nudge_with_image(monkeypatch):
     monkeypatch.setattr(main.random, 'random', lambda: 0)
 
     await main.send_nudge_with_image(target, 1, 'hello', caption='cap', is_message=True)
+    await main.drain_image_jobs()
 
     assert len(target.answer_calls) == 1
     assert len(target.answer_photo_calls) == 1
@@ -63,12 +72,79 @@ async def test_send_nudge_with_image(monkeypatch):
     target.send_photo_calls.clear()
 
     await main.send_nudge_with_image(target, 1, 'hello', caption='cap', is_message=False)
+    await main.drain_image_jobs()
 
     assert len(target.send_message_calls) == 1
     assert len(target.send_photo_calls) == 1
     assert target.answer_photo_calls == []
 
 
+@pytest.mark.asyncio
+async def test_nudge_text_does_not_wait_for_image(monkeypatch):
+    target = FakeTarget()
+    release = asyncio.Event()
+
+    async def slow_generate(observation, size="1024x1024", quality=None):
+        await release.wait()
+        return b"png"
+
+    monkeypatch.setattr(main, "generate_image_from_observation", slow_generate)
+    monkeypatch.setattr(main.random, "random", lambda: 0)
+
+    await main.send_nudge_with_image(target, 1, "hello", is_message=True)
+
+    assert len(target.answer_calls) == 1
+    assert target.answer_photo_calls == []
+    release.set()
+    await main.drain_image_jobs()
+    assert len(target.answer_photo_calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_nudge_image_skipped_over_soft_budget(monkeypatch):
+    target = FakeTarget()
+    gen_mock = AsyncMock(return_value=b'dummy')
+    monkeypatch.setattr(main, 'generate_image_from_observation', gen_mock)
+    monkeypatch.setattr(main.random, 'random', lambda: 0)
+    monkeypatch.setattr(main.usage_ledger, 'budget_state', lambda chat_id: 'soft')
+
+    await main.send_nudge_with_image(target, 1, 'hello', is_message=True)
+    await main.drain_image_jobs()
+
+    assert len(target.answer_calls) == 1
+    gen_mock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_image_jobs_limited_per_chat_and_hour(monkeypatch):
+    target = FakeTarget()
+    tiers = []
+
+    async def fake_generate(observation, size="1024x1024", quality=None):
+        tiers.append((size, quality))
+        return b"png"
+
+    monkeypatch.setattr(main, "generate_image_from_observation", fake_generate)
+    monkeypatch.setattr(main, "IMAGE_JOBS_PER_HOUR", 3)
+    monkeypatch.setattr(main, "IMAGE_JOB_WORKERS", 1)
+    monkeypatch.setattr(main, "_image_job_starts", main.deque())
+    monkeypatch.setattr(main, "_image_workers", [])
+
+    assert main.enqueue_image_job(target, 1, "a")
+    assert not main.enqueue_image_job(target, 1, "b")  # chat already waits
+    assert main.enqueue_image_job(target, 2, "c")
+    assert main.enqueue_image_job(target, 3, "d")
+    assert not main.enqueue_image_job(target, 4, "e")  # hourly cap
+    await main.drain_image_jobs()
+
+    assert len(target.answer_photo_calls) == 3
+    # The first job starts with others waiting behind it, the last one alone
+    assert tiers[0] == main.IMAGE_GEN_BUSY_TIER
+    assert tiers[-1] == main.IMAGE_GEN_TIER
+    for worker in main._image_workers:
+        worker.cancel()
+
+
 @pytest.mark.asyncio
 async def test_send_nudge_with_image_json(monkeypatch):
     target = FakeTarget()
@@ -77,6 +153,7 @@ async def test_send_nudge_with_image_json(monkeypatch):
     reply = json.dumps({"image": encoded, "caption": "hi"})
     style_mock = AsyncMock(return_value="styled")
     monkeypatch.setattr(main, "style_caption", style_mock)
+    monkeypatch.setattr(main, "CAPTION_STYLE_MODE", "wait")
     gen_mock = AsyncMock()
     monkeypatch.setattr(main, "generate_image_from_observation", gen_mock)
 
@@ -111,8 +188,7 @@ async def test_send_nudge_with_image_json_no_caption(monkeypatch):
 @pytest.mark.asyncio
 async def test_send_nudge_with_image_meme_command(monkeypatch, tmp_path):
     target = FakeTarget()
-    meme_path = tmp_path / "meme.jpg"
-    meme_mock = AsyncMock(return_value=str(meme_path))
+    meme_mock = AsyncMock(return_value=media_store.put(b"x", ".jpg"))
     monkeypatch.setattr(main, "retrieve_joke", meme_mock)
 
     await main.send_nudge_with_image(target, 1, json.dumps({"command": "/meme"}), is_message=True)
@@ -142,13 +218,12 @@ async def test_send_nudge_with_image_fact_command(monkeypatch):
 @pytest.mark.asyncio
 async def test_send_nudge_with_image_plain_url(monkeypatch, tmp_path):
     target = FakeTarget()
-    file_path = tmp_path / "img.jpg"
-    file_path.write_text("x")
+    handle = media_store.put(b"x", ".jpg")
     async def fake_download(url: str) -> str:
         assert url == "http://example.com/img.jpg"
-        return str(file_path)
+        return handle
 
-    monkeypatch.setattr(main, "download_image_to_tmp", fake_download)
+    monkeypatch.setattr(main, "download_media", fake_download)
     gen_mock = AsyncMock()
     monkeypatch.setattr(main, "generate_image_from_observation", gen_mock)
 
@@ -171,14 +246,50 @@ async def test_send_nudge_with_image_plain_url(monkeypatch, tmp_path):
 @pytest.mark.skip(reason="voice functionality currently disabled")
 async def test_send_nudge_with_voice(monkeypatch, tmp_path):
     target = FakeTarget()
-    file_path = tmp_path / "v.ogg"
-    file_path.write_text("x")
+    handle = media_store.put(b"x", ".ogg")
 
-    await main.send_nudge_with_image(target, 1, f"Take this {file_path}", is_message=True)
+    await main.send_nudge_with_image(target, 1, f"Take this {handle}", is_message=True)
 
     assert len(target.answer_voice_calls) == 1
     args, _ = target.answer_voice_calls[0]
     assert isinstance(args[0], main.FSInputFile)
-    assert args[0].path == str(file_path)
+    assert args[0].path == media_store.path(handle)
     assert len(target.answer_calls) == 1
     assert target.answer_calls[0][0] == ("Take this",)
+
+
+class FakeSentMessage:
+    def __init__(self):
+        self.chat = type("Chat", (), {"id": 1})()
+        self.edits = []
+
+    async def edit_caption(self, caption):
+        self.edits.append(caption)
+
+
+@pytest.mark.asyncio
+async def test_photo_sent_first_and_caption_edited(monkeypatch):
+    target = FakeTarget()
+    sent = FakeSentMessage()
+    release = asyncio.Event()
+
+    async def answer_photo(*args, **kwargs):
+        target.answer_photo_calls.append((args, kwargs))
+        return sent
+
+    async def slow_style(caption, chat_id=None):
+        await release.wait()
+        return "styled"
+
+    target.answer_photo = answer_photo
+    monkeypatch.setattr(main, "style_caption", slow_style)
+    monkeypatch.setattr(main, "CAPTION_STYLE_MODE", "edit")
+    reply = json.dumps({"image": base64.b64encode(b"img").decode(), "caption": "hi"})
+
+    await main.send_nudge_with_image(target, 1, reply, is_message=True)
+
+    assert target.answer_photo_calls[0][1]["caption"] == "hi"
+    assert sent.edits == []
+    release.set()
+    await asyncio.gather(*main._background_tasks)
+    assert sent.edits == ["styled"]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import mcp_server
+
+
+@pytest.fixture(autouse=True)
+def isolated_decks(monkeypatch, tmp_path):
+    monkeypatch.setattr(mcp_server, "DECK_DIR", str(tmp_path / "decks"))
+    mcp_server._decks.clear()
+    mcp_server._block_indexes.clear()
+
+
+def _write_stories(path, count):
+    blocks = [f"Topic {i}\nline one\nline two" for i in range(count)]
+    path.write_text("\n---\n".join(blocks) + "\n---\n", encoding="utf-8")
+
+
+def test_story_deck_has_no_repeats_until_exhausted(tmp_path):
+    stories = tmp_path / "stories.txt"
+    _write_stories(stories, 5)
+
+    results = [mcp_server.get_random_story(str(stories)) for _ in range(5)]
+
+    assert sorted(results) == [f"Topic {i}: line one line two" for i in range(5)]
+    # A sixth call starts a new round instead of failing
+    assert mcp_server.get_random_story(str(stories)) in results
+
+
+def test_story_deck_survives_restart(tmp_path):
+    stories = tmp_path / "stories.txt"
+    _write_stories(stories, 4)
+
+    first = [mcp_server.get_random_story(str(stories)) for _ in range(2)]
+    # Simulate a restart: in-memory state is gone, the deck file remains
+    mcp_server._decks.clear()
+    mcp_server._block_indexes.clear()
+    rest = [mcp_server.get_random_story(str(stories)) for _ in range(2)]
+
+    assert len(set(first + rest)) == 4
+
+
+def test_story_index_rebuilt_when_file_changes(tmp_path):
+    stories = tmp_path / "stories.txt"
+    _write_stories(stories, 2)
+    mcp_server.get_random_story(str(stories))
+
+    _write_stories(stories, 3)
+    st = os.stat(stories)
+    os.utime(stories, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    results = {mcp_server.get_random_story(str(stories)) for _ in range(3)}
+
+    assert "Topic 2: line one line two" in results
+    assert len(results) == 3
+
+
+def test_story_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        mcp_server.get_random_story(str(tmp_path / "missing.txt"))
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+import tool_cache
+from tool_cache import cached_tool
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(tool_cache, "TOOL_CACHE_DIR", str(tmp_path / "cache"))
+    tool_cache.clear()
+    yield
+    tool_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_cached_tool_hits_after_first_call():
+    calls = []
+
+    @cached_tool(60, key=lambda date: date)
+    async def extract(date: str) -> str:
+        calls.append(date)
+        return f"text for {date}"
+
+    assert await extract("17 июня") == "text for 17 июня"
+    assert await extract(date="17 июня") == "text for 17 июня"
+    assert calls == ["17 июня"]
+    assert tool_cache.stats()["extract"]["hits"] == 1
+    assert tool_cache.stats()["extract"]["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_tool_coalesces_concurrent_calls():
+    calls = 0
+    release = asyncio.Event()
+
+    @cached_tool(60)
+    async def potd(date: str = "") -> str:
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "{}"
+
+    tasks = [asyncio.create_task(potd("2025-06-20")) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert results == ["{}"] * 5
+    assert calls == 1
+    assert tool_cache.stats()["potd"]["coalesced"] == 4
+
+
+@pytest.mark.asyncio
+async def test_cached_tool_does_not_cache_errors():
+    calls = 0
+
+    @cached_tool(60)
+    async def flaky() -> str:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ValueError("boom")
+        return "ok"
+
+    with pytest.raises(ValueError):
+        await flaky()
+    assert await flaky() == "ok"
+    assert tool_cache.stats()["flaky"]["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_tool_disk_tier_survives_memory_clear():
+    calls = 0
+
+    @cached_tool(60, disk=True)
+    async def extract(date: str) -> str:
+        nonlocal calls
+        calls += 1
+        return "persisted"
+
+    await extract("18 июня")
+    tool_cache._memory.clear()
+    assert await extract("18 июня") == "persisted"
+    assert calls == 1
+    assert tool_cache.stats()["extract"]["disk_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_disk_hit_keeps_original_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tool_cache.time, "time", lambda: now[0])
+    calls = 0
+
+    @cached_tool(60, disk=True)
+    async def extract(date: str) -> str:
+        nonlocal calls
+        calls += 1
+        return "persisted"
+
+    await extract("18 июня")
+    tool_cache._memory.clear()
+    now[0] += 50
+    await extract("18 июня")  # promoted from disk with 10 seconds left
+    now[0] += 20
+    await extract("18 июня")
+
+    assert calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_tool_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tool_cache.time, "time", lambda: now[0])
+    calls = 0
+
+    @cached_tool(10)
+    async def weather(location: str) -> str:
+        nonlocal calls
+        calls += 1
+        return str(calls)
+
+    assert await weather("Riga") == "1"
+    now[0] += 11
+    assert await weather("Riga") == "2"
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = tool_cache.LRUCache(2)
+    cache.set("a", 1, 60)
+    cache.set("b", 2, 60)
+    cache.get("a")
+    cache.set("c", 3, 60)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from unittest.mock import AsyncMock, Mock
+from agents.usage import Usage
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+
+import agent_client
+import usage_ledger
+
+
+@pytest.fixture(autouse=True)
+def ledger(monkeypatch, tmp_path):
+    monkeypatch.setattr(usage_ledger, "USAGE_DIR", str(tmp_path / "usage"))
+    monkeypatch.setattr(usage_ledger, "PERSONA", "test_bot")
+    monkeypatch.setattr(usage_ledger, "_totals", {})
+    monkeypatch.setattr(usage_ledger, "_dirty", False)
+
+
+def _usage(input_tokens, cached, output):
+    return Usage(
+        requests=1,
+        input_tokens=input_tokens,
+        input_tokens_details=InputTokensDetails(cached_tokens=cached),
+        output_tokens=output,
+        output_tokens_details=OutputTokensDetails(reasoning_tokens=0),
+        total_tokens=input_tokens + output,
+    )
+
+
+def test_records_tokens_images_and_tts_per_class():
+    usage_ledger.record_usage(100, "reply", "gpt-4.1-mini", _usage(1_000_000, 500_000, 100_000))
+    usage_ledger.record(100, "nudge_image", images=1, image_quality="low")
+    usage_ledger.record(100, "voice", tts_chars=2000)
+    usage_ledger.record(200, "reply", requests=1)
+
+    summary = usage_ledger.summary(100)
+
+    assert summary["reply"]["input_tokens"] == 1_000_000
+    assert summary["reply"]["cached_tokens"] == 500_000
+    # 0.5M uncached at 0.40 + 0.5M cached at 0.10 + 0.1M output at 1.60
+    assert summary["reply"]["cost_usd"] == pytest.approx(0.2 + 0.05 + 0.16)
+    assert summary["nudge_image"]["images"] == 1
+    assert summary["voice"]["tts_chars"] == 2000
+    assert usage_ledger.spent_today(100) == pytest.approx(0.41 + 0.011 + 0.6)
+    assert set(usage_ledger.summary()) == {"reply", "nudge_image", "voice"}
+
+
+def test_budget_states(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "USAGE_SOFT_BUDGET_USD", 0.5)
+    monkeypatch.setattr(usage_ledger, "USAGE_HARD_BUDGET_USD", 1.0)
+
+    assert usage_ledger.budget_state(100) == "ok"
+    usage_ledger.record(100, "voice", tts_chars=2000)  # $0.60
+    assert usage_ledger.budget_state(100) == "soft"
+    usage_ledger.record(100, "voice", tts_chars=2000)
+    assert usage_ledger.budget_state(100) == "hard"
+    assert usage_ledger.budget_state(200) == "ok"
+
+
+def test_flush_and_load_round_trip(tmp_path):
+    usage_ledger.record(100, "reply", requests=2, input_tokens=30, output_tokens=5)
+    usage_ledger.flush()
+
+    path = tmp_path / "usage" / "test_bot" / f"{usage_ledger._today()}.json"
+    entries = json.loads(path.read_text())
+    assert entries[0]["chat"] == "100" and entries[0]["class"] == "reply"
+
+    usage_ledger._totals.clear()
+    usage_ledger.load()
+    assert usage_ledger.summary(100)["reply"]["requests"] == 2
+
+
+@pytest.mark.asyncio
+async def test_ask_agent_records_usage_and_downgrades_over_budget(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "USAGE_SOFT_BUDGET_USD", 0.01)
+    monkeypatch.setattr(agent_client, "_agent", Mock())
+    monkeypatch.setattr(agent_client, "_system_history", [])
+    result = Mock(final_output="hi", new_items=[])
+    result.context_wrapper.usage = _usage(1000, 0, 100)
+    run_mock = AsyncMock(return_value=result)
+    monkeypatch.setattr(agent_client.Runner, "run", run_mock)
+    agent_client._histories.clear()
+
+    await agent_client.ask_agent([{"role": "user", "content": "a"}], 7, request_class="chime_in")
+    assert run_mock.await_args.kwargs["run_config"] is None
+    assert usage_ledger.summary(7)["chime_in"]["input_tokens"] == 1000
+
+    usage_ledger.record(7, "voice", tts_chars=100)  # over the soft budget
+    await agent_client.ask_agent([{"role": "user", "content": "b"}], 7)
+    assert run_mock.await_args.kwargs["run_config"].model == usage_ledger.USAGE_DOWNGRADE_MODEL
+    agent_client._histories.clear()
+
+
+def test_record_run_counts_only_synthesized_voice():
+    def voice_call(call_id, text, synthesized):
+        call = Mock(type="tool_call_item")
+        call.raw_item = Mock(call_id=call_id, arguments=json.dumps({"text": text}))
+        call.raw_item.name = "generate_voice"
+        output = Mock(type="tool_call_output_item", raw_item={"call_id": call_id})
+        output.output = json.dumps({"type": "text", "text": "media:x.ogg", "meta": {"synthesized": synthesized}})
+        return [call, output]
+
+    result = Mock(new_items=voice_call("a", "fresh", True) + voice_call("b", "from cache", False))
+    result.context_wrapper.usage = None
+
+    agent_client._record_run(7, "reply", "gpt-5.1", result)
+
+    assert usage_ledger.summary(7)["reply"]["tts_chars"] == len("fresh")
@@ -0,0 +1,137 @@
+import asyncio
+import os
+
+import pytest
+
+import mcp_server
+import media_store
+import tool_cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_voice_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("ELEVEN_API_KEY", "sk-test")
+    monkeypatch.setattr(mcp_server, "VOICE_CACHE_DIR", str(tmp_path / "voice"))
+    monkeypatch.setattr(mcp_server, "FFMPEG_BIN", "ffmpeg-not-installed")
+    monkeypatch.setattr(media_store, "MEDIA_DIR", str(tmp_path / "media"))
+    tool_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_repeated_phrase_is_synthesized_once(monkeypatch):
+    calls = []
+
+    async def fake_synthesize(text, voice_id, api_key):
+        calls.append(text)
+        return b"mp3-bytes"
+
+    monkeypatch.setattr(mcp_server, "_synthesize_voice", fake_synthesize)
+
+    first = await mcp_server.generate_voice("Привет!")
+    second = await mcp_server.generate_voice(" Привет! ")
+
+    assert calls == ["Привет!"]
+    assert first.text == second.text
+    assert first.text.endswith(".mp3")
+    assert media_store.read(first.text) == b"mp3-bytes"
+    # Only the first call was billed by ElevenLabs
+    assert first.meta == {"synthesized": True}
+    assert second.meta == {"synthesized": False}
+    assert tool_cache.stats()["generate_voice"] == {
+        "hits": 1, "disk_hits": 0, "misses": 1, "coalesced": 0, "errors": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_are_coalesced(monkeypatch):
+    calls = 0
+    release = asyncio.Event()
+
+    async def fake_synthesize(text, voice_id, api_key):
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return b"mp3-bytes"
+
+    monkeypatch.setattr(mcp_server, "_synthesize_voice", fake_synthesize)
+
+    tasks = [asyncio.create_task(mcp_server.generate_voice("Ура")) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    handles = await asyncio.gather(*tasks)
+
+    assert calls == 1
+    assert len({h.text for h in handles}) == 1
+    assert [h.meta["synthesized"] for h in handles].count(True) == 1
+    assert tool_cache.stats()["generate_voice"]["coalesced"] == 2
+
+
+def test_voice_cache_key_covers_voice_and_settings(monkeypatch):
+    base = mcp_server._voice_cache_key("Привет", "voice-a")
+
+    assert mcp_server._voice_cache_key("Привет", "voice-b") != base
+    monkeypatch.setitem(mcp_server.ELEVEN_VOICE_SETTINGS, "speed", 1.0)
+    assert mcp_server._voice_cache_key("Привет", "voice-a") != base
+
+
+def test_evict_voice_cache_drops_least_recently_used(monkeypatch, tmp_path):
+    cache_dir = tmp_path / "voice"
+    cache_dir.mkdir()
+    for i, name in enumerate(("old", "mid", "new")):
+        path = cache_dir / f"{name}.mp3"
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (1000 + i, 1000 + i))
+    monkeypatch.setattr(mcp_server, "VOICE_CACHE_DIR", str(cache_dir))
+
+    mcp_server._evict_voice_cache(max_bytes=20)
+
+    assert sorted(os.listdir(cache_dir)) == ["mid.mp3", "new.mp3"]
+
+
+class FakeProcess:
+    def __init__(self, returncode, out):
+        self.returncode = returncode
+        self.out = out
+
+    async def communicate(self, data):
+        return self.out, b"" if self.returncode == 0 else b"bad input"
+
+
+@pytest.mark.asyncio
+async def test_voice_is_encoded_to_opus(monkeypatch):
+    async def fake_synthesize(text, voice_id, api_key):
+        return b"m" * 100
+
+    async def fake_exec(*args, **kwargs):
+        assert "libopus" in args
+        return FakeProcess(0, b"o" * 30)
+
+    monkeypatch.setattr(mcp_server, "_synthesize_voice", fake_synthesize)
+    monkeypatch.setattr("shutil.which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(mcp_server.asyncio, "create_subprocess_exec", fake_exec)
+    monkeypatch.setattr(mcp_server, "_voice_encode_stats", dict.fromkeys(mcp_server._voice_encode_stats, 0))
+
+    handle = (await mcp_server.generate_voice("Привет")).text
+
+    assert handle.endswith(".ogg")
+    assert media_store.read(handle) == b"o" * 30
+    assert mcp_server._voice_encode_stats["bytes_in"] == 100
+    assert mcp_server._voice_encode_stats["bytes_out"] == 30
+
+
+@pytest.mark.asyncio
+async def test_failed_encoding_falls_back_to_mp3(monkeypatch, tmp_path):
+    async def fake_synthesize(text, voice_id, api_key):
+        return b"mp3-bytes"
+
+    async def fake_exec(*args, **kwargs):
+        return FakeProcess(1, b"")
+
+    monkeypatch.setattr(mcp_server, "_synthesize_voice", fake_synthesize)
+    monkeypatch.setattr("shutil.which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(mcp_server.asyncio, "create_subprocess_exec", fake_exec)
+
+    handle = (await mcp_server.generate_voice("Привет")).text
+
+    assert handle.endswith(".mp3")
+    assert media_store.read(handle) == b"mp3-bytes"
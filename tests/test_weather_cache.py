@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import mcp_server
+import tool_cache
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self.payload
+
+    async def text(self):
+        return json.dumps(self.payload)
+
+
+class FakeSession:
+    requests = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, url, ssl=None):
+        FakeSession.requests.append(url)
+        if "geocoding-api" in url:
+            return FakeResponse({"results": [{"latitude": 56.946, "longitude": 24.10589}]})
+        return FakeResponse({"current": {"temperature_2m": 12.5}})
+
+
+@pytest.fixture(autouse=True)
+def isolated_weather(monkeypatch, tmp_path):
+    FakeSession.requests = []
+    monkeypatch.setattr(mcp_server.aiohttp, "ClientSession", FakeSession)
+    monkeypatch.setattr(mcp_server, "GEOCODE_CACHE_FILE", str(tmp_path / "geocode.json"))
+    monkeypatch.setattr(mcp_server, "_geocodes", None)
+    monkeypatch.setattr(mcp_server, "_weather_cache", tool_cache.LRUCache(16))
+    mcp_server._weather_hotness.clear()
+    tool_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_weather_second_call_makes_no_requests():
+    first = await mcp_server.get_current_weather("Riga")
+    second = await mcp_server.get_current_weather("Riga, Latvia")
+
+    assert json.loads(first)["current"]["temperature_2m"] == 12.5
+    assert second == first
+    assert len(FakeSession.requests) == 2
+    assert "latitude=56.95&longitude=24.11" in FakeSession.requests[1]
+
+
+@pytest.mark.asyncio
+async def test_geocode_cache_persists_by_transliterated_name(tmp_path):
+    await mcp_server.get_current_weather("Рига")
+
+    with open(mcp_server.GEOCODE_CACHE_FILE, encoding="utf-8") as f:
+        assert json.load(f) == {"riga": [56.95, 24.11]}
+
+    # Simulate a restart: memory caches are gone, the geocode file remains
+    mcp_server._geocodes = None
+    mcp_server._weather_cache.clear()
+    FakeSession.requests = []
+    await mcp_server.get_current_weather("Riga")
+
+    assert len(FakeSession.requests) == 1
+    assert "api.open-meteo.com/v1/forecast" in FakeSession.requests[0]
+
+
+@pytest.mark.asyncio
+async def test_weather_tracks_hot_locations():
+    await mcp_server.get_current_weather("Riga")
+    await mcp_server.get_current_weather("Riga")
+
+    assert mcp_server._weather_hotness.most_common(1) == [("56.95,24.11", 2)]
+
+
+@pytest.mark.asyncio
+async def test_refresh_continues_past_a_failing_location(monkeypatch):
+    mcp_server._weather_hotness.update({"1.0,1.0": 3, "2.0,2.0": 2, "3.0,3.0": 1})
+    fetched = []
+
+    async def fetch(session, lat, lon):
+        if lat == 1.0:
+            raise RuntimeError("upstream down")
+        fetched.append(lat)
+
+    sleeps = 0
+
+    async def sleep(_seconds):
+        nonlocal sleeps
+        sleeps += 1
+        if sleeps > 1:
+            raise mcp_server.asyncio.CancelledError
+
+    monkeypatch.setattr(mcp_server, "_fetch_forecast", fetch)
+    monkeypatch.setattr(mcp_server.asyncio, "sleep", sleep)
+    with pytest.raises(mcp_server.asyncio.CancelledError):
+        await mcp_server.refresh_hot_weather()
+
+    assert fetched == [2.0, 3.0]
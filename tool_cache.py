@@ -0,0 +1,202 @@
+"""Result caching and request coalescing for MCP tools.
+
+Decorate a tool with :func:`cached_tool` to keep its results in a shared
+in-memory LRU and, optionally, in JSON files under TOOL_CACHE_DIR so a
+restarted server does not refetch. Concurrent calls that resolve to the same
+key share one upstream request.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+TOOL_CACHE_DIR = os.getenv("TOOL_CACHE_DIR", "/tmp/telebot_tool_cache")
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "512"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded ``key -> value`` mapping with per-entry expiry."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value or ``default`` if absent or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class Singleflight:
+    """Run at most one coroutine per key; concurrent callers share its result."""
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """Await ``fn()`` for ``key`` and return ``(result, shared)``.
+
+        ``shared`` is True when the call joined a request that was already in
+        flight. The upstream task is shielded so a cancelled caller does not
+        abort it for the others.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
+
+
+_memory = LRUCache(TOOL_CACHE_MAX_ENTRIES)
+_flights = Singleflight()
+_stats: dict[str, dict[str, int]] = {}
+
+
+def _disk_path(cache_key: str) -> str:
+    digest = hashlib.sha256(cache_key.encode()).hexdigest()
+    return os.path.join(TOOL_CACHE_DIR, f"{digest}.json")
+
+
+def _disk_get(cache_key: str) -> Any:
+    """Return ``(value, expires)`` of a live disk entry, or ``_MISSING``."""
+    try:
+        with open(_disk_path(cache_key), "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return _MISSING
+    if record.get("key") != cache_key or record.get("expires", 0) <= time.time():
+        return _MISSING
+    if "value" not in record:
+        return _MISSING
+    return record["value"], record["expires"]
+
+
+def _disk_set(cache_key: str, value: Any, ttl: float) -> None:
+    """Write ``value`` atomically so readers never see a partial file."""
+    os.makedirs(TOOL_CACHE_DIR, exist_ok=True)
+    path = _disk_path(cache_key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    record = {"key": cache_key, "expires": time.time() + ttl, "value": value}
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError) as e:
+        print(f"[tool_cache] Failed to persist {cache_key}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def record_stat(tool: str, field: str) -> None:
+    """Increment the ``field`` counter for ``tool`` in :func:`stats`."""
+    counters = _stats.setdefault(
+        tool, {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+    )
+    counters[field] = counters.get(field, 0) + 1
+
+
+def cached_tool(
+    ttl: float,
+    key: Callable[..., str] | None = None,
+    *,
+    disk: bool = False,
+):
+    """Cache an async tool's result for ``ttl`` seconds.
+
+    ``key`` receives the tool's bound arguments as keyword arguments and
+    returns the cache key; by default all arguments are used. With ``disk``
+    the result is also persisted under TOOL_CACHE_DIR. Exceptions are never
+    cached. Place the decorator below ``@mcp.tool()`` so FastMCP still sees
+    the original signature and docstring.
+    """
+
+    def decorator(fn):
+        name = fn.__name__
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if key is not None:
+                suffix = key(**bound.arguments)
+            else:
+                suffix = json.dumps(bound.arguments, sort_keys=True, ensure_ascii=False)
+            cache_key = f"{name}:{suffix}"
+
+            value = _memory.get(cache_key, _MISSING)
+            if value is not _MISSING:
+                record_stat(name, "hits")
+                return value
+            if disk:
+                entry = _disk_get(cache_key)
+                if entry is not _MISSING:
+                    value, expires = entry
+                    record_stat(name, "disk_hits")
+                    # Keep the disk entry's expiry rather than starting a new TTL
+                    _memory.set(cache_key, value, expires - time.time())
+                    return value
+
+            async def fetch():
+                result = await fn(*args, **kwargs)
+                _memory.set(cache_key, result, ttl)
+                if disk:
+                    _disk_set(cache_key, result, ttl)
+                return result
+
+            try:
+                result, shared = await _flights.do(cache_key, fetch)
+            except Exception:
+                record_stat(name, "errors")
+                raise
+            record_stat(name, "coalesced" if shared else "misses")
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict[str, dict[str, int]]:
+    """Return per-tool counters of hits, disk hits, misses and coalesced calls."""
+    return {tool: dict(counters) for tool, counters in _stats.items()}
+
+
+def clear() -> None:
+    """Drop in-memory entries and counters (disk entries expire on their own)."""
+    _memory.clear()
+    _stats.clear()
@@ -0,0 +1,189 @@
+"""Per-chat usage and cost ledger with daily budgets.
+
+Every model call, generated image, vision upload and voice clip is recorded
+under ``(day, chat, persona, request class)`` with its tokens (input, cached,
+output), image count, TTS characters and an estimated cost in USD. Totals
+are kept in memory and written to ``USAGE_DIR/<persona>/<day>.json`` by
+:func:`flush`; :func:`load` picks today's totals up again after a restart.
+
+A chat that has spent USAGE_SOFT_BUDGET_USD today is answered by
+USAGE_DOWNGRADE_MODEL and gets no nudge images; past USAGE_HARD_BUDGET_USD
+it also gets no unmentioned chime-ins. Prices are estimates for budgeting,
+not billing.
+"""
+
+import json
+import logging
+import os
+from datetime import date
+
+USAGE_DIR = os.getenv("USAGE_DIR", "usage")
+PERSONA = os.getenv("BOT_USERNAME", "") or "telebot"
+USAGE_FLUSH_SECONDS = 60
+USAGE_SOFT_BUDGET_USD = float(os.getenv("USAGE_SOFT_BUDGET_USD", "0"))  # per chat and day, 0 = none
+USAGE_HARD_BUDGET_USD = float(os.getenv("USAGE_HARD_BUDGET_USD", "0"))
+USAGE_DOWNGRADE_MODEL = os.getenv("USAGE_DOWNGRADE_MODEL", "gpt-4.1-mini")
+
+# USD per million tokens: (input, cached input, output)
+TOKEN_PRICES = {
+    "gpt-5.1": (1.25, 0.125, 10.0),
+    "gpt-5": (1.25, 0.125, 10.0),
+    "gpt-5-mini": (0.25, 0.025, 2.0),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+}
+DEFAULT_TOKEN_PRICE = TOKEN_PRICES["gpt-5.1"]
+IMAGE_PRICES = {"low": 0.011, "medium": 0.042, "high": 0.167}  # USD per 1024x1024 image
+TTS_PRICE_PER_1K_CHARS = 0.30
+
+COUNTERS = (
+    "requests", "input_tokens", "cached_tokens", "output_tokens",
+    "images", "tts_chars", "vision_uploads", "cost_usd",
+)
+
+# (day, chat, persona, request class) -> counters; chat is "shared" for work
+# done ahead of time for all chats (the picture of the day caption prefetch)
+_totals: dict[tuple[str, str, str, str], dict[str, float]] = {}
+_dirty = False
+
+
+def _today() -> str:
+    return date.today().isoformat()
+
+
+def _chat_key(chat_id: int | None) -> str:
+    return "shared" if chat_id is None else str(chat_id)
+
+
+def _count(value) -> int:
+    return value if isinstance(value, int) else 0
+
+
+def _token_cost(model: str | None, input_tokens: int, cached: int, output: int) -> float:
+    price_in, price_cached, price_out = TOKEN_PRICES.get(model or "", DEFAULT_TOKEN_PRICE)
+    uncached = max(0, input_tokens - cached)
+    return (uncached * price_in + cached * price_cached + output * price_out) / 1_000_000
+
+
+def record(
+    chat_id: int | None,
+    request_class: str,
+    *,
+    model: str | None = None,
+    requests: int = 0,
+    input_tokens: int = 0,
+    cached_tokens: int = 0,
+    output_tokens: int = 0,
+    images: int = 0,
+    image_quality: str | None = None,
+    tts_chars: int = 0,
+    vision_uploads: int = 0,
+) -> None:
+    """Add one piece of work to today's totals for ``chat_id``."""
+    global _dirty
+    cost = _token_cost(model, input_tokens, cached_tokens, output_tokens)
+    cost += images * IMAGE_PRICES.get(image_quality or "medium", IMAGE_PRICES["medium"])
+    cost += tts_chars / 1000 * TTS_PRICE_PER_1K_CHARS
+    key = (_today(), _chat_key(chat_id), PERSONA, request_class)
+    entry = _totals.setdefault(key, dict.fromkeys(COUNTERS, 0))
+    for name, value in (
+        ("requests", requests), ("input_tokens", input_tokens), ("cached_tokens", cached_tokens),
+        ("output_tokens", output_tokens), ("images", images), ("tts_chars", tts_chars),
+        ("vision_uploads", vision_uploads), ("cost_usd", cost),
+    ):
+        entry[name] += value
+    _dirty = True
+
+
+def record_usage(chat_id: int | None, request_class: str, model: str | None, usage) -> None:
+    """Record an Agents SDK ``Usage`` or OpenAI ``ResponseUsage`` object."""
+    if usage is None:
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    requests = getattr(usage, "requests", 1)
+    record(
+        chat_id,
+        request_class,
+        model=model,
+        requests=requests if isinstance(requests, int) else 1,
+        input_tokens=_count(getattr(usage, "input_tokens", 0)),
+        cached_tokens=_count(getattr(details, "cached_tokens", 0)),
+        output_tokens=_count(getattr(usage, "output_tokens", 0)),
+    )
+
+
+def spent_today(chat_id: int) -> float:
+    """Return today's estimated cost in USD for ``chat_id``."""
+    day, chat = _today(), _chat_key(chat_id)
+    return sum(e["cost_usd"] for (d, c, _, _), e in _totals.items() if d == day and c == chat)
+
+
+def budget_state(chat_id: int | None) -> str:
+    """Return ``"ok"``, ``"soft"`` or ``"hard"`` for the chat's spend today."""
+    if chat_id is None or not (USAGE_SOFT_BUDGET_USD or USAGE_HARD_BUDGET_USD):
+        return "ok"
+    spent = spent_today(chat_id)
+    if USAGE_HARD_BUDGET_USD and spent >= USAGE_HARD_BUDGET_USD:
+        return "hard"
+    if USAGE_SOFT_BUDGET_USD and spent >= USAGE_SOFT_BUDGET_USD:
+        return "soft"
+    return "ok"
+
+
+def summary(chat_id: int | None = None) -> dict[str, dict[str, float]]:
+    """Return today's totals per request class, for one chat or all of them."""
+    day = _today()
+    result: dict[str, dict[str, float]] = {}
+    for (d, chat, _, request_class), entry in _totals.items():
+        if d != day or (chat_id is not None and chat != _chat_key(chat_id)):
+            continue
+        total = result.setdefault(request_class, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            total[name] += entry[name]
+    return result
+
+
+def _day_path(day: str) -> str:
+    return os.path.join(USAGE_DIR, PERSONA, f"{day}.json")
+
+
+def flush() -> None:
+    """Write the totals of every day in memory to disk and forget past days."""
+    global _dirty
+    if not _dirty:
+        return
+    by_day: dict[str, list[dict]] = {}
+    for (day, chat, persona, request_class), entry in _totals.items():
+        by_day.setdefault(day, []).append(
+            {"chat": chat, "persona": persona, "class": request_class, **entry}
+        )
+    os.makedirs(os.path.join(USAGE_DIR, PERSONA), exist_ok=True)
+    for day, entries in by_day.items():
+        path = _day_path(day)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"[usage] Failed to write {path}: {e}")
+            return
+    today = _today()
+    for key in [k for k in _totals if k[0] != today]:
+        del _totals[key]
+    _dirty = False
+
+
+def load() -> None:
+    """Read today's totals back from disk, e.g. after a restart."""
+    day = _today()
+    try:
+        with open(_day_path(day), "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return
+    for item in entries:
+        key = (day, item["chat"], item["persona"], item["class"])
+        _totals[key] = {name: item.get(name, 0) for name in COUNTERS}